@@ -0,0 +1,113 @@
+#!/usr/bin/python
+
+"""
+Cost of the aggregation of one bucket (1h of 5-minute entries)
+on synthetic data: the per-entry Python loop (aggregate.aggregate_bucket,
+called for every bucket) and the vectorized kernel
+(aggregate.aggregate_entries, called for a chunk of buckets),
+and which of them aggregate.aggregate_chunk uses (see KERNEL_MIN_KEYS).
+
+Usage:
+
+    bench_aggregate.py
+
+Environment: DAYS (365 by default) of data, CURRENCIES (170) columns.
+The data is generated and aggregated chunk by chunk;
+MongoDB is not used.
+"""
+
+import os
+import random
+import sys
+import time
+
+MYDIR = os.path.abspath(os.path.dirname(os.path.dirname("__file__")))
+sys.path.append(f"{MYDIR}/lib/")
+
+from aggregate import (
+    INTERVAL,
+    KERNEL_MIN_KEYS,
+    KEYS,
+    ROLLUP_CHUNK,
+    aggregate_bucket,
+    aggregate_entries,
+)
+
+DAYS = int(os.environ.get("DAYS", 365))
+CURRENCIES = int(os.environ.get("CURRENCIES", 170))
+
+STEP = 300
+INTERVAL_SIZE = INTERVAL["1h"]
+
+
+def generate(keys, time_start, time_end, state):
+    """
+    Random walk of ``keys`` from _time_start_ to _time_end_ (5-minute entries)
+    """
+
+    entries = []
+    for timestamp in range(time_start, time_end, STEP):
+        entry = {"timestamp": timestamp}
+        for key in keys:
+            if key == "rank":
+                state[key] = max(1, state.get(key, 10) + random.choice([-1, 0, 0, 1]))
+            else:
+                state[key] = state.get(key, 100.0) * random.uniform(0.99, 1.01)
+            entry[key] = state[key]
+        entries.append(entry)
+    return entries
+
+
+def bench(keys):
+    """
+    Time (s) of the loop and of the kernel, and the number of buckets
+    """
+
+    random.seed(0)
+    state = {}
+    times = [0.0, 0.0]
+    buckets = 0
+    time_start = 0
+    while time_start < DAYS * 24 * 3600:
+        time_end = min(time_start + ROLLUP_CHUNK, DAYS * 24 * 3600)
+        entries = generate(keys, time_start, time_end, state)
+        per_bucket = INTERVAL_SIZE // STEP
+        bucket_entries = [
+            entries[i : i + per_bucket] for i in range(0, len(entries), per_bucket)
+        ]
+
+        start = time.perf_counter()
+        expected = [aggregate_bucket(x, keys) for x in bucket_entries]
+        times[0] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = aggregate_entries(entries, keys, time_start, INTERVAL_SIZE)
+        times[1] += time.perf_counter() - start
+
+        if expected != result:
+            raise RuntimeError(f"kernel result differs at {time_start}")
+
+        buckets += len(bucket_entries)
+        time_start = time_end
+    return times, buckets
+
+
+def main():
+    datasets = [
+        ("coins", KEYS),
+        ("currencies", [f"C{i:03d}" for i in range(CURRENCIES)]),
+    ]
+    print(f"{DAYS} days, 1h buckets, us per bucket")
+    print(f"{'data':<12} {'keys':>5} {'buckets':>8} {'loop':>10} {'kernel':>10} used")
+    for name, keys in datasets:
+        times, buckets = bench(keys)
+        loop, kernel = (x / buckets * 1e6 for x in times)
+        used = "kernel" if len(keys) >= KERNEL_MIN_KEYS else "loop"
+        print(
+            f"{name:<12} {len(keys):>5} {buckets:>8}"
+            f" {loop:>10.1f} {kernel:>10.1f} {used}"
+        )
+
+
+if __name__ == "__main__":
+    main()
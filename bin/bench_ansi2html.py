@@ -0,0 +1,88 @@
+#!/usr/bin/python
+
+"""
+Compare share/ansi2html.sh with the in-process converter (lib/ansi2html.py)
+on the first page and on a chart page.
+
+Usage:
+
+    bench_ansi2html.py [FILE...]
+
+Without arguments, the pages are rendered from the database;
+otherwise FILEs with the ANSI pages are used.
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+MYDIR = os.path.abspath(os.path.dirname(os.path.dirname("__file__")))
+sys.path.append(f"{MYDIR}/lib/")
+
+from globals import ANSI2HTML
+from ansi2html import ansi2html
+
+ROUNDS = int(os.environ.get("ROUNDS", 20))
+
+
+def load_pages():
+    """
+    Pages to convert: (name, ANSI text)
+    """
+
+    if len(sys.argv) > 1:
+        pages = []
+        for filename in sys.argv[1:]:
+            with open(filename, "r", encoding="utf-8") as page_file:
+                pages.append((os.path.basename(filename), page_file.read()))
+        return pages
+
+    import draw
+    import view
+
+    config = {
+        "number_of_ticks": 12,
+        "number_of_coins": 10,
+        "currency": "USD",
+    }
+    return [("firstpage", view.show(config)), ("btc", draw.view("btc"))]
+
+
+def run_script(data):
+    return subprocess.run(
+        ["bash", ANSI2HTML, "--palette=xterm", "--bg=dark"],
+        input=data.encode("utf-8"),
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout.decode("utf-8")
+
+
+def measure(func, data):
+    """
+    Average time (in ms) of ``func(data)`` and its result
+    """
+
+    result = func(data)
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        func(data)
+    return (time.perf_counter() - start) * 1000 / ROUNDS, result
+
+
+def main():
+    print(
+        f"{'page':<12} {'size':>8} {'script, ms':>12} {'python, ms':>12} "
+        f"{'speedup':>8}  same"
+    )
+    for name, data in load_pages():
+        script_time, script_result = measure(run_script, data)
+        python_time, python_result = measure(ansi2html, data)
+        print(
+            f"{name:<12} {len(data):>8} {script_time:>12.2f} {python_time:>12.2f} "
+            f"{script_time / python_time:>7.1f}x  {script_result == python_result}"
+        )
+
+
+if __name__ == "__main__":
+    main()
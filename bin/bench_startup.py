@@ -0,0 +1,92 @@
+#!/usr/bin/python
+
+"""
+Cold start time of the entry points: time of the imports
+and of the first request, measured in a new process.
+
+Usage:
+
+    bench_startup.py [ENTRY_POINT...]
+
+Entry points: srv, show_data, aggregate (all by default).
+The first request needs MongoDB; if it is not available,
+the error is reported instead of the time.
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+MYDIR = os.path.abspath(os.path.dirname(os.path.dirname("__file__")))
+
+ROUNDS = int(os.environ.get("ROUNDS", 5))
+
+# entry point: (modules imported at start, the first request)
+ENTRY_POINTS = {
+    "srv": (
+        ["gevent.pywsgi", "flask", "cmd_wrapper"],
+        "cmd_wrapper.cmd_wrapper('btc', 'rate.sx', {}, False)",
+    ),
+    "show_data": (
+        ["view"],
+        "view.show({'number_of_coins': 10})",
+    ),
+    "aggregate": (
+        ["aggregate"],
+        "aggregate.get_aggregated_coin('BTC', time.time() - 24 * 3600, time.time(), 80)",
+    ),
+}
+
+CHILD = """
+import importlib, json, sys, time
+sys.path.append("{mydir}/lib/")
+start = time.perf_counter()
+for name in {modules!r}:
+    importlib.import_module(name)
+    globals()[name.split(".")[0]] = sys.modules[name.split(".")[0]]
+imported = time.perf_counter()
+result = {{"import": (imported - start) * 1000, "first": None, "error": None}}
+try:
+    {request}
+    result["first"] = (time.perf_counter() - imported) * 1000
+except Exception as e_msg:
+    result["error"] = str(e_msg).splitlines()[0][:60]
+print(json.dumps(result))
+"""
+
+
+def measure(modules, request):
+    """
+    Import and first request time (ms) in a new process
+    """
+
+    code = CHILD.format(mydir=MYDIR, modules=modules, request=request)
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=MYDIR,
+        stdout=subprocess.PIPE,
+        check=True,
+        timeout=120,
+    ).stdout.decode("utf-8")
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    names = sys.argv[1:] or list(ENTRY_POINTS)
+    print(f"{'entry point':<12} {'import, ms':>12} {'first request, ms':>18}")
+    for name in names:
+        modules, request = ENTRY_POINTS[name]
+        results = [measure(modules, request) for _ in range(ROUNDS)]
+        import_time = statistics.median(x["import"] for x in results)
+        first_times = [x["first"] for x in results if x["first"] is not None]
+        if first_times:
+            first = f"{statistics.median(first_times):>18.1f}"
+        else:
+            first = f"{'error: ' + results[-1]['error']:>18}"
+        print(f"{name:<12} {import_time:>12.1f} {first}")
+
+
+if __name__ == "__main__":
+    main()
@@ -59,10 +59,10 @@ import requests
 MYDIR = os.path.abspath(os.path.dirname(os.path.dirname("__file__")))
 sys.path.append("%s/lib/" % MYDIR)
 
-from pymongo import MongoClient
+from mng import get_client, MongoReader, MongoWriter
+from rollup import update_rollups
 
-mongo_host = os.environ.get("MONGO_HOST", "localhost")
-client = MongoClient(host=mongo_host)
+client = get_client()
 
 logging.basicConfig(
     format="%(asctime)s %(levelname)-8s %(message)s",
@@ -111,6 +111,18 @@ def log(s):
     logging.error(s)
 
 
+def update_aggregated(entries, currencies=False):
+    """
+    Fold the collected entries into the aggregated collections
+    (if it fails, the batch aggregation repairs them)
+    """
+
+    try:
+        update_rollups(entries, currencies=currencies)
+    except Exception as e:
+        log("updating aggregated data: %s" % e)
+
+
 def fetch_coins(token):
 
     url = "https://pro-api.coinmarketcap.com/v1/cryptocurrency/listings/latest?start=1&limit=600&convert=USD"
@@ -398,6 +410,7 @@ elif command == "currencies":
     currencies_data = fetch_currencies(token=config["fixer"])
     # print json.dumps(currencies_data, indent=4)
     currencies.insert_one(currencies_data)
+    update_aggregated([currencies_data], currencies=True)
 
 elif command == "coins":
 
@@ -408,3 +421,13 @@ elif command == "coins":
         # pass
         # print json.dumps(data, indent=4)
         coins.insert_many(coins_data)
+        update_aggregated(coins_data)
+
+        # precompute the first page, so it can be loaded with one query
+        mongo_reader = MongoReader(
+            {"number_of_coins": len(coins_data), "currency": "USD"}
+        )
+        firstpage = mongo_reader.build_firstpage(
+            coins_data[0]["timestamp"], entries=coins_data
+        )
+        MongoWriter().update(firstpage, "firstpage")
@@ -15,7 +15,7 @@ import sys
 import logging
 import os
 import re
-import requests
+import signal
 import socket
 import subprocess
 import time
@@ -23,10 +23,14 @@ import traceback
 import dateutil.parser
 import json
 import datetime
+import hmac
+import importlib
+import math
 
 import jinja2
 from flask import (
     Flask,
+    g,
     request,
     render_template,
     send_from_directory,
@@ -48,9 +52,50 @@ SKIP_LOGGING_FOR_THIS_IPS = set(
     ]
 )
 
-from globals import FILE_QUERIES_LOG, LOG_FILE, TEMPLATES, STATIC, log, error
-from cmd_wrapper import cmd_wrapper
+from globals import (
+    CACHE_DIR,
+    FILE_QUERIES_LOG,
+    LOG_FILE,
+    METRICS_ALLOWED_IPS,
+    METRICS_TOKEN,
+    TEMPLATES,
+    STATIC,
+    QUERIES_LOG_QUEUE_SIZE,
+    QUERIES_LOG_BATCH_SIZE,
+    QUERIES_LOG_FLUSH_INTERVAL,
+    QUERIES_LOG_MAX_BYTES,
+    QUERIES_LOG_BACKUPS,
+    RATE_LIMITS,
+    RATE_LIMIT_MAX_CLIENTS,
+    SERVER_PORT,
+    SERVER_WORKERS,
+    SERVER_GRACEFUL_TIMEOUT,
+    WARMUP_CONCURRENCY,
+    WARMUP_KEYS,
+    WARMUP_LOG_BYTES,
+    WARMUP_TOP_K,
+    log,
+    error,
+)
+from cmd_wrapper import (
+    RENDER_POOL,
+    RESPONSE_CACHE,
+    SINGLE_FLIGHT,
+    cmd_wrapper,
+    get_etag,
+    get_route_class,
+    get_stale_output,
+    is_overloaded,
+)
+from compression import choose_encoding
+from metrics import METRICS
+from mng import pool_stats
 from parse_query import parse_query
+from prefork import PreforkServer
+from query_log import QueryLog
+from rate_limit import RateLimiter
+from warmup import Warmup
+from tick_buffer import TICK_INTERVAL
 
 if not os.path.exists(os.path.dirname(LOG_FILE)):
     os.makedirs(os.path.dirname(LOG_FILE))
@@ -66,6 +111,33 @@ my_loader = jinja2.ChoiceLoader(
 )
 app.jinja_loader = my_loader
 
+QUERY_LOG = QueryLog(
+    FILE_QUERIES_LOG,
+    queue_size=QUERIES_LOG_QUEUE_SIZE,
+    batch_size=QUERIES_LOG_BATCH_SIZE,
+    flush_interval=QUERIES_LOG_FLUSH_INTERVAL,
+    max_bytes=QUERIES_LOG_MAX_BYTES,
+    backups=QUERIES_LOG_BACKUPS,
+)
+
+WARMUP = Warmup(
+    WARMUP_KEYS,
+    FILE_QUERIES_LOG,
+    os.path.join(CACHE_DIR, "warmup.lock"),
+    top_k=WARMUP_TOP_K,
+    log_bytes=WARMUP_LOG_BYTES,
+    concurrency=WARMUP_CONCURRENCY,
+)
+
+RATE_LIMITER = RateLimiter(RATE_LIMITS, max_clients=RATE_LIMIT_MAX_CLIENTS)
+
+# modules that are imported on the first use; in the pre-fork mode
+# they are imported before fork, so the workers share them
+PRELOAD_MODULES = ["dateparser", "babel.numbers", "terminaltables", "diagram"]
+
+# how long the clients should wait when the server is overloaded (seconds)
+OVERLOAD_RETRY_AFTER = 5
+
 
 def is_html_needed(user_agent):
     plaintext_clients = [
@@ -81,6 +153,18 @@ def is_html_needed(user_agent):
     return True
 
 
+@app.before_request
+def start_request():
+    METRICS.in_flight += 1
+    g.started = time.perf_counter()
+
+
+@app.teardown_request
+def finish_request(exception=None):
+    METRICS.in_flight -= 1
+    METRICS.observe("request", time.perf_counter() - g.started)
+
+
 @app.route("/files/<path:path>")
 def send_static(path):
     return send_from_directory(STATIC, path)
@@ -96,16 +180,125 @@ def send_malformed():
     return send_from_directory(STATIC, "malformed-response.html")
 
 
-def log_query(ip, hostname, topic, user_agent):
-    log_entry = "%s %s %s %s %s" % (
+def collect_gauges():
+    """
+    Current state of the caches, pools and of the queries log for /:metrics
+    """
+
+    variants = RESPONSE_CACHE.variant_stats()
+    gauges = [
+        (
+            "cache_hit_ratio",
+            "Responses cache hit ratio",
+            [({"variant": name}, x["hit_ratio"]) for name, x in variants.items()],
+        ),
+        (
+            "cache_requests",
+            "Responses cache lookups",
+            [
+                ({"variant": name, "result": result}, x[result])
+                for name, x in variants.items()
+                for result in ("hits", "misses")
+            ],
+        ),
+    ]
+    for name, stats in [
+        ("cache", RESPONSE_CACHE.stats()),
+        ("single_flight", SINGLE_FLIGHT.stats()),
+        ("render_pool", RENDER_POOL.stats()),
+        ("mongo_pool", pool_stats()),
+        ("query_log", QUERY_LOG.stats()),
+        ("warmup", WARMUP.stats()),
+    ]:
+        gauges.append(
+            (
+                name,
+                f"{name.replace('_', ' ').capitalize()} counters",
+                [
+                    ({"counter": key}, value)
+                    for key, value in stats.items()
+                    if isinstance(value, (int, float))
+                ],
+            )
+        )
+    gauges.append(
+        (
+            "rate_limit",
+            "Rate limited and allowed queries",
+            [
+                ({"route_class": route_class, "result": result}, value)
+                for route_class, x in RATE_LIMITER.stats().items()
+                for result, value in x.items()
+            ],
+        )
+    )
+    return gauges
+
+
+def is_metrics_allowed():
+    """
+    True if the client can read /:metrics: it has the token (if it is configured)
+    or it is connected from an allowed address directly, not via the proxy
+    """
+    if METRICS_TOKEN:
+        return hmac.compare_digest(
+            request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"
+        )
+    if request.headers.get("X-Forwarded-For") or request.headers.get("X-Real-IP"):
+        return False
+    return request.remote_addr in METRICS_ALLOWED_IPS
+
+
+@app.route("/:metrics")
+def send_metrics():
+    if not is_metrics_allowed():
+        return make_response("Not found\n", 404)
+    response = make_response(METRICS.render(collect_gauges()))
+    response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return response
+
+
+def log_query(ip, hostname, topic, user_agent, status):
+    if ip in SKIP_LOGGING_FOR_THIS_IPS:
+        return
+    log_entry = "%s %s %s %s %s %s" % (
         datetime.datetime.now(),
         ip,
         hostname,
         topic,
         user_agent,
+        status,
     )
-    with open(FILE_QUERIES_LOG, "a") as my_file:
-        my_file.write(log_entry + "\n")
+    QUERY_LOG.write(log_entry)
+
+
+def is_not_modified(etag, epoch):
+    """
+    True if the client has the current version of the answer
+    (``If-None-Match`` or ``If-Modified-Since``)
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since:
+        return request.if_modified_since.timestamp() >= int(epoch)
+    return False
+
+
+def error_response(text, status, retry_after):
+    response = make_response(text, status)
+    response.headers["Retry-After"] = str(math.ceil(retry_after))
+    return response
+
+
+def set_validators(response, etag, epoch):
+    """
+    ETag, Last-Modified and Cache-Control (until the next data collection)
+    """
+    response.set_etag(etag)
+    response.last_modified = datetime.datetime.fromtimestamp(
+        int(epoch), tz=datetime.timezone.utc
+    )
+    response.cache_control.max_age = int(TICK_INTERVAL - time.time() % TICK_INTERVAL)
 
 
 @app.route("/", methods=["GET"])
@@ -125,7 +318,8 @@ def answer(topic=None):
 
     user_agent = request.headers.get("User-Agent", "").lower()
     html_needed = is_html_needed(user_agent)
-    options = parse_query(request.args)
+    with METRICS.timer("parse"):
+        options = parse_query(request.args)
     hostname = request.headers["Host"]
 
     if request.headers.getlist("X-Forwarded-For"):
@@ -138,16 +332,65 @@ def answer(topic=None):
     if topic is None:
         topic = ":firstpage"
 
-    answer = cmd_wrapper(
-        topic,
-        hostname=hostname,
-        request_options=options,
-        html=is_html_needed(user_agent),
-    )
-
-    if ip not in SKIP_LOGGING_FOR_THIS_IPS:
-        log_query(ip, hostname, topic, user_agent)
-    return answer
+    # /:json/TOPIC is the same as /TOPIC?format=json
+    if topic == ":json" or topic.startswith(":json/"):
+        topic = topic[len(":json/") :] or ":firstpage"
+        options["format"] = "json"
+
+    encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+    etag, epoch = get_etag(topic, hostname, options, html_needed, encoding)
+    route_class = "hit" if etag is not None else get_route_class(topic)
+
+    wait = RATE_LIMITER.check(ip, route_class)
+    if wait:
+        response = error_response(
+            "Too many queries. Please wait a bit and try again\n", 429, wait
+        )
+        log_query(ip, hostname, topic, user_agent, response.status_code)
+        return response
+
+    stale = None
+    if route_class != "hit" and is_overloaded():
+        # the new answer is not rendered, the previous one is served if possible
+        stale = get_stale_output(topic, hostname, options, html_needed, encoding)
+        if stale is None:
+            response = error_response(
+                "Server is overloaded. Please try again later\n",
+                503,
+                OVERLOAD_RETRY_AFTER,
+            )
+            log_query(ip, hostname, topic, user_agent, response.status_code)
+            return response
+
+    if stale is not None:
+        response = make_response(stale)
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+    elif etag is not None and is_not_modified(etag, epoch):
+        response = make_response("", 304)
+    else:
+        answer = cmd_wrapper(
+            topic,
+            hostname=hostname,
+            request_options=options,
+            html=html_needed,
+            encoding=encoding,
+        )
+        response = make_response(answer)
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+        # the answer is cached now (if it can be cached at all)
+        etag, epoch = get_etag(topic, hostname, options, html_needed, encoding)
+
+    log_query(ip, hostname, topic, user_agent, response.status_code)
+
+    if etag is not None:
+        set_validators(response, etag, epoch)
+    if options.get("format") == "json" and response.status_code == 200:
+        response.mimetype = "application/json"
+    # the answer depends on the user agent too (HTML or text)
+    response.headers["Vary"] = "Accept-Encoding, User-Agent"
+    return response
 
 
 import traceback
@@ -159,5 +402,21 @@ def internal_error(exception):
     print(traceback.format_exc())
 
 
-server = WSGIServer(("", 8004), app)  # log=None)
-server.serve_forever()
+if SERVER_WORKERS > 1:
+    # all modules are imported at this point and are shared by the workers
+    for module in PRELOAD_MODULES:
+        importlib.import_module(module)
+    PreforkServer(
+        ("", SERVER_PORT),
+        app,
+        workers=SERVER_WORKERS,
+        graceful_timeout=SERVER_GRACEFUL_TIMEOUT,
+        on_worker_start=WARMUP.start,
+        on_worker_exit=QUERY_LOG.close,
+    ).serve_forever()
+else:
+    server = WSGIServer(("", SERVER_PORT), app)  # log=None)
+    gevent.signal_handler(signal.SIGTERM, lambda: gevent.spawn(server.stop))
+    WARMUP.start()
+    server.serve_forever()
+    QUERY_LOG.close()
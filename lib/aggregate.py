@@ -24,7 +24,13 @@ all of that (except "coin"), in turn, has the following aggragated data:
     'end',
     'time_end',
     'time_min',
-    'time_max'
+    'time_max',
+    'avg',
+    'sum',
+    'count'
+
+('sum' and 'count' of the present values, so the open buckets can be
+continued at ingest time; see rollup.py).
 
 The whole entry has additional fields:
 
@@ -97,25 +103,58 @@ Example of an entry:
             "symbol" : "BTC"
     }
 
+The entries are maintained at ingest time: the collector folds every tick
+into the open buckets (see rollup.py). This module rebuilds and repairs them.
+
+The entries are rebuilt by the rollup engine (``rollup_coins()``):
+one aggregation pipeline pass buckets the raw data of all coins
+by symbol and hour (the buckets are aligned to the interval,
+the bucket timestamp is the timestamp of its first entry)
+and merges the result into coins_1h on the server side.
+Currencies are rolled up in the same way (``rollup_currencies()``)
+and written with bulk upserts.
+
 """
 
+import datetime
+import itertools
 import logging
 import math
+import multiprocessing
 import os
+import sys
+import time
+from queue import Empty
+
+import numpy as np
 
 from currencies_names import currency_name
 from coins_names import COINS_NAMES
 
 from mng import MongoReader, MongoWriter
+from rollup import INTERVAL, KEYS
 
 MONGO_READER = MongoReader()
 MONGO_WRITER = MongoWriter()
-INTERVAL = {
-    "1h": 1 * 3600,
-}
-#    '24h':      24*3600,
 DEBUG_LEVEL = 0
 
+# default number of the aggregation runner processes
+WORKERS = int(os.environ.get("AGGREGATE_WORKERS", 4))
+
+# with fewer keys, the per-entry loop aggregates a bucket faster than
+# the vectorized kernel (see bin/bench_aggregate.py, 28 days): 6 coins keys,
+# 11.7us vs 29.1us per bucket; 48 currencies, 92.5us vs 88.0us;
+# 170 currencies, 378us vs 371us
+KERNEL_MIN_KEYS = 48
+
+# the aggregation runner gives up, if there is no progress for that long
+# (seconds): a worker process was killed and its shard is never finished
+RUNNER_TIMEOUT = int(os.environ.get("AGGREGATE_TIMEOUT", 600))
+
+# the rollup processes the raw data by chunks of that size (one pipeline pass
+# per chunk), so a backfill does not have to group the whole history at once
+ROLLUP_CHUNK = 7 * 24 * 3600
+
 MYDIR = os.path.abspath(os.path.dirname(os.path.dirname("__file__")))
 LOGFILE = f"{MYDIR}/log/aggregate.log"
 logging.basicConfig(
@@ -134,135 +173,167 @@ def _log_error(message):
     logging.error(message)
 
 
-def _get_entries(coin, start_time, end_time):
-    data = MONGO_READER.get_raw_data(coin, start_time, end_time)
-    return data
-
-
-def aggregate_coin(coin, time_start, interval):
+def aggregate_entries(entries, keys, time_start=None, interval_size=None):
     """
-    Aggregate 5min _coin_ data starting from _start_time_
-    for _interval_ (in seconds; must be divisible by 5m)
-    and return aggregated information (dictionary).
-
-    Fields of the result: min, max, avg, begin, end
+    Aggregate ``keys`` of ``entries`` (sorted by timestamp) in one vectorized
+    pass. The entries are split into _interval_size_ buckets starting
+    from _time_start_ (one bucket, if ``interval_size`` is not specified).
+
+    Return the list of the aggregated entries of the non-empty buckets:
+    timestamp, time_end, number_of_aggregated and, for each of the keys,
+    min, max, begin, end, time_min, time_max, avg and the sum and the count
+    of the present values. Missing values of a key are skipped.
     """
 
-    time_end = time_start + interval
-    entries = list(_get_entries(coin, time_start, time_end))
+    number_of_entries = len(entries)
+    values = np.array([list(map(entry.get, keys)) for entry in entries], dtype=float)
 
-    if not entries:
-        _log(f"no entries for interval: {coin} {time_start} {time_end}")
-        return
+    if interval_size:
+        timestamps = np.array([entry["timestamp"] for entry in entries], dtype=float)
+        buckets = (timestamps - time_start) // interval_size
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    else:
+        starts = np.zeros(1, dtype=int)
+    sizes = np.diff(np.r_[starts, number_of_entries])
+
+    # entries of the buckets: (bucket, position in the bucket, key)
+    owner = np.repeat(np.arange(len(starts)), sizes)
+    position = np.arange(number_of_entries) - starts[owner]
+    table = np.full((len(starts), sizes.max(), len(keys)), np.nan)
+    table[owner, position] = values
+    missing = np.isnan(table)
+
+    # argmin/argmax return the first occurrence, as the strict comparison does
+    index_min = np.where(missing, np.inf, table).argmin(axis=1) + starts[:, None]
+    index_max = np.where(missing, -np.inf, table).argmax(axis=1) + starts[:, None]
+
+    # summed position by position, in the same order as sum() does
+    present = np.where(missing, 0.0, table)
+    sums = np.zeros((len(starts), len(keys)))
+    for column in range(table.shape[1]):
+        sums += present[:, column]
+    counts = (~missing).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        averages = sums / counts
+
+    # the values are taken from the entries and not from the table,
+    # to keep their types
+    result = []
+    times = [entry.get("timestamp") for entry in entries]
+    index_min, index_max = index_min.tolist(), index_max.tolist()
+    averages, sums, counts = averages.tolist(), sums.tolist(), counts.tolist()
+    for bucket, (start, size) in enumerate(zip(starts.tolist(), sizes.tolist())):
+        first, last = entries[start], entries[start + size - 1]
+        aggregated = {
+            "timestamp": times[start],
+            "time_end": times[start + size - 1],
+            "number_of_aggregated": size,
+        }
+        for key, i_min, i_max, avg, sum_, count in zip(
+            keys,
+            index_min[bucket],
+            index_max[bucket],
+            averages[bucket],
+            sums[bucket],
+            counts[bucket],
+        ):
+            aggregated[key] = {
+                "min": entries[i_min].get(key),
+                "max": entries[i_max].get(key),
+                "begin": first.get(key),
+                "end": last.get(key),
+                "time_min": times[i_min],
+                "time_max": times[i_max],
+                "avg": avg if count else None,
+                "sum": sum_,
+                "count": count,
+            }
+        result.append(aggregated)
 
-    keys = [
-        "rank",
-        "price_usd",
-        "24h_volume_usd",
-        "market_cap_usd",
-        "available_supply",
-        "total_supply",
-    ]
+    return result
+
+
+def aggregate_bucket(entries, keys):
+    """
+    Aggregate ``keys`` of ``entries`` (sorted by timestamp) of one bucket
+    with the per-entry loop. The result is the same as of aggregate_entries();
+    the loop is faster when there are only a few keys (see KERNEL_MIN_KEYS).
+    """
 
+    first, last = entries[0], entries[-1]
     result = {
-        "symbol": coin,
-        "timestamp": entries[0].get("timestamp"),
-        "time_end": entries[-1].get("timestamp"),
+        "timestamp": first.get("timestamp"),
+        "time_end": last.get("timestamp"),
         "number_of_aggregated": len(entries),
     }
-
     for key in keys:
-
-        aggregated = {
-            "min": entries[0].get(key),
-            "max": entries[0].get(key),
-            "begin": entries[0].get(key),
-            "end": entries[-1].get(key),
-            "time_min": entries[0].get("timestamp"),
-            "time_max": entries[0].get("timestamp"),
-        }
-
+        minimum = maximum = None
+        time_min = time_max = first.get("timestamp")
         sum_ = 0
+        count = 0
         for entry in entries:
             this = entry.get(key)
-            time_this = entry.get("timestamp")
+            if this is None:
+                continue
 
-            if this > aggregated["max"]:
-                aggregated["max"] = this
-                aggregated["time_max"] = time_this
+            if maximum is None or this > maximum:
+                maximum = this
+                time_max = entry.get("timestamp")
 
-            if this < aggregated["min"]:
-                aggregated["min"] = this
-                aggregated["time_min"] = time_this
+            if minimum is None or this < minimum:
+                minimum = this
+                time_min = entry.get("timestamp")
 
             sum_ += this
-        aggregated["avg"] = sum_ / len(entries)
-
-        result[key] = aggregated
-
+            count += 1
+
+        result[key] = {
+            "min": minimum,
+            "max": maximum,
+            "begin": first.get(key),
+            "end": last.get(key),
+            "time_min": time_min,
+            "time_max": time_max,
+            "avg": sum_ / count if count else None,
+            "sum": sum_,
+            "count": count,
+        }
     return result
 
 
-def aggregate_currencies(_, time_start, interval):
+def aggregate_chunk(entries, keys, time_start, interval_size):
+    """
+    Aggregate ``keys`` of ``entries`` (sorted by timestamp) split into
+    _interval_size_ buckets starting from _time_start_, with the kernel
+    (aggregate_entries()) or with the per-entry loop (aggregate_bucket()),
+    whichever is faster for that number of keys
     """
-    ``coin`` is always None; it is used here, because I want to merge aggregation
-    function later.
 
-    Aggregate 5min currencies data starting from _start_time_
-    for _interval_ (in seconds; must be divisible by 5m)
-    and return aggregated information (dictionary).
+    if len(keys) >= KERNEL_MIN_KEYS:
+        return aggregate_entries(entries, keys, time_start, interval_size)
 
-    Fields of the result: min, max, avg, begin, end
-    """
+    return [
+        aggregate_bucket(list(bucket), keys)
+        for _, bucket in itertools.groupby(
+            entries, key=lambda x: (x["timestamp"] - time_start) // interval_size
+        )
+    ]
 
-    time_end = time_start + interval
-    entries = MONGO_READER.get_raw_data(
-        None, time_start, time_end, collection_name="currencies"
-    )
 
-    if not entries:
-        _log(f"no entries for interval: {time_start} {time_end}")
-        return
+def _currencies_keys(entries):
+    """
+    Currencies of ``entries``: all keys that are in any of them
+    (in the order of their first appearance)
+    """
 
-    result = {
-        "timestamp": entries[0].get("timestamp"),
-        "time_end": entries[-1].get("timestamp"),
-        "number_of_aggregated": len(entries),
-    }
-    currencies = [
+    keys = {}
+    for entry in entries:
+        keys.update(dict.fromkeys(entry))
+    return [
         k
-        for k in entries[0].keys()
+        for k in keys
         if not k.startswith("_") and k not in ["timestamp", "last_updated"]
     ]
-    for key in currencies:
-        aggregated = {
-            "min": entries[0].get(key),
-            "max": entries[0].get(key),
-            "begin": entries[0].get(key),
-            "end": entries[-1].get(key),
-            "time_min": entries[0].get("timestamp"),
-            "time_max": entries[0].get("timestamp"),
-        }
-
-        sum_ = 0
-        for entry in entries:
-            this = entry.get(key)
-            time_this = entry.get("timestamp")
-
-            if this > aggregated["max"]:
-                aggregated["max"] = this
-                aggregated["time_max"] = time_this
-
-            if this < aggregated["min"]:
-                aggregated["min"] = this
-                aggregated["time_min"] = time_this
-
-            sum_ += this
-        aggregated["avg"] = sum_ / len(entries)
-
-        result[key] = aggregated
-
-    return result
 
 
 def get_aggregated_coin(
@@ -522,65 +593,112 @@ def get_aggregated_pair(
     }
 
 
-def aggregate_new_entries(coin):
+def _collections(coin, interval_name):
     """
-    Aggregate new entries for ``coin``. If ``coin`` is none, aggregate currencies.
+    Source (raw data) and target collections of ``coin`` (None for currencies)
     """
 
     if coin:
-        aggregation_function = aggregate_coin
-        collection_prefix = "coins_"
-    else:
-        aggregation_function = aggregate_currencies
-        collection_prefix = "currencies_"
+        return None, f"coins_{interval_name}"
+    return "currencies", f"currencies_{interval_name}"
 
-    first_timestamp = MONGO_READER.get_first_timestamp(coin)
-    last_timestamp = MONGO_READER.get_first_timestamp(coin, last=True)
-    if first_timestamp is None or last_timestamp is None:
-        _log_error(f"timestamp is None for {coin}")
-        return
 
-    for interval_name, interval_size in INTERVAL.items():
-        collection_name = collection_prefix + interval_name
+def get_aggregation_range(coin, interval_name):
+    """
+    Raw entries of ``coin`` (None for currencies) to aggregate
+    into ``interval_name`` intervals: (time_start, last_timestamp) or None.
+    Aggregation starts from the checkpoint; without it, from the last
+    aggregated entry or from the first entry, at the start of its interval
+    (the intervals are aligned, as in the rollup and at ingest time).
+    """
+
+    source_collection_name, collection_name = _collections(coin, interval_name)
+
+    last_timestamp = MONGO_READER.get_first_timestamp(
+        coin, last=True, collection_name=source_collection_name
+    )
+    if last_timestamp is None:
+        return None
 
-        last_aggregated_timestamp = MONGO_READER.get_first_timestamp(
+    time_start = MONGO_READER.get_checkpoint(coin, interval_name)
+    if time_start is None:
+        time_start = MONGO_READER.get_first_timestamp(
             coin, last=True, collection_name=collection_name
         )
-        if last_aggregated_timestamp is None:
-            _log(f"[{collection_name}/{coin}] last_aggregated_timestamp is None")
-            last_aggregated_timestamp = first_timestamp
-        _log(
-            "[%s/%s] %s entries to insert/update"
-            % (
-                collection_name,
-                coin,
-                int(
-                    math.ceil(
-                        (last_timestamp - last_aggregated_timestamp)
-                        * 1.0
-                        / interval_size
-                    )
-                ),
-            )
+    if time_start is None:
+        _log(f"[{collection_name}/{coin}] last_aggregated_timestamp is None")
+        time_start = MONGO_READER.get_first_timestamp(
+            coin, collection_name=source_collection_name
         )
+    time_start -= time_start % INTERVAL[interval_name]
+    return time_start, last_timestamp
+
 
-        inserted_entries = 0
-        timestamp = last_aggregated_timestamp
+def _number_of_buckets(time_start, last_timestamp, interval_size):
+    return int((last_timestamp - time_start) // interval_size) + 1
+
+
+def aggregate_range(
+    coin, interval_name, time_start, last_timestamp, progress=None
+):  # pylint: disable=too-many-locals
+    """
+    Aggregate entries of ``coin`` (None for currencies) from _time_start_
+    to _last_timestamp_ into ``interval_name`` intervals, chunk by chunk.
+
+    The intervals are aligned to the interval size. The existing entries
+    of a chunk are replaced. After every chunk is written, the checkpoint
+    is saved (the last interval, that can be incomplete, is aggregated again
+    next time) and ``progress`` is called with the number of the aggregated
+    intervals.
+
+    Return the number of the written entries.
+    """
+
+    interval_size = INTERVAL[interval_name]
+    source_collection_name, collection_name = _collections(coin, interval_name)
+    time_start -= time_start % interval_size
+
+    total = _number_of_buckets(time_start, last_timestamp, interval_size)
+    last_bucket = time_start + (total - 1) * interval_size
+    _log(f"[{collection_name}/{coin}] {total} entries to insert/update")
+
+    # the raw data is loaded and aggregated by chunks of many intervals
+    chunk = max(ROLLUP_CHUNK // interval_size, 1) * interval_size
+
+    inserted_entries = 0
+    timestamp = time_start
+    with MONGO_WRITER.bulk(collection_name) as writer:
         while timestamp <= last_timestamp:
-            # try:
-            entry = aggregation_function(coin, timestamp, interval_size)
-            # except Exception as e_msg:
-            #     _log_error("ERROR: coin: %s: %s: %s" % (coin, time.strftime("%Y-%m-%d %H:%M", time.gmtime(timestamp)), e_msg))
-            #     entry = None
-
-            # import json
-            # print json.dumps(entry)
-
-            # we insert all entries except the last one,
-            # because it is possible that it is not yet completed
-            # therefore we insert entry first, and calculate a new one thereafter
-            if entry:
-                MONGO_WRITER.update(entry, collection_name)
+            entries = MONGO_READER.get_raw_data(
+                coin,
+                timestamp,
+                timestamp + chunk,
+                collection_name=source_collection_name,
+            )
+            if entries:
+                # replace the entries of the chunk (also the unaligned ones)
+                MONGO_WRITER.delete_range(
+                    timestamp,
+                    timestamp + chunk,
+                    [coin] if coin else None,
+                    collection_name,
+                )
+                keys = KEYS if coin else _currencies_keys(entries)
+                aggregated = aggregate_chunk(entries, keys, timestamp, interval_size)
+            else:
+                aggregated = []
+
+            for entry in aggregated:
+                if coin:
+                    entry = dict(symbol=coin, **entry)
+                else:
+                    # the currencies that are not in this interval at all
+                    entry = {
+                        k: v
+                        for k, v in entry.items()
+                        if not isinstance(v, dict) or v["count"]
+                    }
+                writer.update(entry)
                 inserted_entries += 1
                 if (
                     entry["number_of_aggregated"] != interval_size / 300
@@ -595,8 +713,526 @@ def aggregate_new_entries(coin):
                             entry["number_of_aggregated"],
                         )
                     )
-            timestamp += interval_size
-        _log(f"[{collection_name}/{coin}] Updated {inserted_entries} entries")
+
+            errors = writer.errors
+            writer.flush()
+            if writer.errors > errors:
+                # the checkpoint is not moved, the chunk is written again next time
+                raise RuntimeError(
+                    f"[{collection_name}/{coin}] {writer.errors - errors} write errors"
+                )
+
+            buckets = _number_of_buckets(
+                timestamp, min(timestamp + chunk - 1, last_timestamp), interval_size
+            )
+            timestamp += chunk
+            MONGO_WRITER.save_checkpoint(
+                coin, interval_name, min(timestamp, last_bucket)
+            )
+            if progress:
+                progress(buckets)
+
+    _log(
+        f"[{collection_name}/{coin}] Updated {inserted_entries} entries: "
+        f"{writer.batches} batches"
+    )
+    return inserted_entries
+
+
+#
+# parallel aggregation runner
+#
+
+# progress messages of the worker processes
+_PROGRESS_QUEUE = None
+
+
+def _init_worker(queue):
+    global _PROGRESS_QUEUE  # pylint: disable=global-statement
+    _PROGRESS_QUEUE = queue
+
+
+def _run_shard(shard):
+    """
+    Aggregate one shard (coin or currencies) in a worker process
+    """
+
+    coin, ranges = shard
+    started = time.time()
+    result = {"shard": coin or "currencies", "written": 0, "error": None}
+    try:
+        for interval_name, time_start, last_timestamp in ranges:
+            result["written"] += aggregate_range(
+                coin,
+                interval_name,
+                time_start,
+                last_timestamp,
+                progress=_PROGRESS_QUEUE.put,
+            )
+    except Exception as e_msg:  # pylint: disable=broad-except
+        _log_error(f"ERROR: {result['shard']}: {e_msg}")
+        result["error"] = str(e_msg)
+    result["duration"] = time.time() - started
+    return result
+
+
+def _failed_shard(coin, error):
+    return {"shard": coin or "currencies", "written": 0, "error": str(error)}
+
+
+class AggregationRunner(object):
+    """
+    Aggregation of new entries of many coins in a pool of worker processes.
+
+    Every coin is a shard, and the currencies (``None`` in ``coins``)
+    are a shard of their own. The shards are aggregated
+    by ``workers`` processes (see aggregate_range()); the checkpoints
+    are saved after every chunk, so an interrupted run is resumed
+    exactly where it was stopped. The progress (intervals/s, ETA) is
+    reported every ``report_interval`` seconds, and the summary at the end.
+    If there is no progress for ``timeout`` seconds (a worker died),
+    the shards that are not finished are reported as failed.
+    """
+
+    def __init__(
+        self,
+        coins,
+        workers=4,
+        report_interval=10,
+        output=sys.stdout,
+        timeout=RUNNER_TIMEOUT,
+    ):  # pylint: disable=too-many-arguments
+        self.coins = coins
+        self.workers = workers
+        self.report_interval = report_interval
+        self.output = output
+        self.timeout = timeout
+
+        self.total = 0
+        self.done = 0
+        self.started = 0.0
+
+    def _print(self, message):
+        print(message, file=self.output, flush=True)
+        logging.info(message)
+
+    def plan(self):
+        """
+        Shards to aggregate: (coin, [(interval_name, time_start, last_timestamp)])
+        """
+
+        shards = []
+        for coin in self.coins:
+            ranges = []
+            for interval_name, interval_size in INTERVAL.items():
+                time_range = get_aggregation_range(coin, interval_name)
+                if time_range is None:
+                    _log_error(f"timestamp is None for {coin}")
+                    continue
+                ranges.append((interval_name,) + time_range)
+                self.total += _number_of_buckets(*time_range, interval_size)
+            if ranges:
+                shards.append((coin, ranges))
+        return shards
+
+    def _report(self, finished, shards):
+        elapsed = time.time() - self.started
+        rate = self.done / elapsed if elapsed else 0.0
+        eta = (self.total - self.done) / rate if rate else 0
+        self._print(
+            f"{self.done}/{self.total} intervals"
+            f" ({100.0 * self.done / max(self.total, 1):.1f}%),"
+            f" {rate:.1f} intervals/s,"
+            f" ETA {datetime.timedelta(seconds=int(eta))},"
+            f" shards {finished}/{shards}"
+        )
+
+    def run(self):
+        """
+        Aggregate all shards; return the summary
+        """
+
+        self.started = time.time()
+        shards = self.plan()
+        self._print(
+            f"aggregating {self.total} intervals of {len(shards)} shards"
+            f" in {self.workers} processes"
+        )
+
+        queue = multiprocessing.Queue()
+        results = []
+        with multiprocessing.Pool(
+            self.workers, initializer=_init_worker, initargs=(queue,)
+        ) as pool:
+            pending = [
+                (pool.apply_async(_run_shard, (shard,)), shard[0]) for shard in shards
+            ]
+
+            last_report = last_progress = time.time()
+            while pending or not queue.empty():
+                try:
+                    self.done += queue.get(timeout=0.5)
+                    last_progress = time.time()
+                except Empty:
+                    pass
+
+                for async_result, coin in pending[:]:
+                    if not async_result.ready():
+                        continue
+                    pending.remove((async_result, coin))
+                    last_progress = time.time()
+                    try:
+                        results.append(async_result.get())
+                    except Exception as e_msg:  # pylint: disable=broad-except
+                        results.append(_failed_shard(coin, e_msg))
+
+                if pending and time.time() - last_progress > self.timeout:
+                    # the result of a shard never comes, if its worker
+                    # was killed (e.g. out of memory)
+                    for _, coin in pending:
+                        results.append(
+                            _failed_shard(coin, f"no progress in {self.timeout}s")
+                        )
+                    pending = []
+                    pool.terminate()
+
+                if time.time() - last_report >= self.report_interval:
+                    self._report(len(results), len(shards))
+                    last_report = time.time()
+
+        elapsed = time.time() - self.started
+        duration = datetime.timedelta(seconds=int(elapsed))
+        failed = [x for x in results if x["error"]]
+        summary = {
+            "shards": len(shards),
+            "failed": len(failed),
+            "intervals": self.done,
+            "written": sum(x["written"] for x in results),
+            "duration": elapsed,
+        }
+        self._print(
+            f"aggregated {summary['intervals']} intervals"
+            f" of {summary['shards']} shards in {duration}"
+            f" ({self.done / elapsed if elapsed else 0.0:.1f} intervals/s):"
+            f" {summary['written']} entries written, {summary['failed']} shards failed"
+        )
+        for result in failed:
+            self._print(f"    {result['shard']}: {result['error']}")
+        return summary
+
+
+def _bucket(interval_size):
+    "start of the ``interval_size`` bucket of the entry"
+    return {"$subtract": ["$timestamp", {"$mod": ["$timestamp", interval_size]}]}
+
+
+def _first_time(key, accumulator):
+    """
+    Timestamp of the first of the bucket ``entries``, which ``key``
+    is equal to ``accumulator`` ($min, $max) of all of them
+    """
+
+    return {
+        "$let": {
+            "vars": {
+                "entry": {
+                    "$arrayElemAt": [
+                        {
+                            "$filter": {
+                                "input": "$entries",
+                                "as": "entry",
+                                "cond": {
+                                    "$eq": [
+                                        f"$$entry.{key}",
+                                        {accumulator: f"$entries.{key}"},
+                                    ]
+                                },
+                            }
+                        },
+                        0,
+                    ]
+                }
+            },
+            "in": "$$entry.timestamp",
+        }
+    }
+
+
+def _aggregated(key):
+    """
+    Aggregated ``key`` of the bucket ``entries`` (sorted by timestamp);
+    the same fields as in aggregate_entries()
+    """
+
+    values = f"$entries.{key}"
+    return {
+        "min": {"$min": values},
+        "max": {"$max": values},
+        "begin": {"$arrayElemAt": [values, 0]},
+        "end": {"$arrayElemAt": [values, -1]},
+        "time_min": _first_time(key, "$min"),
+        "time_max": _first_time(key, "$max"),
+        "avg": {"$avg": values},
+        "sum": {"$sum": values},
+        "count": {
+            "$size": {"$filter": {"input": values, "cond": {"$ne": ["$$this", None]}}}
+        },
+    }
+
+
+def coins_rollup_pipeline(time_start, time_end, interval_size, symbols=None):
+    """
+    Aggregation pipeline of the coins data from _time_start_ (>=)
+    to _time_end_ (<), bucketed by symbol and ``interval_size``.
+    The output documents are the coins_* entries.
+    """
+
+    query = {"timestamp": {"$gte": time_start, "$lt": time_end}}
+    if symbols is not None:
+        query["symbol"] = {"$in": list(symbols)}
+
+    entry = {"timestamp": "$timestamp"}
+    entry.update({key: f"${key}" for key in KEYS})
+
+    result = {
+        "_id": 0,
+        "symbol": "$_id.symbol",
+        "timestamp": "$timestamp",
+        "time_end": "$time_end",
+        "number_of_aggregated": "$number_of_aggregated",
+    }
+    result.update({key: _aggregated(key) for key in KEYS})
+
+    return [
+        {"$match": query},
+        {"$sort": {"timestamp": 1}},
+        {
+            "$group": {
+                "_id": {"symbol": "$symbol", "bucket": _bucket(interval_size)},
+                "timestamp": {"$first": "$timestamp"},
+                "time_end": {"$last": "$timestamp"},
+                "number_of_aggregated": {"$sum": 1},
+                "entries": {"$push": entry},
+            }
+        },
+        {"$project": result},
+    ]
+
+
+def currencies_rollup_pipeline(time_start, time_end, interval_size):
+    """
+    Aggregation pipeline of the currencies data from _time_start_ (>=)
+    to _time_end_ (<), bucketed by currency and ``interval_size``.
+    Every output document is one currency of a bucket:
+    bucket, currency, timestamp, time_end, number_of_aggregated, aggregated.
+    """
+
+    return [
+        {"$match": {"timestamp": {"$gte": time_start, "$lt": time_end}}},
+        {"$sort": {"timestamp": 1}},
+        {"$project": {"timestamp": 1, "values": {"$objectToArray": "$$ROOT"}}},
+        {"$unwind": "$values"},
+        {
+            "$match": {
+                "values.k": {"$regex": "^[^_]", "$nin": ["timestamp", "last_updated"]}
+            }
+        },
+        {
+            "$group": {
+                "_id": {"bucket": _bucket(interval_size), "currency": "$values.k"},
+                "timestamp": {"$first": "$timestamp"},
+                "time_end": {"$last": "$timestamp"},
+                "number_of_aggregated": {"$sum": 1},
+                "entries": {"$push": {"timestamp": "$timestamp", "value": "$values.v"}},
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "bucket": "$_id.bucket",
+                "currency": "$_id.currency",
+                "timestamp": "$timestamp",
+                "time_end": "$time_end",
+                "number_of_aggregated": "$number_of_aggregated",
+                "aggregated": _aggregated("value"),
+            }
+        },
+    ]
+
+
+def _chunks(time_start, time_end, interval_size):
+    """
+    Split the time range into ROLLUP_CHUNK chunks,
+    extended to the ``interval_size`` buckets boundaries
+    """
+
+    chunk = max(ROLLUP_CHUNK // interval_size, 1) * interval_size
+    start = time_start - time_start % interval_size
+    end = int(math.ceil(time_end / interval_size)) * interval_size
+    while start < end:
+        yield start, min(start + chunk, end)
+        start += chunk
+
+
+def _last_bucket(time_end, interval_size):
+    "start of the last (possibly incomplete) bucket before _time_end_"
+    return int(math.ceil(time_end / interval_size)) * interval_size - interval_size
+
+
+def rollup_coins(time_start, time_end, symbols=None, interval_name="1h"):
+    """
+    Aggregate the coins data (of ``symbols`` or of all coins)
+    from _time_start_ to _time_end_ into coins_``interval_name``:
+    one pipeline pass per chunk for all coins, merged on the server side.
+    The existing entries of the range are replaced, and the aggregation
+    checkpoints in the range are moved to its end.
+    """
+
+    interval_size = INTERVAL[interval_name]
+    collection_name = f"coins_{interval_name}"
+    last_bucket = _last_bucket(time_end, interval_size)
+
+    for start, stop in _chunks(time_start, time_end, interval_size):
+        started = time.time()
+        MONGO_WRITER.delete_range(start, stop, symbols, collection_name)
+        MONGO_WRITER.merge(
+            coins_rollup_pipeline(start, stop, interval_size, symbols),
+            collection_name,
+        )
+        MONGO_WRITER.advance_checkpoints(
+            symbols, interval_name, start, min(stop, last_bucket)
+        )
+        _log(f"[{collection_name}] {start}-{stop}: {time.time() - started:.1f}s")
+
+
+def rollup_currencies(time_start, time_end, interval_name="1h"):
+    """
+    Aggregate the currencies data from _time_start_ to _time_end_
+    into currencies_``interval_name`` (see rollup_coins()).
+    """
+
+    interval_size = INTERVAL[interval_name]
+    collection_name = f"currencies_{interval_name}"
+    last_bucket = _last_bucket(time_end, interval_size)
+
+    for start, stop in _chunks(time_start, time_end, interval_size):
+        started = time.time()
+        rows = MONGO_READER.aggregate(
+            currencies_rollup_pipeline(start, stop, interval_size),
+            collection_name="currencies",
+        )
+
+        entries = {}
+        for row in sorted(rows, key=lambda x: (x["bucket"], x["currency"])):
+            entry = entries.setdefault(
+                row["bucket"],
+                {
+                    "timestamp": row["timestamp"],
+                    "time_end": row["time_end"],
+                    "number_of_aggregated": row["number_of_aggregated"],
+                },
+            )
+            entry["timestamp"] = min(entry["timestamp"], row["timestamp"])
+            entry["time_end"] = max(entry["time_end"], row["time_end"])
+            entry["number_of_aggregated"] = max(
+                entry["number_of_aggregated"], row["number_of_aggregated"]
+            )
+            entry[row["currency"]] = row["aggregated"]
+
+        MONGO_WRITER.delete_range(start, stop, collection_name=collection_name)
+        MONGO_WRITER.upsert_many(list(entries.values()), collection_name)
+        MONGO_WRITER.advance_checkpoints(
+            [None], interval_name, start, min(stop, last_bucket)
+        )
+        _log(f"[{collection_name}] {start}-{stop}: {time.time() - started:.1f}s")
+
+
+def _new_entries_range(collection_name, source_collection_name=None):
+    """
+    Time range of the raw entries of ``source_collection_name``
+    that are not aggregated yet into ``collection_name``
+    (starting with the last aggregated entry, that can be incomplete)
+    """
+
+    last_timestamp = MONGO_READER.get_first_timestamp(
+        None, last=True, collection_name=source_collection_name
+    )
+    if last_timestamp is None:
+        return None
+
+    start = MONGO_READER.get_first_timestamp(
+        None, last=True, collection_name=collection_name
+    )
+    if start is None:
+        start = MONGO_READER.get_first_timestamp(
+            None, collection_name=source_collection_name
+        )
+    return start, last_timestamp + 1
+
+
+def _last_aggregated(collection_name):
+    """
+    Timestamp of the last aggregated entry of every symbol
+    of ``collection_name``
+    """
+
+    # the order of the (symbol, timestamp) index, backwards:
+    # the first entry of every symbol is taken from the index
+    pipeline = [
+        {"$sort": {"symbol": -1, "timestamp": -1}},
+        {"$group": {"_id": "$symbol", "timestamp": {"$first": "$timestamp"}}},
+    ]
+    return {
+        x["_id"]: x["timestamp"]
+        for x in MONGO_READER.aggregate(pipeline, collection_name=collection_name)
+    }
+
+
+def _new_coins_ranges(interval_name, symbols=None):
+    """
+    Raw coins entries that are not aggregated yet into coins_``interval_name``:
+    (time_start, time_end, symbols) of the coins that start
+    in the same interval. Every coin starts with its last aggregated entry
+    (that can be incomplete), or with its first entry, so a coin
+    that lags behind is caught up.
+    """
+
+    interval_size = INTERVAL[interval_name]
+    last_timestamp = MONGO_READER.get_first_timestamp(None, last=True)
+    if last_timestamp is None:
+        return []
+
+    if symbols is None:
+        symbols = MONGO_READER.get_symbols()
+    last_aggregated = _last_aggregated(f"coins_{interval_name}")
+
+    starts = {}
+    for symbol in symbols:
+        start = last_aggregated.get(symbol)
+        if start is None:
+            start = MONGO_READER.get_first_timestamp(symbol)
+        if start is not None:
+            starts.setdefault(start - start % interval_size, []).append(symbol)
+
+    return [
+        (start, last_timestamp + 1, group) for start, group in sorted(starts.items())
+    ]
+
+
+def rollup_new_entries(symbols=None):
+    """
+    Aggregate new entries of all coins (or of ``symbols``) and currencies
+    """
+
+    for interval_name in INTERVAL:
+        for time_start, time_end, group in _new_coins_ranges(interval_name, symbols):
+            rollup_coins(
+                time_start, time_end, symbols=group, interval_name=interval_name
+            )
+
+        time_range = _new_entries_range(f"currencies_{interval_name}", "currencies")
+        if time_range:
+            rollup_currencies(*time_range, interval_name=interval_name)
 
 
 # we have blacklisted these coins, because there are some problems
@@ -675,7 +1311,17 @@ BLACKLISTED = """
 
 def main():
     """
-    Aggregator of existing entries
+    Aggregator of existing entries: repair of the entries maintained
+    at ingest time (the missed ticks, the late entries, the gaps).
+
+    Usage:
+
+        aggregate.py                aggregate new entries
+        aggregate.py START [END]    (re)aggregate entries from START to END
+                                    (unix timestamps; END is now by default)
+        aggregate.py --workers [N]  aggregate new entries coin by coin
+                                    in N processes (AGGREGATE_WORKERS),
+                                    resuming from the checkpoints
     """
 
     global DEBUG_LEVEL
@@ -693,15 +1339,27 @@ def main():
     )
 
     blacklisted = set(BLACKLISTED.split())
-    coins_to_aggregate = [None] + [x[0] for x in COINS_NAMES if x[0] not in blacklisted]
-
     coins_to_aggregate = [x[0] for x in COINS_NAMES if x[0] not in blacklisted]
 
-    for coin in coins_to_aggregate:
-        # try:
-        aggregate_new_entries(coin)
-    # except IndexError as e_msg:
-    #     _log_error("ERROR: coin: %s: %s" % (coin, e_msg))
+    if len(sys.argv) < 2:
+        rollup_new_entries(coins_to_aggregate)
+        return
+
+    if sys.argv[1] == "--workers":
+        workers = int(sys.argv[2]) if len(sys.argv) > 2 else WORKERS
+        summary = AggregationRunner([None] + coins_to_aggregate, workers).run()
+        sys.exit(1 if summary["failed"] else 0)
+
+    time_start = int(sys.argv[1])
+    time_end = int(sys.argv[2]) if len(sys.argv) > 2 else time.time()
+    for interval_name in INTERVAL:
+        rollup_coins(
+            time_start,
+            time_end,
+            symbols=coins_to_aggregate,
+            interval_name=interval_name,
+        )
+        rollup_currencies(time_start, time_end, interval_name=interval_name)
 
 
 if __name__ == "__main__":
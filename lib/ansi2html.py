@@ -0,0 +1,581 @@
+"""
+Convert ANSI (terminal) colours and attributes to HTML.
+
+In-process port of share/ansi2html.sh (pixelb's ansi2html.sh, v0.23)
+called as ``ansi2html.sh --palette=xterm --bg=dark``: the produced HTML
+is the same, but no process is forked for the conversion.
+
+The input is converted line by line, so the output can be streamed
+(see ``convert``).
+
+Exports:
+
+    ansi2html
+    convert
+"""
+
+import re
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+XTERM_PALETTE = [
+    "000000",
+    "CD0000",
+    "00CD00",
+    "CDCD00",
+    "0000EE",
+    "CD00CD",
+    "00CDCD",
+    "E5E5E5",
+    "7F7F7F",
+    "FF0000",
+    "00FF00",
+    "FFFF00",
+    "5C5CFF",
+    "FF00FF",
+    "00FFFF",
+    "FFFFFF",
+]
+
+
+def _header(palette: List[str]) -> str:
+    """
+    HTML header with the CSS for ``palette`` on the dark background
+    """
+
+    colors = "".join(
+        f".ef{i},.f{i} {{ color: #{palette[i]}; }} "
+        f".eb{i},.b{i} {{ background-color: #{palette[i]}; }}\n"
+        for i in range(8)
+    )
+    colors += "".join(
+        f".ef{i + 8},{' ' if i < 2 else ''}.f{i} > .bold,.bold > .f{i} "
+        f"{{ color: #{palette[i + 8]}; font-weight: normal; }}\n"
+        for i in range(8)
+    )
+    colors += "".join(
+        f".eb{i}{' ' * (3 - len(str(i)))}{{ background-color: #{palette[i]}; }}\n"
+        for i in range(8, 16)
+    )
+
+    # the default xterm 256 colour palette
+    colors_256 = ""
+    for red in range(6):
+        for green in range(6):
+            for blue in range(6):
+                number = 16 + red * 36 + green * 6 + blue
+                rgb = "".join(
+                    f"{(value * 40 + 55) * (value > 0):02x}"
+                    for value in (red, green, blue)
+                )
+                colors_256 += (
+                    f".ef{number} {{ color: #{rgb}; }} "
+                    f".eb{number} {{ background-color: #{rgb}; }}\n"
+                )
+    for gray in range(24):
+        rgb = f"{gray * 10 + 8:02x}" * 3
+        colors_256 += (
+            f".ef{gray + 232} {{ color: #{rgb}; }} "
+            f".eb{gray + 232} {{ background-color: #{rgb}; }}\n"
+        )
+
+    return (
+        "<html>\n"
+        "<head>\n"
+        '<meta http-equiv="Content-Type" content="text/html; charset=utf-8"/>\n'
+        '<link rel="stylesheet" type="text/css" href="/files/style.css" />\n'
+        '<link rel="stylesheet" type="text/css"'
+        ' href="/files/fonts/stylesheet.css" />\n'
+        '<style type="text/css">\n'
+        f"{colors}{colors_256}\n"
+        f".f9 {{ color: #{palette[7]}; }}\n"
+        f".b9 {{ background-color: #{palette[0]}; }}\n"
+        ".f9 > .bold,.bold > .f9, body.f9 > pre > .bold {\n"
+        "  /* Bold is heavy black on white, or bright white\n"
+        "     depending on the default background */\n"
+        f"  color: #{palette[15]};\n"
+        "  font-weight: normal;\n"
+        "}\n"
+        ".reverse {\n"
+        "  /* CSS does not support swapping fg and bg colours unfortunately,\n"
+        "     so just hardcode something that will look OK on all backgrounds. */\n"
+        f"  color: #{palette[0]}; background-color: #{palette[7]};\n"
+        "}\n"
+        ".underline { text-decoration: underline; }\n"
+        ".line-through { text-decoration: line-through; }\n"
+        ".blink { text-decoration: blink; }\n"
+        "\n"
+        "/* Avoid pixels between adjacent span elements.\n"
+        "   Note this only works for lines less than 80 chars\n"
+        "   where we close span elements on the same line.\n"
+        "span { display: inline-block; }\n"
+        "*/\n"
+        "</style>\n"
+        "</head>\n"
+        "\n"
+        '<body class="">\n'
+        "<pre>\n"
+    )
+
+
+HEADER = _header(XTERM_PALETTE)
+FOOTER = "</pre>\n</body>\n</html>\n"
+
+P = r"\x1b\["
+
+# substitutions of the sed part of the script, in the same order;
+# the substitutions with ``True`` are repeated while they match
+# (``t label`` loops)
+_SUBSTITUTIONS = [
+    # escape ampersand and quote
+    (r"&", "&amp;", False),
+    (r'"', "&quot;", False),
+    # strip anything between \e and ST
+    (r"\x1b[^\x1b]*\x1b\\", "", False),
+    # strip any OSC (xterm title etc.)
+    (r"\x1b\][0-9]*;[^\a]*\a", "", False),
+    # strip trailing \r
+    (r"\r$", "", False),
+    # strip other non SGR escape sequences
+    (r"\x07", "", False),
+    (r"\x1b[\]>=\\][0-9;]*", "", False),
+    (r"\x1bP+.{5}", "", False),
+    # mark cursor positioning codes "Jr;c;
+    (P + r"([0-9]{1,2})G", r'"J;\1;', False),
+    (P + r"([0-9]{1,2});([0-9]{1,2})H", r'"J\1;\2;', False),
+    # mark clear as "Cn where n=1 is screen and n=0 is to end-of-line
+    (P + r"H", '"C1;', False),
+    (P + r"K", '"C0;', False),
+    # mark cursor move columns as "Mn where n is +ve for right, -ve for left
+    (P + r"C", '"M1;', False),
+    (P + r"([0-9]+)C", r'"M\1;', False),
+    (P + r"([0-9]+)D", r'"M-\1;', False),
+    (P + r"([0-9]+)P", r'"X\1;', False),
+    (P + r"[0-9;?]*[^0-9;?m]", "", False),
+    # escape HTML (ampersand and quote done above)
+    (r">", "&gt;", False),
+    (r"<", "&lt;", False),
+    # split 256 colors out and mark so that they're not
+    # recognised by the following 'split combined' line
+    (P + r"([0-9;]+);([34]8;5;[0-9]{1,3})m", "\x1b[\\1m\x1b[¬\\2m", True),
+    (P + r"([34]8;5;[0-9]{1,3})m", "\x1b[¬\\1m", False),
+    # split combined
+    (P + r"([0-9]+);([0-9;]+)m", "\x1b[\\1m\x1b[\\2m", True),
+    # strip leading 0
+    (P + r"0([0-7])", "\x1b[\\1", False),
+    # bold last (with clr)
+    (P + r"1m((" + P + r"[4579]m)*)", "\\1\x1b[1m", False),
+    # add leading 0 to norm
+    (P + r"m", "\x1b[0m", False),
+    # undo any 256 color marking
+    (P + r"¬([34]8;5;[0-9]{1,3})m", "\x1b[\\1m", False),
+    # map 16 color codes to color + bold
+    (P + r"9([0-7])m", "\x1b[3\\1m\x1b[1m", False),
+    (P + r"10([0-7])m", "\x1b[4\\1m\x1b[1m", False),
+    # change 'reset' code to "R
+    (P + r"0m", '"R;', False),
+    # common combinations to minimise html
+    (P + r"3[0-7]m" + P + r"3([0-7])m", "\x1b[3\\1m", True),
+    (P + r"4[0-7]m" + P + r"4([0-7])m", "\x1b[4\\1m", True),
+    (P + r"3([0-7])m" + P + r"4([0-7])m", r'<span class="f\1 b\2">', False),
+    (P + r"4([0-7])m" + P + r"3([0-7])m", r'<span class="f\2 b\1">', False),
+    (P + r"1m", '<span class="bold">', False),
+    (P + r"4m", '<span class="underline">', False),
+    (P + r"5m", '<span class="blink">', False),
+    (P + r"7m", '<span class="reverse">', False),
+    (P + r"9m", '<span class="line-through">', False),
+    (P + r"3([0-9])m", r'<span class="f\1">', False),
+    (P + r"4([0-9])m", r'<span class="b\1">', False),
+    (P + r"38;5;([0-9]{1,3})m", r'<span class="ef\1">', False),
+    (P + r"48;5;([0-9]{1,3})m", r'<span class="eb\1">', False),
+    # strip unhandled codes
+    (P + r"[0-9;]*m", "", False),
+    # change 'smacs' and 'rmacs' to "T1 and "T0 to simplify matching
+    (r"\x1b\(0", '"T1;', False),
+    (r"\x0e", '"T1;', False),
+    (r"\x1b\(B", '"T0;', False),
+    (r"\x0f", '"T0;', False),
+]
+_SUBSTITUTIONS = [
+    (re.compile(pattern), replacement, repeat)
+    for pattern, replacement, repeat in _SUBSTITUTIONS
+]
+
+# alternative character set
+_TRANSLITERATION = dict(
+    zip("abcdefghijklmnopqrstuvwxyz{}`~", "▒␉␌␍␊°±␤␋┘┐┌└┼⎺⎻─⎼⎽├┤┴┬│≤≥π£◆·")
+)
+
+# markers that need the screen tracking
+_SCREEN_CONTROL = re.compile(r'[\r\b]|"[CJMX]')
+
+# dump screen status
+DS_OFF = 0  # not dumping screen contents, just write output directly
+DS_NEW = 1  # just after move/clear waiting for activity to start recording
+DS_RESET = 2  # screen cleared, build new empty buffer and record
+DS_ACTIVE = 3  # currently recording
+
+
+def _normalize(line: str) -> str:
+    """
+    Escape HTML and replace the escape codes of ``line`` with the markers
+    (spans and "X; sequences) understood by ``_Screen``
+    """
+
+    for regexp, replacement, repeat in _SUBSTITUTIONS:
+        line, number = regexp.subn(replacement, line)
+        while repeat and number:
+            line, number = regexp.subn(replacement, line)
+    return line
+
+
+def _as_number(value: str) -> int:
+    """
+    Numeric value of ``value`` as awk sees it: leading number or 0
+    """
+    match = re.match(r"\s*[-+]?[0-9]+", value)
+    return int(match.group(0)) if match else 0
+
+
+class _Screen(object):  # pylint: disable=too-many-instance-attributes
+    """
+    Attributes tracking and output of the normalized lines
+    (the awk part of the script)
+    """
+
+    def __init__(self) -> None:
+        self.dump = {}  # type: Dict[Tuple[int, int], str]
+        self.attr = {}  # type: Dict[Tuple[int, int], str]
+        self.span = []  # type: List[str]
+        self.cur = []  # type: List[str]
+        self.cur_attributes = ""
+        self.x = 1
+        self.y = 1
+        self.max_x = 80
+        self.max_y = 0
+        self.dump_status = DS_OFF
+        self.last_mode = 0
+
+    def _fix_attributes(self, attributes: str) -> str:
+        """
+        Close/open spans to switch from the opened spans to ``attributes``
+        """
+
+        if attributes == self.cur_attributes:
+            return ""
+
+        spans = [value + ">" for value in attributes.split(">")[:-1]]
+
+        kept = 0
+        while (
+            kept < len(self.cur) and kept < len(spans) and self.cur[kept] == spans[kept]
+        ):
+            kept += 1
+
+        result = "</span>" * (len(self.cur) - kept) + "".join(spans[kept:])
+        self.cur = spans
+        self.cur_attributes = attributes
+        return result
+
+    def _dump_line(self, line: int, delete: bool) -> str:
+        result = ""
+        blanks = ""
+        for column in range(1, self.max_x):
+            position = (column, line)
+            if position in self.attr or self.cur:
+                attributes = self.attr.get(position, "")
+                if delete:
+                    self.attr.pop(position, None)
+                else:
+                    self.attr[position] = attributes
+                result += blanks + self._fix_attributes(attributes)
+                blanks = ""
+            if position in self.dump:
+                result += blanks + self.dump[position]
+                if delete:
+                    del self.dump[position]
+                blanks = ""
+            else:
+                blanks += " "
+        if self.cur:
+            result += blanks
+        return result
+
+    def _dump_screen(self) -> str:
+        result = ""
+        for line in range(1, self.max_y + 1):
+            result += self._dump_line(line, False) + "\n"
+        return result + self._fix_attributes("")
+
+    def _put(self, char: str) -> str:
+        """
+        Write ``char`` at the cursor position
+        """
+
+        result = ""
+        if self.dump_status == DS_RESET:
+            self.dump.clear()
+            self.attr.clear()
+            result += "\n"
+            self.dump_status = DS_ACTIVE
+        if self.dump_status == DS_NEW:
+            # after moving/clearing we are now ready to write
+            # something to the screen so start recording now
+            result += "\n"
+            self.dump_status = DS_ACTIVE
+        if self.dump_status in (DS_ACTIVE, DS_OFF):
+            position = (self.x, self.y)
+            self.dump[position] = char
+            if self.span:
+                self.attr[position] = "".join(self.span)
+            else:
+                self.attr.pop(position, None)
+            self.x += 1
+            self.max_x = max(self.max_x, self.x)
+        return result
+
+    def _command(self, command: str, args: List[str]) -> Tuple[str, int]:
+        """
+        Execute the marker ``command`` ("X;...;), return the output
+        and the number of the extra characters used by the marker
+        """
+
+        result = ""
+        extra = 0
+        if command == "C":
+            if _as_number(args[0]):
+                # clear screen: if recording, dump the screen
+                if self.dump_status == DS_ACTIVE:
+                    result += self._dump_screen()
+                self.dump_status = DS_ACTIVE
+                self.dump.clear()
+                self.attr.clear()
+                self.x = self.y = 1
+            else:
+                # clear to end of line
+                for position in range(self.x, self.max_x):
+                    self.dump[(position, self.y)] = " "
+                    if self.span:
+                        self.attr[(position, self.y)] = "".join(self.span)
+                    else:
+                        self.attr.pop((position, self.y), None)
+        elif command == "J":
+            # jump to x,y
+            extra = len(args[1]) + 1 if len(args) > 1 else 1
+            # if line is higher, dump the previous screen
+            if self.dump_status == DS_ACTIVE and (
+                not args[0] or _as_number(args[0]) < self.y
+            ):
+                result += self._dump_screen()
+                self.dump_status = DS_NEW
+            self.x = _as_number(args[1]) if len(args) > 1 else 0
+            if args[0] and self.y != _as_number(args[0]):
+                self.y = _as_number(args[0])
+                self.max_y = max(self.max_y, self.y)
+                # change y: start recording
+                self.dump_status = self.dump_status or DS_RESET
+        elif command == "M":
+            # move left/right on current line
+            self.x += _as_number(args[0])
+        elif command == "X":
+            # delete on right
+            shift = _as_number(args[0])
+            for position in range(self.x, self.max_x + 1):
+                source = (position + shift, self.y)
+                target = (position, self.y)
+                if position + shift < self.max_x:
+                    for screen in (self.attr, self.dump):
+                        if source in screen:
+                            screen[target] = screen[source]
+                        else:
+                            screen.pop(target, None)
+                elif self.span:
+                    self.attr[target] = "".join(self.span)
+                    self.dump[target] = " "
+        elif command == "R":
+            # reset attributes
+            self.span.clear()
+        return result, extra
+
+    def _feed_direct(self, line: str) -> str:
+        """
+        Output for ``line`` without cursor movements, when the screen
+        is not recorded (same result as ``feed``, but much faster)
+        """
+
+        result = []
+        attributes = "".join(self.span)
+        state = 3
+        entity = ""
+        i = 0
+        while i < len(line):
+            char = line[i]
+            if state == 2:
+                entity += char
+                if char != ";":
+                    i += 1
+                    continue
+                char = entity
+                state = self.last_mode
+            elif char == "<":
+                end = line.find(">", i)
+                if end == -1:
+                    end = len(line)
+                self.span.append(line[i:end] + ">")
+                attributes = "".join(self.span)
+                i = end + 1
+                continue
+            elif char == "&":
+                entity = char
+                state = 2
+                i += 1
+                continue
+            elif char == '"':
+                command = line[i + 1 : i + 2]
+                argument = line[i + 2 :].split(";", 1)[0]
+                if command == "T":
+                    if argument == "1" and state == 3:
+                        self.last_mode = state = 4
+                    if argument == "0" and state == 4:
+                        self.last_mode = state = 3
+                elif command == "R":
+                    self.span.clear()
+                    attributes = ""
+                i += len(argument) + 3
+                continue
+            elif state == 4 and char in _TRANSLITERATION:
+                char = _TRANSLITERATION[char]
+
+            result.append(self._fix_attributes(attributes))
+            result.append(char)
+            self.x += 1
+            i += 1
+
+        self.max_x = max(self.max_x, self.x)
+        if self.x < self.max_x:
+            # nothing after the end of the line
+            result.append(self._fix_attributes(""))
+        self.x = 1
+        return "".join(result)
+
+    def feed(self, line: str) -> str:
+        """
+        Output for the normalized ``line``
+        """
+
+        if self.dump_status == DS_OFF and not _SCREEN_CONTROL.search(line):
+            return self._feed_direct(line)
+
+        result = ""
+        state = 3
+        entity = ""
+        i = 0
+        while i < len(line):
+            char = line[i]
+            if state == 2:
+                entity += char
+                if char != ";":
+                    i += 1
+                    continue
+                # all the entity goes to a single position
+                char = entity
+                state = self.last_mode
+            elif char == "\r":
+                self.x = 1
+                i += 1
+                continue
+            elif char == "<":
+                # change attributes: store the current active attributes
+                end = line.find(">", i)
+                if end == -1:
+                    end = len(line)
+                self.span.append(line[i:end] + ">")
+                i = end + 1
+                continue
+            elif char == "&":
+                entity = char
+                state = 2
+                i += 1
+                continue
+            elif char == "\b":
+                # backspace: move insertion point back 1
+                if self.span:
+                    self.attr[(self.x, self.y)] = "".join(self.span)
+                self.x = self.x - 1 if self.x > 1 else 1
+                i += 1
+                continue
+            elif char == '"':
+                command = line[i + 1 : i + 2]
+                args = line[i + 2 :].split(";")
+                if command == "T":
+                    # transliterate on/off
+                    if args[0] == "1" and state == 3:
+                        self.last_mode = state = 4
+                    if args[0] == "0" and state == 4:
+                        self.last_mode = state = 3
+                output, extra = self._command(command, args)
+                result += output
+                i += extra + len(args[0]) + 3
+                continue
+            elif state == 4 and char in _TRANSLITERATION:
+                char = _TRANSLITERATION[char]
+
+            result += self._put(char)
+            i += 1
+
+        # end of line: if dumping, increment y and set x back to first col
+        self.x = 1
+        if not self.dump_status:
+            return result + self._dump_line(self.y, True)
+        self.y += 1
+        self.max_y = max(self.max_y, self.y)
+        return result
+
+    def close(self) -> str:
+        """
+        Output of the recorded screen (if any)
+        """
+        if self.dump_status:
+            return self._dump_screen() + "\n"
+        return ""
+
+
+_CONTROL_CHARS = re.compile("[\x07\x0e\x0f\x1b\r]")
+
+
+def _normalize_fast(line: str) -> str:
+    if _CONTROL_CHARS.search(line):
+        return _normalize(line)
+    # only HTML escaping is needed
+    return (
+        line.replace("&", "&amp;")
+        .replace('"', "&quot;")
+        .replace(">", "&gt;")
+        .replace("<", "&lt;")
+    )
+
+
+def convert(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Convert ``lines`` (without the line breaks) to HTML, yielding
+    the HTML chunks as soon as they are ready
+    """
+
+    yield HEADER
+    screen = _Screen()
+    for line in lines:
+        yield screen.feed(_normalize_fast(line)) + "\n"
+    tail = screen.close()
+    if tail:
+        yield tail
+    yield FOOTER
+
+
+def ansi2html(text: str) -> str:
+    """
+    Convert ``text`` with ANSI escape sequences to an HTML page
+    """
+
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return "".join(convert(lines))
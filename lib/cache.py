@@ -0,0 +1,302 @@
+"""
+Responses cache.
+
+Two tiers: an in-memory LRU cache limited by size (in bytes)
+in front of the disk store (CACHE_DIR).
+
+Entries are tied to the collection epoch (timestamp of the latest coins data).
+Disk entries are stored in CACHE_DIR/<epoch>/<key>.<variant>, so when a new
+epoch lands, the stale entries are not served anymore; directories of the old
+epochs (except the previous one) are removed in a thread of the gevent
+threadpool, so the requests processing never waits for the sweep.
+Answers are not cached while the epoch is unknown (None).
+
+Every key can have several variants (output formats) of the same data,
+e.g. ``ansi``, ``plain`` and ``html``; they are cached and counted separately.
+Compressed copies of a variant are stored next to it as <key>.<variant>.<encoding>
+(see ``get_encoded`` and ``put_encoded``).
+
+When the server is overloaded, answers of the previous epoch can be served
+instead of rendering the new ones (see ``get_stale``).
+
+Exports:
+
+    ResponseCache
+"""
+
+import collections
+import logging
+import os
+import shutil
+from typing import Any, Dict, Optional, Union
+
+import gevent
+
+
+class ResponseCache(object):  # pylint: disable=too-many-instance-attributes
+    """
+    Epoch-aware two-tier cache of the rendered responses
+    """
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self._memory = collections.OrderedDict()
+        self._epoch = None
+        self._previous_epoch = None
+
+        self.bytes = 0
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+        self.writes = 0
+        self.variants = collections.defaultdict(
+            lambda: {"hits": 0, "misses": 0}
+        )  # type: Dict[str, Dict[str, int]]
+
+    @staticmethod
+    def _epoch_name(epoch: float) -> str:
+        return str(int(epoch))
+
+    def _path(self, key: str, epoch: float, variant: str) -> str:
+        return os.path.join(self.directory, self._epoch_name(epoch), f"{key}.{variant}")
+
+    def _new_epoch(self, epoch: Optional[float]) -> None:
+        """
+        Switch to ``epoch`` and schedule the removal of the disk entries
+        of the epochs older than the previous one
+        """
+
+        previous_epoch = self._epoch
+        self._epoch = epoch
+        self._previous_epoch = previous_epoch
+        if epoch is None or previous_epoch is None or epoch < previous_epoch:
+            return
+
+        gevent.get_hub().threadpool.spawn(self._remove_old_epochs, previous_epoch)
+
+    def _remove_old_epochs(self, oldest: float) -> None:
+        """
+        Remove the directories of the epochs older than ``oldest``,
+        and the one of the unknown epoch saved by the older versions
+        (run in a thread of the gevent threadpool, so the newer epochs
+        can be written meanwhile)
+        """
+
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            old = name == "none" or name.isdigit() and int(name) < int(oldest)
+            if old and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _remember(self, memory_key, value: Union[str, bytes]) -> None:
+        size = len(value) if isinstance(value, bytes) else len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+
+        old_value = self._memory.pop(memory_key, None)
+        if old_value is not None:
+            self.bytes -= old_value[1]
+
+        self._memory[memory_key] = (value, size)
+        self.bytes += size
+
+        while self.bytes > self.max_bytes:
+            _, (_, evicted_size) = self._memory.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def contains(self, key: str, epoch: Optional[float], variant: str = "ansi") -> bool:
+        """
+        True if ``variant`` of ``key`` for ``epoch`` is cached
+        (the hit/miss counters are not changed)
+        """
+        if epoch is None:
+            return False
+        if (epoch, key, variant) in self._memory:
+            return True
+        return os.path.exists(self._path(key, epoch, variant))
+
+    def get(
+        self, key: str, epoch: Optional[float], variant: str = "ansi"
+    ) -> Optional[str]:
+        """
+        Return the cached ``variant`` of ``key`` for ``epoch`` or None
+        """
+        return self._get(key, epoch, variant, binary=False)
+
+    def get_encoded(
+        self, key: str, epoch: Optional[float], variant: str, encoding: str
+    ) -> Optional[bytes]:
+        """
+        Return the cached ``variant`` of ``key`` for ``epoch``
+        compressed with ``encoding``, or None
+        """
+        return self._get(key, epoch, f"{variant}.{encoding}", binary=True)
+
+    def get_stale(
+        self,
+        key: str,
+        epoch: Optional[float],
+        variant: str,
+        encoding: Optional[str] = None,
+    ) -> Union[str, bytes, None]:  # pylint: disable=too-many-arguments
+        """
+        Return ``variant`` of ``key`` (compressed with ``encoding`` if specified)
+        cached for the latest epoch before ``epoch``, or None.
+        The hit/miss counters are not changed.
+        """
+
+        if epoch is None:
+            return None
+        epochs = [
+            x
+            for x in (self._epoch, self._previous_epoch)
+            if x is not None and x < epoch
+        ]
+        if not epochs:
+            # nothing is cached by this process yet, but other processes
+            # could have saved the answers on the disk
+            try:
+                names = os.listdir(self.directory)
+            except FileNotFoundError:
+                names = []
+            epochs = [int(x) for x in names if x.isdigit() and int(x) < int(epoch)]
+        if not epochs:
+            return None
+
+        if encoding is not None:
+            variant = f"{variant}.{encoding}"
+        value = self._get(key, max(epochs), variant, encoding is not None, count=False)
+        if value is not None:
+            self.stale_hits += 1
+        return value
+
+    def _get(
+        self,
+        key: str,
+        epoch: Optional[float],
+        variant: str,
+        binary: bool,
+        count: bool = True,
+    ) -> Union[str, bytes, None]:  # pylint: disable=too-many-arguments
+        if epoch is None:
+            if count:
+                self.misses += 1
+                self.variants[variant]["misses"] += 1
+            return None
+
+        memory_key = (epoch, key, variant)
+        if memory_key in self._memory:
+            self._memory.move_to_end(memory_key)
+            if count:
+                self.hits += 1
+                self.memory_hits += 1
+                self.variants[variant]["hits"] += 1
+            return self._memory[memory_key][0]
+
+        try:
+            with open(self._path(key, epoch, variant), "rb") as cache_file:
+                value = cache_file.read()
+            if not binary:
+                value = value.decode("utf-8")
+        except FileNotFoundError:
+            if count:
+                self.misses += 1
+                self.variants[variant]["misses"] += 1
+            return None
+
+        self._remember(memory_key, value)
+        if count:
+            self.hits += 1
+            self.disk_hits += 1
+            self.variants[variant]["hits"] += 1
+        return value
+
+    def put(
+        self, key: str, epoch: Optional[float], value: str, variant: str = "ansi"
+    ) -> None:
+        """
+        Save ``variant`` of ``key`` for ``epoch`` in the memory and on the disk
+        """
+        self._put(key, epoch, value, variant)
+
+    def put_encoded(
+        self,
+        key: str,
+        epoch: Optional[float],
+        value: bytes,
+        variant: str,
+        encoding: str,
+    ) -> None:  # pylint: disable=too-many-arguments
+        """
+        Save ``variant`` of ``key`` for ``epoch`` compressed with ``encoding``
+        """
+        self._put(key, epoch, value, f"{variant}.{encoding}")
+
+    def _put(
+        self, key: str, epoch: Optional[float], value: Union[str, bytes], variant: str
+    ) -> None:
+        # the answers of the unknown epoch would never expire
+        if epoch is None:
+            return
+        if epoch != self._epoch:
+            self._new_epoch(epoch)
+
+        self._remember((epoch, key, variant), value)
+        self.writes += 1
+
+        path = self._path(key, epoch, variant)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write to a temporary file first, so a partially written file
+            # is never served
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as cache_file:
+                cache_file.write(
+                    value if isinstance(value, bytes) else value.encode("utf-8")
+                )
+            os.replace(tmp_path, path)
+        except OSError as e_msg:
+            logging.error("ERROR: can't write cache entry %s: %s", path, e_msg)
+
+    def variant_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Hits, misses and hit ratio of every variant
+        """
+
+        result = {}
+        for variant, counters in self.variants.items():
+            requests = counters["hits"] + counters["misses"]
+            result[variant] = {
+                "hits": counters["hits"],
+                "misses": counters["misses"],
+                "hit_ratio": counters["hits"] / requests if requests else 0.0,
+            }
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Cache counters
+        """
+
+        return {
+            "hits": self.hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stale_hits": self.stale_hits,
+            "evictions": self.evictions,
+            "writes": self.writes,
+            "bytes": self.bytes,
+            "entries": len(self._memory),
+            "variants": self.variant_stats(),
+        }
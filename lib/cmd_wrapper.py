@@ -5,7 +5,6 @@ Caches the results. Handles exceptions.
 """
 
 from gevent.monkey import patch_all
-from gevent.subprocess import Popen, PIPE
 
 patch_all()
 
@@ -29,12 +28,39 @@ import view
 import coins_names
 import draw
 
-from globals import error, ANSI2HTML
+from globals import (
+    CACHE_DIR,
+    CACHE_MEMORY_MAX_BYTES,
+    RENDER_POOL_SIZE,
+    RENDER_QUEUE_SIZE,
+    RENDER_TIMEOUT,
+    SHED_IN_FLIGHT,
+    SHED_QUEUE_DEPTH,
+    SINGLE_FLIGHT_TIMEOUT,
+)
+from ansi2html import ansi2html
+from cache import ResponseCache
+from compression import compress
+from metrics import METRICS
+from render_pool import RenderPool, RenderPoolError
+from singleflight import SingleFlight, SingleFlightError
+from mng import get_epoch
 from buttons import TWITTER_BUTTON, GITHUB_BUTTON, GITHUB_BUTTON_FOOTER
 from utils import remove_ansi, remove_trailing_spaces
 
 INTERNAL_TOPICS = [":help", ":currencies", ":coins"]
 
+# one-letter flags of the query string (see parse_query)
+FLAGS = "qAITF"
+
+# options that change only the presentation of the answer
+PRESENTATION_OPTIONS = ["quiet", "force-ansi", "no-terminal", "format"]
+
+RESPONSE_CACHE = ResponseCache(CACHE_DIR, CACHE_MEMORY_MAX_BYTES)
+SINGLE_FLIGHT = SingleFlight(timeout=SINGLE_FLIGHT_TIMEOUT)
+# CPU-bound rendering; the data are loaded in the server process
+RENDER_POOL = RenderPool(RENDER_POOL_SIZE, RENDER_TIMEOUT, RENDER_QUEUE_SIZE)
+
 
 def show_currencies():
     return (
@@ -65,75 +91,353 @@ def get_internal(topic):
     return ""
 
 
+def get_internal_data(topic):
+    """
+    Internal page ``topic`` for the JSON output
+    """
+
+    if topic == ":currencies":
+        return {
+            x: currencies_names.CURRENCY_NAME[x]
+            for x in currencies_names.SUPPORTED_CURRENCIES
+        }
+
+    if topic == ":coins":
+        return dict(coins_names.COINS_NAMES)
+
+    return {"text": get_internal(topic)}
+
+
 def get_digest(data):
     return hashlib.sha1(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
 
 
-def get_cmd_output(hostname, topic, request_options):
+def get_variant(request_options, html):
+    """
+    Output variant of the answer:
+    ansi, plain (no-terminal), html, html-nofollow (without the buttons);
+    html of the plain answer is plain-html and plain-html-nofollow;
+    json (format=json) is the data of the answer (not rendered)
+    """
 
-    digest = get_digest({"h": hostname, "t": topic, "r": request_options})
+    if request_options.get("format") == "json":
+        return "json"
 
-    cache_file = f"{MYDIR}/cache/{digest}"
-    if os.path.exists(cache_file):
-        return open(cache_file).read()
-    # elif hostname == 'rate.sx' and topic == ':firstpage' and os.path.exists(cache_file):
-    #    return open(cache_file).read().decode('utf-8')
-    else:
-        currency = hostname.lower()
-        if currency.endswith(".rate.sx"):
-            currency = currency[:-8].upper()
-
-        if currency == "COIN":
-            return "Use YOUR COIN instead of COIN in the query: for example btg.rate.sx, xvg.rate.sx, eth.rate.sx and so on\nTry:\n curl btg.rate.sx\n curl xvg.rate.sx\n curl xrb.rate.sx\n"
-
-        use_currency = currency
-        if (
-            currency not in currencies_names.SUPPORTED_CURRENCIES
-            and currency not in coins_names.COIN_NAMES_DICT
-            and currency != "coin"
-        ):
-            currency = "USD"
-
-        if topic != ":firstpage":
-            try:
-                answer = calculator.calculate(topic.upper(), currency)
-                if answer:
-                    answer = f"text {answer}"
-            except ValueError as e:
-                return f"ERROR: {e}\n"
-
-            if answer is None:
-                try:
-                    answer = draw.view(topic, use_currency=currency)
-                except RuntimeError as e:
-                    return f"ERROR: {e}\n"
-
-            if answer is not None:
-                if request_options.get("no-terminal"):
-                    answer = remove_trailing_spaces(remove_ansi(answer))
-                open(cache_file, "w").write(str(answer) + "\n")
-                return f"{answer}\n"
-            else:
-                return f"ERROR: Can't parse your query: {topic}\n"
-
-        cmd = [
-            f"{MYDIR}/ve/bin/python",
-            f"{MYDIR}/bin/show_data.py",
-            currency,
+    variant = "plain" if request_options.get("no-terminal") else "ansi"
+    if html:
+        variant = "html" if variant == "ansi" else "plain-html"
+        if request_options.get("quiet") and request_options.get("no-follow-line"):
+            variant += "-nofollow"
+    return variant
+
+
+def get_data_options(request_options):
+    """
+    Options that change the answer data, not only its presentation
+    (presentation is covered by the variant)
+    """
+
+    return {
+        key: value
+        for key, value in request_options.items()
+        if key not in PRESENTATION_OPTIONS
+        and not (value == "" and set(key) <= set(FLAGS))
+    }
+
+
+def get_cache_key(hostname, topic, request_options):
+    return get_digest(
+        {"h": hostname, "t": topic, "r": get_data_options(request_options)}
+    )
+
+
+def get_etag(query, hostname=None, request_options=None, html=False, encoding=None):
+    """
+    ETag of the cached answer for ``query`` and the epoch of its data;
+    (None, None) if the answer is not cached (or can't be cached)
+    """
+
+    query = normalize_query(query)
+    if query in INTERNAL_TOPICS:
+        return None, None
+
+    variant = get_variant(request_options, html)
+    digest = get_cache_key(hostname, query, request_options)
+    epoch = get_epoch()
+    if epoch is None:
+        return None, None
+    with METRICS.timer("cache"):
+        if not RESPONSE_CACHE.contains(digest, epoch, variant):
+            return None, None
+
+    etag = f"{digest[:20]}-{int(epoch)}-{variant}"
+    if encoding is not None:
+        etag += f"-{encoding}"
+    return etag, epoch
+
+
+def get_route_class(query):
+    """
+    Route class of the not cached ``query`` (for the rate limits):
+    internal pages are as cheap as the cached answers (``hit``)
+    """
+
+    query = normalize_query(query)
+    if query in INTERNAL_TOPICS:
+        return "hit"
+    if query == ":firstpage":
+        return "firstpage"
+    return "chart"
+
+
+def is_overloaded():
+    """
+    True if the new answers should not be rendered now
+    """
+
+    return (
+        RENDER_POOL.waiting >= SHED_QUEUE_DEPTH
+        or SINGLE_FLIGHT.in_flight() >= SHED_IN_FLIGHT
+    )
+
+
+def get_stale_output(
+    query, hostname=None, request_options=None, html=False, encoding=None
+):
+    """
+    The answer for ``query`` of the previous epoch (if it is cached) or None
+    """
+
+    query = normalize_query(query)
+    digest = get_cache_key(hostname, query, request_options)
+    variant = get_variant(request_options, html)
+    return _get_stale(digest, get_epoch(), variant, encoding)
+
+
+def _get_stale(digest, epoch, variant, encoding):
+    result = RESPONSE_CACHE.get_stale(digest, epoch, variant, encoding)
+    if result is None and encoding is not None:
+        result = RESPONSE_CACHE.get_stale(digest, epoch, variant)
+        if result is not None:
+            result = compress(result, encoding)
+    return result
+
+
+def get_cmd_output(hostname, topic, request_options, variant="ansi", encoding=None):
+    """
+    ``variant`` of the answer for ``topic``
+    (compressed with ``encoding``, as bytes, if it is specified)
+    """
+
+    digest = get_cache_key(hostname, topic, request_options)
+
+    epoch = get_epoch()
+    with METRICS.timer("cache"):
+        if encoding is None:
+            cached = RESPONSE_CACHE.get(digest, epoch, variant)
+        else:
+            cached = RESPONSE_CACHE.get_encoded(digest, epoch, variant, encoding)
+    if cached is not None:
+        return cached
+
+    # concurrent identical queries are rendered only once
+    try:
+        result, _ = SINGLE_FLIGHT.do(
+            (digest, epoch, variant, encoding),
+            _make_variant,
+            hostname,
             topic,
-        ]
+            request_options,
+            digest,
+            epoch,
+            variant,
+            encoding,
+        )
+    except SingleFlightError as e_msg:
+        # the rendering is too slow (or failed): the previous answer is served
+        # if it is cached, the query is not rendered again
+        result = _get_stale(digest, epoch, variant, encoding)
+        if result is None:
+            result = f"ERROR: {e_msg}\n"
+            if encoding is not None:
+                result = compress(result, encoding)
+    return result
 
-    config = request_options
-    config["currency"] = currency
-    answer = view.show(config)
 
-    if config.get("no-terminal"):
-        answer = remove_trailing_spaces(remove_ansi(answer))
+def _get_variant(
+    hostname, topic, request_options, digest, epoch, variant
+):  # pylint: disable=too-many-arguments
+    """
+    Cached ``variant`` of the answer or a newly made one,
+    and if it can be cached
+    """
+
+    cached = RESPONSE_CACHE.get(digest, epoch, variant)
+    if cached is not None:
+        return cached, True
+    return _make_variant(hostname, topic, request_options, digest, epoch, variant)
+
+
+def _make_variant(
+    hostname, topic, request_options, digest, epoch, variant, encoding=None
+):  # pylint: disable=too-many-arguments
+    """
+    Make ``variant`` of the answer for ``topic`` (compressed with ``encoding``
+    if it is specified) and save it in the cache.
+    Variants are made of the cached rendered answer (variant ``answer``),
+    and compressed variants are made of the cached variants;
+    the answer is rendered only if it is not cached yet.
+
+    Return the result and if it can be cached (errors and answers
+    of the unknown epoch are not cached).
+    """
+
+    if encoding is not None:
+        result, cacheable = _get_variant(
+            hostname, topic, request_options, digest, epoch, variant
+        )
+        result = compress(result, encoding)
+        if cacheable:
+            RESPONSE_CACHE.put_encoded(digest, epoch, result, variant, encoding)
+        return result, cacheable
+
+    if variant == "answer":
+        try:
+            result, cacheable = SINGLE_FLIGHT.do(
+                (digest, epoch), _render_cmd_output, hostname, topic, request_options
+            )
+        except SingleFlightError as e_msg:
+            return f"ERROR: {e_msg}\n", False
+    elif variant == "json":
+        result, cacheable = _get_json_output(hostname, topic, request_options)
+    else:
+        answer, cacheable = _get_variant(
+            hostname, topic, request_options, digest, epoch, "answer"
+        )
+        if "html" in variant:
+            try:
+                with METRICS.timer("html"):
+                    result = RENDER_POOL.run(format_output, answer, variant)
+            except RenderPoolError as e_msg:
+                return f"ERROR: {e_msg}\n", False
+        else:
+            result = format_output(answer, variant)
+
+    # the answers of the unknown epoch would never expire
+    cacheable = cacheable and epoch is not None
+    if cacheable:
+        RESPONSE_CACHE.put(digest, epoch, result, variant)
+    return result, cacheable
+
+
+MSG_USE_YOUR_COIN = "Use YOUR COIN instead of COIN in the query: for example btg.rate.sx, xvg.rate.sx, eth.rate.sx and so on\nTry:\n curl btg.rate.sx\n curl xvg.rate.sx\n curl xrb.rate.sx\n"
+
+
+def _get_currency(hostname):
+    """
+    Currency of the answer, specified in ``hostname`` (eur.rate.sx); USD by default.
+    COIN is returned for coin.rate.sx.
+    """
+
+    currency = hostname.lower()
+    if currency.endswith(".rate.sx"):
+        currency = currency[:-8].upper()
+
+    if currency == "COIN":
+        return currency
+
+    if (
+        currency not in currencies_names.SUPPORTED_CURRENCIES
+        and currency not in coins_names.COIN_NAMES_DICT
+        and currency != "coin"
+    ):
+        currency = "USD"
+    return currency
+
+
+def _json_default(value):
+    # numpy numbers and arrays
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _to_json(data):
+    return json.dumps(data, default=_json_default) + "\n"
+
+
+def _get_json_output(hostname, topic, request_options):
+    """
+    Data of the answer for ``topic`` as JSON: the first page table data,
+    the chart data or the calculation result. Nothing is rendered.
+    Return the answer and if it can be cached (errors are not cached).
+    """
+
+    currency = _get_currency(hostname)
+    if currency == "COIN":
+        return _to_json({"error": MSG_USE_YOUR_COIN}), False
+
+    if topic == ":firstpage":
+        config = dict(request_options)
+        config["currency"] = currency
+        _, data = view.load(config)
+        return _to_json(data), True
+
+    try:
+        result = calculator.calculate(topic.upper(), currency)
+    except ValueError as e_msg:
+        return _to_json({"error": str(e_msg)}), False
+    if result is not None:
+        return _to_json({"query": topic, "currency": currency, "result": result}), True
+
+    try:
+        data = draw.get_data(topic, use_currency=currency)
+    except RuntimeError as e_msg:
+        return _to_json({"error": str(e_msg)}), False
+    return _to_json(data), True
+
+
+def _render_cmd_output(hostname, topic, request_options):
+    """
+    Render ANSI answer for ``topic``.
+    Return the answer and if it can be cached (errors are not cached).
+    """
+
+    currency = _get_currency(hostname)
+    if currency == "COIN":
+        return MSG_USE_YOUR_COIN, False
+
+    if topic != ":firstpage":
+        try:
+            answer = calculator.calculate(topic.upper(), currency)
+            if answer:
+                answer = f"text {answer}"
+        except ValueError as e:
+            return f"ERROR: {e}\n", False
+
+        if answer is None:
+            try:
+                args = draw.load(topic, use_currency=currency)
+                with METRICS.timer("render"):
+                    answer = RENDER_POOL.run(draw.render, *args)
+            except RuntimeError as e:
+                return f"ERROR: {e}\n", False
+
+        if answer is not None:
+            return f"{answer}\n", True
+        else:
+            return f"ERROR: Can't parse your query: {topic}\n", False
+
+    config = dict(request_options)
+    config["currency"] = currency
+    try:
+        args = view.load(config)
+        with METRICS.timer("render"):
+            answer = RENDER_POOL.run(view.render, *args)
+    except RenderPoolError as e_msg:
+        return f"ERROR: {e_msg}\n", False
 
-    open(cache_file, "w").write(answer)
-    # p = Popen(cmd, stdout=PIPE, stderr=PIPE)
-    # answer = p.communicate()[0]
-    return answer
+    return answer, True
 
 
 def rewrite_aliases(word):
@@ -142,21 +446,7 @@ def rewrite_aliases(word):
     return word
 
 
-def html_wrapper(data):
-    p = Popen(
-        ["bash", ANSI2HTML, "--palette=xterm", "--bg=dark"],
-        stdin=PIPE,
-        stdout=PIPE,
-        stderr=PIPE,
-    )
-    data = data.encode("utf-8")
-    stdout, stderr = p.communicate(data)
-    if p.returncode != 0:
-        error((stdout + stderr).decode("utf-8"))
-    return stdout.decode("utf-8")
-
-
-def cmd_wrapper(query, hostname=None, request_options=None, html=False):
+def normalize_query(query):
 
     #
     # at the moment, we just remove trailing slashes
@@ -164,29 +454,58 @@ def cmd_wrapper(query, hostname=None, request_options=None, html=False):
     #
     query = query.rstrip("/")
 
-    query = rewrite_aliases(query)
+    return rewrite_aliases(query)
 
-    if query in INTERNAL_TOPICS:
-        result = get_internal(query)
-    else:
-        result = get_cmd_output(hostname, query, request_options)
 
-    if result and result.startswith("text "):
-        result = result[5:]
-        html = False
+def html_wrapper(data):
+    return ansi2html(data)
+
 
-    if html:
-        result = "\n".join(result.splitlines()[:-1])
-        result = result + "\n$"
-        result = html_wrapper(result)
-        title = "<title>rate.sx</title>"
-        result = re.sub("<head>", "<head>" + title, result)
-        if not request_options.get("quiet") or not request_options.get(
-            "no-follow-line"
-        ):
-            result = result.replace(
-                "</body>",
-                TWITTER_BUTTON + GITHUB_BUTTON + GITHUB_BUTTON_FOOTER + "</body>",
-            )
+def format_output(answer, variant):
+    """
+    Convert rendered ``answer`` to ``variant``.
+    Text answers (``text ...``) are not converted to HTML.
+    """
+
+    text = answer.startswith("text ")
+    if text:
+        answer = answer[5:]
 
+    if variant.startswith("plain"):
+        answer = remove_trailing_spaces(remove_ansi(answer))
+
+    if "html" not in variant or text:
+        return answer
+
+    result = "\n".join(answer.splitlines()[:-1])
+    result = result + "\n$"
+    result = html_wrapper(result)
+    title = "<title>rate.sx</title>"
+    result = re.sub("<head>", "<head>" + title, result)
+    if not variant.endswith("-nofollow"):
+        result = result.replace(
+            "</body>",
+            TWITTER_BUTTON + GITHUB_BUTTON + GITHUB_BUTTON_FOOTER + "</body>",
+        )
     return result
+
+
+def cmd_wrapper(query, hostname=None, request_options=None, html=False, encoding=None):
+    """
+    Answer for ``query``: HTML if ``html`` is set, otherwise ANSI
+    or plain text, compressed with ``encoding`` (bytes) if it is specified
+    """
+
+    query = normalize_query(query)
+
+    variant = get_variant(request_options, html)
+    if query in INTERNAL_TOPICS:
+        if variant == "json":
+            result = _to_json(get_internal_data(query))
+        else:
+            result = format_output(get_internal(query), variant)
+        if encoding is not None:
+            result = compress(result, encoding)
+        return result
+
+    return get_cmd_output(hostname, query, request_options, variant, encoding)
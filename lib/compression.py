@@ -0,0 +1,88 @@
+"""
+Compression of the responses (HTTP Content-Encoding).
+
+gzip is always available; brotli (br) and zstd are used
+if the ``brotli`` and ``zstandard`` modules are installed.
+
+Exports:
+
+    ENCODINGS
+    choose_encoding
+    compress
+"""
+
+import gzip
+from typing import Dict, Optional, Union
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# available encodings, the most preferred first
+ENCODINGS = (["br"] if brotli else []) + (["zstd"] if zstandard else []) + ["gzip"]
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+ZSTD_LEVEL = 10
+
+
+def compress(data: Union[str, bytes], encoding: str) -> bytes:
+    """
+    Compress ``data`` (str is encoded to UTF-8) with ``encoding``
+    """
+
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+
+    if encoding == "gzip":
+        # mtime=0: the same data are always compressed to the same bytes
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    if encoding == "br" and brotli:
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    if encoding == "zstd" and zstandard:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def _parse_accept_encoding(accept_encoding: str) -> Dict[str, float]:
+    result = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        result[name] = quality
+    return result
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    The best available encoding accepted by the client
+    (according to the ``Accept-Encoding`` header), or None
+    """
+
+    if not accept_encoding:
+        return None
+
+    accepted = _parse_accept_encoding(accept_encoding)
+    best = None
+    best_quality = 0.0
+    for encoding in ENCODINGS:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
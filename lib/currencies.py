@@ -3,7 +3,6 @@
 
 import sys
 import os
-import requests
 import json
 import calendar
 import time
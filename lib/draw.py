@@ -21,7 +21,7 @@
 
 16 [X] url support
 17 [ ] terminal size
-18 [ ] json output
+18 [X] json output
 
 19 [X] readme update
 20 [X]  intervals
@@ -45,6 +45,7 @@
 34 [X] add a warning if interval is truncated
 35 [ ] add a warning if one of the currencies is overridden
 """
+
 from __future__ import print_function
 
 import sys
@@ -53,7 +54,6 @@ import os
 import re
 from io import BytesIO
 
-import diagram
 from colorama import Fore, Back, Style
 
 MYDIR = os.path.abspath(os.path.dirname(os.path.dirname("__file__")))
@@ -67,6 +67,7 @@ import interval
 from ansi_utils import colorize_number
 from to_precision import to_precision
 from globals import MSG_SEE_HELP, MSG_INTERVAL
+from metrics import METRICS
 
 # pylint: enable=wrong-import-position
 
@@ -293,6 +294,8 @@ class Diagram(object):  # pylint: disable=too-many-instance-attributes
         return re.sub("{.*?}", _colorize_curlies_block, text)
 
     def _make_diagram(self):
+        # the diagram engine (and curses) is imported on the first diagram
+        import diagram  # pylint: disable=import-outside-toplevel
 
         class Option(
             object
@@ -408,7 +411,8 @@ def _parse_query(query):
         raise SyntaxError(f"Invalid coin/currency name: {coin2}")
 
     try:
-        time_begin, time_end = interval.parse_interval(interval_string)
+        with METRICS.timer("parse"):
+            time_begin, time_end = interval.parse_interval(interval_string)
     except OverflowError:
         # to be fixed: ranges like yesterday, today, now and so on
         raise RuntimeError(f"Wrong range specification: {interval_string}")
@@ -420,6 +424,10 @@ def _parse_query(query):
 
 
 def get_data(query, use_currency=None):
+    """
+    Aggregated data of the ``query`` diagram.
+    RuntimeError is raised if the query can't be parsed or there is no data.
+    """
 
     try:
         coin, coin2, time_begin, time_end = _parse_query(query)
@@ -444,15 +452,16 @@ def get_data(query, use_currency=None):
     else:
         data = aggregate.get_aggregated_coin(coin, time_begin, time_end, ticks)
 
+    if data["ticks"] == []:
+        raise RuntimeError("No data found for your query. Wrong range?")
+
     return data
 
 
-def view(query, use_currency=None):
+def load(query, use_currency=None):
     """
-    Main rendering function, entry point for this module.
-    Returns rendered view for the ``query``.
-    If currency is specified in ``query``, it overrides ``currency``.
-    If ``currency`` is not specified, USD is used.
+    Load the data for the ``query`` diagram (see view()).
+    Returns the arguments of render().
     """
 
     try:
@@ -465,9 +474,6 @@ def view(query, use_currency=None):
 
     data = get_data(query, use_currency=use_currency)
 
-    if data["ticks"] == []:
-        raise RuntimeError("No data found for your query. Wrong range?")
-
     warnings = []
     if data["meta"]["time_begin"] - time_begin > 3600 * 24:
         warnings.append(
@@ -481,10 +487,29 @@ def view(query, use_currency=None):
         currency=coin2 or "USD",
         warnings=warnings,
     )
-    dia = Diagram(data, (time_begin, time_end), options=options)
+    return data, (time_begin, time_end), options
+
+
+def render(data, interval_pair, options):
+    """
+    Draw the diagram of the loaded ``data`` (CPU only, no database access)
+    """
+
+    dia = Diagram(data, interval_pair, options=options)
     return dia.make_view()
 
 
+def view(query, use_currency=None):
+    """
+    Main rendering function, entry point for this module.
+    Returns rendered view for the ``query``.
+    If currency is specified in ``query``, it overrides ``currency``.
+    If ``currency`` is not specified, USD is used.
+    """
+
+    return render(*load(query, use_currency=use_currency))
+
+
 def main():
     "experimenting with get_aggregated_coin()"
 
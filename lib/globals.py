@@ -16,6 +16,73 @@ LOG_FILE = os.path.join(MYDIR, "log/main.log")
 FILE_QUERIES_LOG = os.path.join(MYDIR, "log/queries.log")
 TEMPLATES = os.path.join(MYDIR, "share/templates")
 STATIC = os.path.join(MYDIR, "share/static")
+CACHE_DIR = os.path.join(MYDIR, "cache")
+
+# HTTP server port and the number of the worker processes
+# (more than one: pre-fork mode, see lib/prefork.py)
+SERVER_PORT = int(os.environ.get("RATESX_PORT", 8004))
+SERVER_WORKERS = int(os.environ.get("RATESX_WORKERS", 1))
+SERVER_GRACEFUL_TIMEOUT = 30
+
+# size of the in-memory part of the responses cache
+CACHE_MEMORY_MAX_BYTES = 64 * 1024 * 1024
+
+# how long identical concurrent queries wait for the first one to be rendered
+SINGLE_FLIGHT_TIMEOUT = 30
+
+# rendering processes per server process (0: render in the server process),
+# rendering job timeout (seconds) and the maximal number of the waiting jobs
+RENDER_POOL_SIZE = int(os.environ.get("RATESX_RENDER_POOL_SIZE", 2))
+RENDER_TIMEOUT = 20
+RENDER_QUEUE_SIZE = 100
+
+# per-client rate limits of the route classes: cached answers,
+# rendering of the charts and of the first page (tokens per second, burst),
+# of every server worker: in the pre-fork mode a client can get
+# up to SERVER_WORKERS times these limits (see lib/rate_limit.py)
+RATE_LIMITS = {
+    "hit": (20, 100),
+    "chart": (2, 20),
+    "firstpage": (5, 50),
+}
+RATE_LIMIT_MAX_CLIENTS = 100000
+
+# load shedding: the answers are not rendered (the previous epoch answer
+# is served, if it is cached, or 503) when so many rendering jobs are waiting
+# for a free rendering process, or so many renderings are in progress
+SHED_QUEUE_DEPTH = 20
+SHED_IN_FLIGHT = 200
+
+# clients allowed to read /:metrics (the connection address; the queries
+# forwarded by the reverse proxy are denied, as it connects from the loopback too).
+# If METRICS_TOKEN is set, /:metrics is allowed to the queries with the header
+# "Authorization: Bearer <METRICS_TOKEN>" only
+METRICS_ALLOWED_IPS = ["127.0.0.1", "::1"]
+METRICS_TOKEN = os.environ.get("RATESX_METRICS_TOKEN")
+
+# cache warm-up (on start and on every new epoch): the keys (hostname, topic)
+# that are always warmed, the number of the most popular queries log keys
+# (in the last WARMUP_LOG_BYTES of the log) and the number of concurrent renderings
+WARMUP_KEYS = [
+    ("rate.sx", ":firstpage"),
+    ("eur.rate.sx", ":firstpage"),
+    ("btc.rate.sx", ":firstpage"),
+    ("rate.sx", "btc"),
+    ("rate.sx", "btc@24h"),
+    ("rate.sx", "eth"),
+]
+WARMUP_TOP_K = 50
+WARMUP_LOG_BYTES = 10 * 1024 * 1024
+WARMUP_CONCURRENCY = 2
+
+# queries log writer: queue size (lines), batch size (lines),
+# flush interval (seconds); rotation size (bytes, 0: no rotation)
+# and the number of the compressed archives
+QUERIES_LOG_QUEUE_SIZE = 10000
+QUERIES_LOG_BATCH_SIZE = 500
+QUERIES_LOG_FLUSH_INTERVAL = 1.0
+QUERIES_LOG_MAX_BYTES = 0
+QUERIES_LOG_BACKUPS = 10
 
 _g = lambda x: Fore.GREEN + x + Style.RESET_ALL  # pylint: disable=invalid-name
 MSG_GITHUB_BUTTON = (
@@ -46,7 +46,6 @@ import calendar
 import datetime
 import re
 from dateutil.relativedelta import relativedelta
-import dateparser
 from typing import Tuple
 
 INTERVAL_LENGTH = {
@@ -64,10 +63,18 @@ def _epoch(dt_tuple: datetime.datetime) -> int:
     return calendar.timegm(dt_tuple.timetuple())
 
 
+def _dateparser():
+    # dateparser takes long to import (regular expressions of many locales),
+    # so it is imported only when a date is really parsed
+    import dateparser  # pylint: disable=import-outside-toplevel
+
+    return dateparser
+
+
 def _parse_datetime(date_time: str) -> datetime.datetime:
     if date_time == "":
         return datetime.datetime.now()
-    return dateparser.parse(date_time)
+    return _dateparser().parse(date_time)
 
 
 def parse_datetime(date_time: str, now: None = None) -> int:
@@ -229,6 +236,7 @@ def parse_interval(
     #
     parsed = _parse_datetime(interval_string)
     if parsed is not None:
+        dateparser = _dateparser()
         if dateparser.parse(
             interval_string, settings={"RELATIVE_BASE": datetime.datetime(1, 1, 1)}
         ) != dateparser.parse(
@@ -0,0 +1,157 @@
+"""
+Request processing metrics in the Prometheus text format.
+
+Duration of every processing stage (query parsing, cache lookup, MongoDB
+commands, rendering, HTML conversion, log writing, the whole request)
+is collected into a histogram with fixed buckets; observing a value is
+a bisect and three additions, so the instrumentation is cheap.
+
+The metrics are per process: in the pre-fork mode every worker
+reports its own ones.
+
+Exports:
+
+    METRICS
+    Metrics
+"""
+
+import bisect
+import collections
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+# histogram buckets (seconds)
+BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+PREFIX = "ratesx"
+
+
+class Histogram(object):
+    """
+    Cumulative histogram of the observed values
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """
+        Add ``value`` to the histogram
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    items = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in sorted(labels.items())
+    )
+    return "{" + items + "}"
+
+
+class Metrics(object):
+    """
+    Stage histograms and counters of the process
+    """
+
+    def __init__(self) -> None:
+        self.stages = collections.defaultdict(Histogram)  # type: Dict[str, Histogram]
+        self.counters = collections.Counter()
+        self.in_flight = 0
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """
+        Record that ``stage`` took ``seconds``
+        """
+        self.stages[stage].observe(seconds)
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """
+        Measure the duration of the ``with`` block as ``stage``
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[stage].observe(time.perf_counter() - start)
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        """
+        Increase counter ``name`` with ``labels`` by ``value``
+        """
+        self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def render(self, gauges: List[Tuple[str, str, List[Tuple[dict, float]]]]) -> str:
+        """
+        All metrics in the Prometheus text format.
+        ``gauges`` are (name, help, [(labels, value), ...]) collected by the caller.
+        """
+
+        lines = [
+            f"# HELP {PREFIX}_stage_duration_seconds "
+            "Duration of the request processing stages",
+            f"# TYPE {PREFIX}_stage_duration_seconds histogram",
+        ]
+        for stage, histogram in sorted(self.stages.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                labels = _format_labels({"stage": stage, "le": str(bound)})
+                lines.append(
+                    f"{PREFIX}_stage_duration_seconds_bucket{labels} {cumulative}"
+                )
+            labels = _format_labels({"stage": stage, "le": "+Inf"})
+            lines.append(
+                f"{PREFIX}_stage_duration_seconds_bucket{labels} {histogram.count}"
+            )
+            labels = _format_labels({"stage": stage})
+            lines.append(f"{PREFIX}_stage_duration_seconds_sum{labels} {histogram.sum}")
+            lines.append(
+                f"{PREFIX}_stage_duration_seconds_count{labels} {histogram.count}"
+            )
+
+        counters = collections.defaultdict(list)
+        for (name, labels), value in sorted(self.counters.items()):
+            counters[name].append((dict(labels), value))
+        for name, samples in counters.items():
+            lines.append(f"# TYPE {PREFIX}_{name} counter")
+            for labels, value in samples:
+                lines.append(f"{PREFIX}_{name}{_format_labels(labels)} {value}")
+
+        gauges = [
+            ("requests_in_flight", "Requests being processed", [({}, self.in_flight)])
+        ] + list(gauges)
+        for name, help_text, samples in gauges:
+            lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}_{name} gauge")
+            for labels, value in samples:
+                lines.append(f"{PREFIX}_{name}{_format_labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
@@ -1,12 +1,18 @@
 """
 MongoDB client.
-Exports MonfoReader
+Exports MonfoReader, MongoWriter, BulkWriter and get_client()
 """
 
 import sys
 import os
+import collections
 import datetime
-from pymongo import MongoClient, ASCENDING
+import logging
+import threading
+import time
+import numpy as np
+from pymongo import MongoClient, ASCENDING, ReplaceOne, monitoring
+from pymongo.errors import BulkWriteError, PyMongoError
 from typing import Dict, List, Optional, Union
 
 MYDIR = os.path.abspath(os.path.dirname(os.path.dirname("__file__")))
@@ -14,27 +20,424 @@ sys.path.append(f"{MYDIR}/lib/")
 
 # pylint: disable=wrong-import-position
 import currencies_names
+from metrics import METRICS
+from tick_buffer import TickBuffer, TICK_INTERVAL, REFRESH_INTERVAL
 
 # pylint: enable=wrong-import-position
 
+# how far back the first page history (changes and sparklines) is looked up
+HISTORY_WINDOW = 25 * 3600
+
+# precomputed first page older than that is not used
+FIRSTPAGE_MAX_AGE = 2 * TICK_INTERVAL
+
+# currency factors are loaded for at least that window
+FACTORS_WINDOW = 25 * 3600
+# the loaded window of a currency is extended up to that size
+FACTORS_MAX_WINDOW = 31 * 24 * 3600
+# maximal number of currency factors kept in memory
+FACTORS_MAX_POINTS = 1000000
+
+MARKETCAP_FIELDS = [
+    "active_currencies",
+    "bitcoin_percentage_of_market_cap",
+    "last_updated",
+    "total_market_cap_usd",
+    "active_markets",
+    "active_assets",
+    "total_24h_volume_usd",
+]
+
+# aggregation progress: the next timestamp to aggregate of every coin and interval
+CHECKPOINTS_COLLECTION = "aggregate_checkpoints"
+
+# number of entries written by one bulk_write() call of BulkWriter
+BULK_BATCH_SIZE = 1000
+# at most that many write errors of a batch are logged
+BULK_LOGGED_ERRORS = 10
+
+MONGO_HOST = os.environ.get("MONGO_HOST", "localhost")
+MONGO_POOL_SIZE = int(os.environ.get("MONGO_POOL_SIZE", 100))
+
+#
+# process-wide connection pool, shared by all readers and writers
+#
+
+
+class _PoolWaitListener(monitoring.ConnectionPoolListener):
+    """
+    Measure how long the callers wait for a connection from the pool.
+    Check-out start time is kept in a thread local
+    (greenlet local, when the threading module is patched by gevent).
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self.checkouts = 0
+        self.failed_checkouts = 0
+        self.checked_out = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.monotonic()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, "started", None)
+        if started is not None:
+            wait_time = time.monotonic() - started
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+        self.checkouts += 1
+        self.checked_out += 1
+
+    def connection_check_out_failed(self, event):
+        self.failed_checkouts += 1
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+
+class _CommandListener(monitoring.CommandListener):
+    """
+    Count MongoDB commands and their duration (see metrics)
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        METRICS.observe("mongo", event.duration_micros / 1e6)
+        METRICS.inc("mongo_commands_total", command=event.command_name, status="ok")
+
+    def failed(self, event):
+        METRICS.observe("mongo", event.duration_micros / 1e6)
+        METRICS.inc("mongo_commands_total", command=event.command_name, status="failed")
+
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+_POOL_LISTENER = _PoolWaitListener()
+
+
+def get_client() -> MongoClient:
+    """
+    Return the process-wide MongoClient (created on the first call).
+    MongoDB host is taken from MONGO_HOST, the pool size from MONGO_POOL_SIZE.
+    """
+
+    global _CLIENT  # pylint: disable=global-statement
+
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                _CLIENT = MongoClient(
+                    host=MONGO_HOST,
+                    maxPoolSize=MONGO_POOL_SIZE,
+                    event_listeners=[_POOL_LISTENER, _CommandListener()],
+                )
+    return _CLIENT
+
+
+def _reset_client() -> None:
+    """
+    MongoClient is not fork-safe: the child process must create its own one.
+    """
+
+    global _CLIENT, _CLIENT_LOCK, _POOL_LISTENER  # pylint: disable=global-statement
+
+    _CLIENT = None
+    _CLIENT_LOCK = threading.Lock()
+    _POOL_LISTENER = _PoolWaitListener()
+
+
+os.register_at_fork(after_in_child=_reset_client)
+
+_EPOCH = {"timestamp": None, "checked_at": 0.0}
+
+
+def get_epoch() -> Optional[float]:
+    """
+    Timestamp of the latest coins data (the current collection epoch).
+
+    MongoDB is not queried until the next collection is due, and then
+    not more often than once in REFRESH_INTERVAL seconds. If MongoDB
+    is not available, the last known epoch is returned.
+    """
+
+    now = time.time()
+    timestamp = _EPOCH["timestamp"]
+    if timestamp is not None and now < timestamp + TICK_INTERVAL:
+        return timestamp
+    if now - _EPOCH["checked_at"] < REFRESH_INTERVAL:
+        return timestamp
+    _EPOCH["checked_at"] = now
+
+    try:
+        entry = get_client().ratesx.coins.find_one(
+            {}, {"timestamp": 1}, sort=[("timestamp", -1)]
+        )
+    except PyMongoError as e_msg:
+        logging.error("ERROR: can't get the current epoch: %s", e_msg)
+        return timestamp
+
+    if entry is not None:
+        _EPOCH["timestamp"] = entry["timestamp"]
+    return _EPOCH["timestamp"]
+
+
+_TICK_BUFFER = None
+
+
+def get_tick_buffer() -> TickBuffer:
+    """
+    Return the process-wide buffer of the latest coins ticks
+    (created on the first call).
+    """
+
+    global _TICK_BUFFER  # pylint: disable=global-statement
+
+    if _TICK_BUFFER is None:
+        _TICK_BUFFER = TickBuffer()
+    return _TICK_BUFFER
+
+
+def pool_stats() -> Dict[str, Union[int, float]]:
+    """
+    Connection pool statistics: pool size, number of checkouts,
+    connections in use and time spent waiting for a connection.
+    """
+
+    listener = _POOL_LISTENER
+    return {
+        "pool_size": MONGO_POOL_SIZE,
+        "checked_out": listener.checked_out,
+        "checkouts": listener.checkouts,
+        "failed_checkouts": listener.failed_checkouts,
+        "wait_time_total": listener.wait_time_total,
+        "wait_time_max": listener.wait_time_max,
+        "wait_time_avg": (
+            listener.wait_time_total / listener.checkouts if listener.checkouts else 0.0
+        ),
+    }
+
+
+class CurrencyFactorTable(object):
+    """
+    As-of lookup table of the currencies (and coins) USD prices.
+
+    For each currency, sorted arrays of timestamps and prices are loaded
+    in bulk for a time window, and the factors for any number of timestamps
+    are found with a binary search. Currencies are evicted in the LRU order
+    when the total number of stored points exceeds ``max_points``.
+    """
+
+    def __init__(self, max_points: int = FACTORS_MAX_POINTS) -> None:
+        self.max_points = max_points
+        self.points = 0
+        self._tables = collections.OrderedDict()
+
+    @staticmethod
+    def _fetch(
+        reader: "MongoReader", currency: str, time_start: float, time_end: float
+    ):
+        """
+        Timestamps and USD prices of ``currency`` from ``time_start``
+        to ``time_end``, and the last one before ``time_start``
+        """
+
+        if currency in currencies_names.SUPPORTED_CURRENCIES:
+            collection = reader.currencies
+            query = {currency: {"$exists": True}}
+            field = currency
+        else:
+            collection = reader.coins
+            query = {"symbol": currency}
+            field = "price_usd"
+        fields = {"timestamp": 1, field: 1, "_id": 0}
+
+        before = list(
+            collection.find(dict(query, timestamp={"$lt": time_start}), fields)
+            .sort([("timestamp", -1)])
+            .limit(1)
+        )
+        entries = before + list(
+            collection.find(
+                dict(query, timestamp={"$gt": time_start - 1, "$lt": time_end + 1}),
+                fields,
+            ).sort([("timestamp", 1)])
+        )
+
+        return (
+            np.array([x["timestamp"] for x in entries], dtype=np.float64),
+            np.array([x[field] for x in entries], dtype=np.float64),
+        )
+
+    def _store(self, currency: str, table: Dict) -> None:
+        old_table = self._tables.pop(currency, None)
+        if old_table is not None:
+            self.points -= old_table["timestamps"].shape[0]
+
+        self._tables[currency] = table
+        self.points += table["timestamps"].shape[0]
+
+        while self.points > self.max_points and len(self._tables) > 1:
+            _, evicted = self._tables.popitem(last=False)
+            self.points -= evicted["timestamps"].shape[0]
+
+    def _ensure(
+        self, reader: "MongoReader", currency: str, time_start: float, time_end: float
+    ) -> Dict:
+        """
+        Make sure the table of ``currency`` covers [``time_start``, ``time_end``]
+        and return it.
+
+        Data newer than one tick before the loading time can still arrive,
+        so it is reloaded (only the new part of it), but not more often than
+        once in REFRESH_INTERVAL seconds. The loaded range (``start``
+        to ``fetched``) is only extended, so a lookup of an older timestamp
+        never drops the newest prices.
+        """
+
+        now = time.time()
+        table = self._tables.get(currency)
+
+        if table is not None and table["start"] <= time_start:
+            self._tables.move_to_end(currency)
+            if time_end <= table["end"]:
+                return table
+            if (
+                time_end <= table["fetched"]
+                and now - table["loaded_at"] < REFRESH_INTERVAL
+            ):
+                return table
+
+            time_end = max(time_end, table["fetched"])
+            timestamps, prices = self._fetch(
+                reader, currency, table["timestamps"][-1] + 1, time_end
+            )
+            # the first entry is the last known one (before the new part)
+            table = {
+                "timestamps": np.concatenate([table["timestamps"], timestamps[1:]]),
+                "prices": np.concatenate([table["prices"], prices[1:]]),
+                "start": table["start"],
+                "end": max(table["end"], min(time_end, now - TICK_INTERVAL)),
+                "fetched": time_end,
+                "loaded_at": now,
+            }
+            self._store(currency, table)
+            return table
+
+        if (
+            table is not None
+            and max(time_end, table["fetched"]) - min(time_start, table["start"])
+            <= FACTORS_MAX_WINDOW
+        ):
+            # extend the existing window instead of creating a new one
+            time_start = min(time_start, table["start"])
+            time_end = max(time_end, table["fetched"])
+
+        timestamps, prices = self._fetch(reader, currency, time_start, time_end)
+        if timestamps.shape[0] == 0:
+            return None
+
+        table = {
+            "timestamps": timestamps,
+            "prices": prices,
+            "start": time_start,
+            "end": min(time_end, now - TICK_INTERVAL),
+            "fetched": time_end,
+            "loaded_at": now,
+        }
+        self._store(currency, table)
+        return table
+
+    def factors(
+        self, reader: "MongoReader", currency: str, timestamps: np.ndarray
+    ) -> np.ndarray:
+        """
+        Factors converting USD into ``currency`` for each of ``timestamps``
+        (the last known price not newer than the timestamp is used)
+        """
+
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        time_start = timestamps.min()
+        time_end = timestamps.max()
+        if time_end - time_start < FACTORS_WINDOW:
+            time_start = time_end - FACTORS_WINDOW
+
+        table = self._ensure(reader, currency, time_start, time_end)
+        if table is None:
+            if currency in currencies_names.SUPPORTED_CURRENCIES:
+                raise ValueError(f"Unknown currency: {currency}")
+            raise ValueError(f"Unknown coin/currency: {currency}")
+
+        indexes = np.searchsorted(table["timestamps"], timestamps, side="right") - 1
+        if indexes.min() < 0:
+            raise ValueError(f"No data for {currency} at {timestamps.min()}")
+
+        return 1 / table["prices"][indexes]
+
+
+CURRENCY_FACTORS = CurrencyFactorTable()
+
+
 #
 # functions that fetch needed data from mongodb
 #
 
 
-class MongoReader(object):  # pylint: disable=too-many-instance-attributes
+class _Collections(object):
     """
-    MongDB client
+    Collections of the ratesx database. The client is taken on the first use
+    (so the readers can be created at import time without connecting,
+    and they use the new client after fork).
     """
 
-    def __init__(self, config: Optional[Dict[str, Union[int, str]]] = None) -> None:
+    @property
+    def client(self) -> MongoClient:
+        return get_client()
+
+    @property
+    def coins(self):
+        return get_client().ratesx.coins
 
-        self.client = MongoClient()
+    @property
+    def marketcap(self):
+        return get_client().ratesx.marketcap
 
-        ratesx_db = self.client.ratesx
-        self.coins = ratesx_db.coins
-        self.marketcap = ratesx_db.marketcap
-        self.currencies = ratesx_db.currencies
+    @property
+    def currencies(self):
+        return get_client().ratesx.currencies
+
+
+class MongoReader(_Collections):  # pylint: disable=too-many-instance-attributes
+    """
+    MongDB client
+    """
+
+    def __init__(self, config: Optional[Dict[str, Union[int, str]]] = None) -> None:
 
         if config is None:
             config = {}
@@ -47,7 +450,6 @@ class MongoReader(object):  # pylint: disable=too-many-instance-attributes
         else:
             self.is_currency_coin = True
 
-        self._currency_factor_cache = {}
         self._spark_price_currency_ticks = []
 
     def currency_factor(
@@ -69,40 +471,90 @@ class MongoReader(object):  # pylint: disable=too-many-instance-attributes
         if currency == "USD":
             return 1
 
-        # we use cache only if timestamp is specified
-        if timestamp and (currency, timestamp) in self._currency_factor_cache:
-            return self._currency_factor_cache[(currency, timestamp)]
-
-        query = {}
-        if timestamp:
-            query["timestamp"] = {"$lt": timestamp + 1}
-
-        if is_currency_coin:
-            query.update({"symbol": currency})
-            try:
-                price_symbol = (
-                    self.coins.find(query, {"price_usd": 1})
-                    .sort([("timestamp", -1)])
-                    .limit(1)[0]["price_usd"]
+        if is_currency_coin and timestamp:
+            ticks = get_tick_buffer()
+            if ticks.covers(timestamp, history=0):
+                price_symbol = ticks.value_at(currency, timestamp)
+                if price_symbol:
+                    return 1 / price_symbol
+
+        if not timestamp:
+            timestamp = time.time()
+
+        return float(self.currency_factors([timestamp], currency=currency)[0])
+
+    def currency_factors(
+        self, timestamps: List[float], currency: Optional[str] = None
+    ) -> np.ndarray:
+        """
+        Factors that are used to convert values in <self.currency> in USD
+        for each of <timestamps> (see CurrencyFactorTable)
+        """
+
+        if currency is None:
+            currency = self.currency
+
+        if currency == "USD":
+            return np.ones(len(timestamps))
+
+        return CURRENCY_FACTORS.factors(self, currency, timestamps)
+
+    def _spark_currency_ticks(self, timestamp: float) -> List[float]:
+        """
+        Price of <self.currency> in USD for the last ticks up to <timestamp>
+        (the denominator of the sparklines). Loaded once per reader.
+        """
+
+        if self._spark_price_currency_ticks != []:
+            return self._spark_price_currency_ticks
+
+        ticks = self.number_of_ticks + 1
+        if self.is_currency_coin:
+            ticks_buffer = get_tick_buffer()
+            if ticks_buffer.covers(timestamp, history=ticks * TICK_INTERVAL):
+                self._spark_price_currency_ticks = (
+                    ticks_buffer.last(self.currency, timestamp, ticks) or []
+                )
+            if self._spark_price_currency_ticks != []:
+                return self._spark_price_currency_ticks
+
+            self._spark_price_currency_ticks = [
+                x["price_usd"]
+                for x in self.coins.find(
+                    {"symbol": self.currency, "timestamp": {"$lt": timestamp + 1}}
                 )
-            except IndexError:
-                raise ValueError(f"Unknown coin/currency: {currency}")
+                .sort([("timestamp", -1)])
+                .limit(ticks)
+            ][::-1]
         else:
-            query.update({currency: {"$exists": True}})
-            try:
-                price_symbol = (
-                    self.currencies.find(query, {currency: 1})
-                    .sort([("timestamp", -1)])
-                    .limit(1)[0][currency]
+            self._spark_price_currency_ticks = [
+                x[self.currency]
+                for x in self.currencies.find(
+                    {
+                        self.currency: {"$exists": True},
+                        "timestamp": {"$lt": timestamp + 1},
+                    }
                 )
-            except IndexError:
-                raise ValueError(f"Unknown currency: {currency}")
+                .sort([("timestamp", -1)])
+                .limit(ticks)
+            ][::-1]
 
-        # we use cache only if timestamp is specified
-        if timestamp:
-            self._currency_factor_cache[(currency, timestamp)] = 1 / price_symbol
+        return self._spark_price_currency_ticks
 
-        return 1 / price_symbol
+    def _spark_in_currency(
+        self, price_usd_ticks: List[float], timestamp: float
+    ) -> List[float]:
+        """
+        Convert USD sparkline ticks into <self.currency>
+        """
+
+        if self.currency == "USD":
+            return price_usd_ticks
+
+        return [
+            x / y
+            for x, y in zip(price_usd_ticks, self._spark_currency_ticks(timestamp))
+        ]
 
     def load_spark(self, symbol: str, timestamp: float) -> List[float]:
         """
@@ -110,6 +562,13 @@ class MongoReader(object):  # pylint: disable=too-many-instance-attributes
         """
 
         ticks = self.number_of_ticks + 1
+
+        ticks_buffer = get_tick_buffer()
+        if ticks_buffer.covers(timestamp, history=ticks * TICK_INTERVAL):
+            price_usd_ticks = ticks_buffer.last(symbol, timestamp, ticks)
+            if price_usd_ticks is not None:
+                return self._spark_in_currency(price_usd_ticks, timestamp)
+
         price_usd_ticks = [
             (x["timestamp"], x["price_usd"])
             for x in self.coins.find(
@@ -120,39 +579,7 @@ class MongoReader(object):  # pylint: disable=too-many-instance-attributes
         ][::-1]
         price_usd_ticks = [x[1] for x in price_usd_ticks]
 
-        if self.currency == "USD":
-            price_ticks = price_usd_ticks
-        elif self.is_currency_coin:
-            if self._spark_price_currency_ticks == []:
-                self._spark_price_currency_ticks = [
-                    x["price_usd"]
-                    for x in self.coins.find(
-                        {"symbol": self.currency, "timestamp": {"$lt": timestamp + 1}}
-                    )
-                    .sort([("timestamp", -1)])
-                    .limit(ticks)
-                ][::-1]
-            price_ticks = [
-                x / y for x, y in zip(price_usd_ticks, self._spark_price_currency_ticks)
-            ]
-        else:
-            if self._spark_price_currency_ticks == []:
-                self._spark_price_currency_ticks = [
-                    x[self.currency]
-                    for x in self.currencies.find(
-                        {
-                            self.currency: {"$exists": True},
-                            "timestamp": {"$lt": timestamp + 1},
-                        }
-                    )
-                    .sort([("timestamp", -1)])
-                    .limit(ticks)
-                ][::-1]
-            price_ticks = [
-                x / y for x, y in zip(price_usd_ticks, self._spark_price_currency_ticks)
-            ]
-
-        return price_ticks
+        return self._spark_in_currency(price_usd_ticks, timestamp)
 
     def mng_load_marketcap_global_data(
         self, timestamp: None = None
@@ -173,15 +600,7 @@ class MongoReader(object):  # pylint: disable=too-many-instance-attributes
             data = self.marketcap.find_one({"timestamp": timestamp})
 
         answer = {}
-        for field in [
-            "active_currencies",
-            "bitcoin_percentage_of_market_cap",
-            "last_updated",
-            "total_market_cap_usd",
-            "active_markets",
-            "active_assets",
-            "total_24h_volume_usd",
-        ]:
+        for field in MARKETCAP_FIELDS:
             if field.endswith("_usd"):
                 answer[field] = self.currency_factor(timestamp=timestamp) * data[field]
             else:
@@ -189,102 +608,280 @@ class MongoReader(object):  # pylint: disable=too-many-instance-attributes
 
         return answer
 
-    def mng_load_coins_data(
-        self, timestamp: None = None
+    def _load_history(
+        self, symbols: List[str], timestamp: float
+    ) -> Dict[str, Dict[str, Union[float, List[float]]]]:
+        """
+        Load history of <symbols> needed for the first page in one aggregation:
+        price 1h and 24h before <timestamp> and the sparkline ticks.
+        If the ticks buffer covers the last 24 hours, MongoDB is not queried.
+
+        Returns dictionary symbol -> {"price_1h", "price_24h", "spark"}
+        """
+
+        ticks = self.number_of_ticks + 1
+
+        ticks_buffer = get_tick_buffer()
+        if ticks_buffer.covers(timestamp):
+            return {
+                symbol: {
+                    "price_1h": ticks_buffer.value_at(symbol, timestamp - 3600) or 0,
+                    "price_24h": ticks_buffer.value_at(symbol, timestamp - 24 * 3600)
+                    or 0,
+                    "spark": ticks_buffer.last(symbol, timestamp, ticks),
+                }
+                for symbol in symbols
+                if symbol in ticks_buffer.symbols
+            }
+
+        def price_before(timedelta):
+            # the last tick not newer than <timestamp> - <timedelta>
+            return {
+                "$arrayElemAt": [
+                    {
+                        "$filter": {
+                            "input": "$ticks",
+                            "cond": {"$lte": ["$$this.t", timestamp - timedelta]},
+                        }
+                    },
+                    -1,
+                ]
+            }
+
+        pipeline = [
+            {
+                "$match": {
+                    "symbol": {"$in": symbols},
+                    "timestamp": {
+                        "$gt": timestamp - HISTORY_WINDOW,
+                        "$lt": timestamp + 1,
+                    },
+                }
+            },
+            {"$project": {"symbol": 1, "timestamp": 1, "price_usd": 1}},
+            {"$sort": {"timestamp": 1}},
+            {
+                "$group": {
+                    "_id": "$symbol",
+                    "ticks": {"$push": {"t": "$timestamp", "p": "$price_usd"}},
+                }
+            },
+            {
+                "$project": {
+                    "spark": {"$slice": ["$ticks.p", -ticks]},
+                    "before_1h": price_before(3600),
+                    "before_24h": price_before(24 * 3600),
+                }
+            },
+        ]
+
+        history = {}
+        for entry in self.coins.aggregate(pipeline):
+            history[entry["_id"]] = {
+                "price_1h": entry.get("before_1h", {}).get("p", 0),
+                "price_24h": entry.get("before_24h", {}).get("p", 0),
+                "spark": entry["spark"],
+            }
+        return history
+
+    def _coins_rows(
+        self, coins: List[Dict], timestamp: float
     ) -> List[Dict[str, Union[str, float, List[float]]]]:
         """
-        Load coins data from MongoDB
+        Convert USD coins data (see _load_coins_usd) into the table rows
+        in <self.currency>
         """
 
-        def get_change(symbol, price_usd, timestamp, timedelta):
+        def get_change(price_before, price, timedelta):
             """
-            Find change (in percents) of <symbols> between <timestamp>-<timedelta> and <timestamp>
+            Find change (in percents) of <price> compared to <price_before>
+            (<timedelta> seconds ago)
             """
-            try:
-                price_before = (
-                    self.coins.find(
-                        {
-                            "symbol": symbol,
-                            "timestamp": {"$lt": timestamp - timedelta + 1},
-                        }
-                    )
-                    .sort([("timestamp", -1)])
-                    .limit(1)[0]["price_usd"]
-                )
-            except IndexError:
-                price_before = 0
-
             price_before = price_before * self.currency_factor(
                 timestamp=timestamp - timedelta
             )
-            price = price_usd * self.currency_factor(timestamp=timestamp)
+            price = price * self.currency_factor(timestamp=timestamp)
 
             if price_before != 0:
                 return (price - price_before) * 100 / price_before
             else:
                 return 0
 
-        if timestamp is None:
-            timestamp = (
-                self.coins.find({}, {"timestamp": 1})
-                .sort([("timestamp", -1)])
-                .limit(1)[0]["timestamp"]
-            )
-
-        number_of_coins = self.number_of_coins
-
         data = []
-        for entry in self.coins.find(
-            {"rank": {"$lt": number_of_coins + 1}, "timestamp": timestamp}
-        ):
-            try:
-                symbol = entry["symbol"]
-            except KeyError:
-                symbol = "-"
-
-            try:
-                price = entry["price_usd"] * self.currency_factor(timestamp=timestamp)
-            except KeyError:
+        for coin in coins:
+            price_usd = coin["price_usd"]
+            market_cap_usd = coin["market_cap_usd"]
+
+            if price_usd is None:
                 price = "-"
+            else:
+                price = price_usd * self.currency_factor(timestamp=timestamp)
 
-            try:
-                change_24h = get_change(
-                    entry["symbol"], entry["price_usd"], timestamp, 24 * 3600
-                )
-            except KeyError:
+            if price_usd is None or coin["spark"] is None:
                 change_24h = "-"
-
-            try:
-                change_1h = get_change(
-                    entry["symbol"], entry["price_usd"], timestamp, 3600
-                )
-            except KeyError:
                 change_1h = "-"
+                spark = "-"
+            else:
+                change_24h = get_change(coin["price_usd_24h"], price_usd, 24 * 3600)
+                change_1h = get_change(coin["price_usd_1h"], price_usd, 3600)
+                spark = self._spark_in_currency(coin["spark"], timestamp)
 
-            try:
-                cap = entry["market_cap_usd"] * self.currency_factor(timestamp)
-            except KeyError:
+            if market_cap_usd is None:
                 cap = "-"
+            else:
+                cap = market_cap_usd * self.currency_factor(timestamp)
+
+            data.append(
+                {
+                    "code": coin["symbol"],
+                    "price": price,
+                    "change_24h": change_24h,
+                    "change_1h": change_1h,
+                    "cap": cap,
+                    "spark": spark,
+                }
+            )
 
-            try:
-                spark = self.load_spark(entry["symbol"], timestamp)
-            except KeyError:
-                spark = "-"
+        return data
 
-            entry = {
-                "code": symbol,
-                "price": price,
-                "change_24h": change_24h,
-                "change_1h": change_1h,
-                "cap": cap,
-                "spark": spark,
-            }
-            data.append(entry)
+    def _load_coins_usd(
+        self, timestamp: float, entries: Optional[List[Dict]] = None
+    ) -> List[Dict]:
+        """
+        Load current values and history of the top <self.number_of_coins> coins
+        at <timestamp>, in USD. Current <entries> (as in the coins collection)
+        are loaded from the database if not specified.
+
+        The number of queries does not depend on the number of coins:
+        one query for the current snapshot, one aggregation for the history
+        (changes and sparklines). When the ticks buffer is filled,
+        the coins data is taken from it.
+        """
 
-        return data
+        number_of_coins = self.number_of_coins
+
+        ticks_buffer = get_tick_buffer()
+        if entries is not None:
+            entries = sorted(
+                [x for x in entries if x.get("rank", 0) < number_of_coins + 1],
+                key=lambda x: x.get("rank", 0),
+            )
+        elif ticks_buffer.covers(timestamp):
+            entries = ticks_buffer.snapshot(timestamp, number_of_coins)
+        else:
+            entries = list(
+                self.coins.find(
+                    {"rank": {"$lt": number_of_coins + 1}, "timestamp": timestamp}
+                ).sort([("rank", 1)])
+            )
+        history = self._load_history(
+            [x["symbol"] for x in entries if "symbol" in x], timestamp
+        )
+
+        coins = []
+        for entry in entries:
+            symbol = entry.get("symbol", "-")
+            coin_history = history.get(symbol, {})
+            coins.append(
+                {
+                    "symbol": symbol,
+                    "rank": entry.get("rank"),
+                    "price_usd": entry.get("price_usd"),
+                    "market_cap_usd": entry.get("market_cap_usd"),
+                    "price_usd_1h": coin_history.get("price_1h"),
+                    "price_usd_24h": coin_history.get("price_24h"),
+                    "spark": coin_history.get("spark"),
+                }
+            )
+
+        return coins
+
+    def _latest_timestamp(self) -> float:
+        """
+        Timestamp of the latest coins data
+        """
+
+        ticks_buffer = get_tick_buffer()
+        ticks_buffer.refresh(self.coins)
+        if ticks_buffer.last_timestamp is not None:
+            return ticks_buffer.last_timestamp
+
+        return (
+            self.coins.find({}, {"timestamp": 1})
+            .sort([("timestamp", -1)])
+            .limit(1)[0]["timestamp"]
+        )
+
+    def mng_load_coins_data(
+        self, timestamp: None = None
+    ) -> List[Dict[str, Union[str, float, List[float]]]]:
+        """
+        Load coins data from MongoDB
+        """
+
+        if timestamp is None:
+            timestamp = self._latest_timestamp()
+
+        return self._coins_rows(self._load_coins_usd(timestamp), timestamp)
+
+    def build_firstpage(
+        self, timestamp: float, entries: Optional[List[Dict]] = None
+    ) -> Dict:
+        """
+        Precompute the first page for <timestamp> (in USD):
+        current values, changes and sparklines of the top <self.number_of_coins>
+        coins and the global marketcap data. The result is stored
+        in the firstpage collection (see MongoWriter.write_firstpage)
+        """
+
+        coins = self._load_coins_usd(timestamp, entries=entries)
+        for coin in coins:
+            for suffix in ["1h", "24h"]:
+                price_before = coin[f"price_usd_{suffix}"]
+                if coin["price_usd"] is None or not price_before:
+                    coin[f"change_{suffix}"] = 0
+                else:
+                    coin[f"change_{suffix}"] = (
+                        (coin["price_usd"] - price_before) * 100 / price_before
+                    )
+
+        marketcap = self.marketcap.find_one(sort=[("timestamp", -1)]) or {}
+
+        return {
+            "timestamp": timestamp,
+            "number_of_ticks": self.number_of_ticks,
+            "coins": coins,
+            "marketcap": {
+                field: marketcap[field]
+                for field in MARKETCAP_FIELDS
+                if field in marketcap
+            },
+        }
+
+    def load_firstpage(self) -> Optional[
+        Dict[
+            str,
+            Union[
+                List[Dict[str, Union[str, float, List[float]]]],
+                Dict[str, Union[int, float]],
+            ],
+        ]
+    ]:
+        """
+        Load the latest precomputed first page (see build_firstpage),
+        take the top <self.number_of_coins> coins and convert them
+        into <self.currency>. The snapshot is loaded once per epoch
+        and shared by all currencies (see FirstPageConverter).
+
+        Return None if there is no recent precomputed first page
+        for <self.number_of_ticks>.
+        """
+
+        return FIRSTPAGE_CONVERTER.convert(self)
 
     def load_from_mongo(
         self,
+        mode: str = "live",
     ) -> Dict[
         str,
         Union[
@@ -294,14 +891,25 @@ class MongoReader(object):  # pylint: disable=too-many-instance-attributes
         ],
     ]:
         """
-        load all data from mongodb
+        load all data from mongodb.
+
+        In the "snapshot" mode, the precomputed first page is used
+        (one query instead of the query fan-out of the "live" mode);
+        if it is not available, the data is loaded live.
         """
 
-        return {
-            "data": self.mng_load_coins_data(),
-            "marketcap_global_data": self.mng_load_marketcap_global_data(),
-            "timestamp_now": f"{datetime.datetime.utcnow()} UTC",
-        }
+        answer = None
+        if mode == "snapshot":
+            answer = self.load_firstpage()
+
+        if answer is None:
+            answer = {
+                "data": self.mng_load_coins_data(),
+                "marketcap_global_data": self.mng_load_marketcap_global_data(),
+            }
+
+        answer["timestamp_now"] = f"{datetime.datetime.utcnow()} UTC"
+        return answer
 
     def get_raw_data(
         self, coin, start_time, stop_time, fields=None, collection_name=None
@@ -363,8 +971,290 @@ class MongoReader(object):  # pylint: disable=too-many-instance-attributes
             return data[0]["timestamp"]
         return None
 
+    def get_symbols(self, collection_name=None):
+        """
+        Symbols of all coins of ``collection_name`` (coins by default)
+        """
+
+        if collection_name:
+            coins = self.client.ratesx[collection_name]
+        else:
+            coins = self.coins
+
+        return coins.distinct("symbol")
+
+    def get_checkpoint(self, coin, interval_name):
+        """
+        Aggregation checkpoint of ``coin`` (None for currencies)
+        and ``interval_name``: the next timestamp to aggregate, or None
+        """
+
+        entry = self.client.ratesx[CHECKPOINTS_COLLECTION].find_one(
+            {"coin": coin, "interval": interval_name}
+        )
+        if entry:
+            return entry["timestamp"]
+        return None
+
+    def aggregate(self, pipeline, collection_name=None):
+        """
+        Run the aggregation ``pipeline`` on ``collection_name``
+        (coins by default) and return the resulting documents.
+        """
+
+        if collection_name:
+            coins = self.client.ratesx[collection_name]
+        else:
+            coins = self.coins
+
+        return list(coins.aggregate(pipeline, allowDiskUse=True))
+
+
+class FirstPageConverter(object):  # pylint: disable=too-many-instance-attributes
+    """
+    Derives the first page in every currency from the USD snapshot
+    (see MongoReader.build_firstpage).
 
-class MongoWriter(object):
+    The snapshot and the currency denominators (USD price of the currency
+    now, 1h and 24h ago, and for the sparkline ticks) are loaded once
+    per collection epoch. Conversion is vectorized and does not query
+    the database.
+    """
+
+    def __init__(self) -> None:
+        self.firstpage = None
+        self.arrays = {}
+        self.symbols = {}
+        self._denominators = {}
+        self._currencies_docs = None
+        self._checked_at = 0.0
+
+    def _load(self, reader: "MongoReader") -> None:
+        """
+        Load the latest snapshot, if a new one can be already there
+        """
+
+        now = time.time()
+        if (
+            self.firstpage is not None
+            and now < self.firstpage["timestamp"] + TICK_INTERVAL
+            and self.firstpage["timestamp"] >= (get_epoch() or 0)
+        ):
+            return
+        if now - self._checked_at < REFRESH_INTERVAL:
+            return
+        self._checked_at = now
+
+        firstpage = reader.client.ratesx.firstpage.find_one(
+            {"timestamp": {"$gt": now - FIRSTPAGE_MAX_AGE}},
+            sort=[("timestamp", -1)],
+        )
+        if firstpage is None:
+            self.firstpage = None
+            return
+        if (
+            self.firstpage is not None
+            and firstpage["timestamp"] == self.firstpage["timestamp"]
+        ):
+            return
+
+        coins = firstpage["coins"]
+        ticks = firstpage["number_of_ticks"] + 1
+
+        def vector(field):
+            return np.array(
+                [np.nan if x[field] is None else x[field] for x in coins],
+                dtype=np.float64,
+            )
+
+        # sparklines are aligned to the left and padded with NaN
+        spark = np.full((len(coins), ticks), np.nan)
+        for i, coin in enumerate(coins):
+            if coin["spark"]:
+                spark[i, : len(coin["spark"][:ticks])] = coin["spark"][:ticks]
+
+        self.arrays = {
+            "price_usd": vector("price_usd"),
+            "market_cap_usd": vector("market_cap_usd"),
+            "price_usd_1h": np.nan_to_num(vector("price_usd_1h")),
+            "price_usd_24h": np.nan_to_num(vector("price_usd_24h")),
+            "spark": spark,
+            "has_spark": np.array([bool(x["spark"]) for x in coins]),
+        }
+        self.symbols = {coin["symbol"]: i for i, coin in enumerate(coins)}
+        self._denominators = {}
+        self._currencies_docs = None
+        self.firstpage = firstpage
+
+    def _load_currencies_docs(self, reader: "MongoReader") -> Dict:
+        """
+        Currencies documents (USD prices of all currencies) needed
+        for the denominators: as of now, 1h and 24h ago, and the spark ticks.
+        """
+
+        if self._currencies_docs is not None:
+            return self._currencies_docs
+
+        timestamp = self.firstpage["timestamp"]
+        ticks = self.firstpage["number_of_ticks"] + 1
+
+        def as_of(timestamp):
+            return (
+                reader.currencies.find_one(
+                    {"timestamp": {"$lt": timestamp + 1}}, sort=[("timestamp", -1)]
+                )
+                or {}
+            )
+
+        self._currencies_docs = {
+            "now": as_of(timestamp),
+            "1h": as_of(timestamp - 3600),
+            "24h": as_of(timestamp - 24 * 3600),
+            "spark": list(
+                reader.currencies.find({"timestamp": {"$lt": timestamp + 1}})
+                .sort([("timestamp", -1)])
+                .limit(ticks)
+            )[::-1],
+        }
+        return self._currencies_docs
+
+    def _get_denominators(self, reader: "MongoReader") -> Dict:
+        """
+        Factors converting USD into <reader.currency> now, 1h and 24h ago,
+        and USD prices of the currency for the sparkline ticks
+        """
+
+        currency = reader.currency
+        if currency in self._denominators:
+            return self._denominators[currency]
+
+        timestamp = self.firstpage["timestamp"]
+        if reader.is_currency_coin and currency in self.symbols:
+            # the snapshot already contains everything we need
+            row = self.symbols[currency]
+            prices = [
+                self.arrays[field][row]
+                for field in ["price_usd", "price_usd_1h", "price_usd_24h"]
+            ]
+            spark = self.arrays["spark"][row]
+            spark = spark[~np.isnan(spark)]
+        elif not reader.is_currency_coin:
+            docs = self._load_currencies_docs(reader)
+            prices = [docs[x].get(currency) for x in ["now", "1h", "24h"]]
+            spark = [x[currency] for x in docs["spark"] if currency in x]
+            if len(spark) < len(docs["spark"]):
+                # the currency is missing in some of the last documents
+                spark = reader._spark_currency_ticks(timestamp)
+            spark = np.array(spark)
+        else:
+            prices = [None]
+            spark = None
+
+        if all(prices):
+            factors = [1 / x for x in prices]
+        else:
+            factors = [
+                reader.currency_factor(timestamp=timestamp - x)
+                for x in [0, 3600, 24 * 3600]
+            ]
+            spark = np.array(reader._spark_currency_ticks(timestamp))
+
+        denominators = {
+            "factor": factors[0],
+            "factor_1h": factors[1],
+            "factor_24h": factors[2],
+            "spark": spark,
+        }
+        self._denominators[currency] = denominators
+        return denominators
+
+    def convert(self, reader: "MongoReader") -> Optional[Dict]:
+        """
+        The first page for the top <reader.number_of_coins> coins
+        in <reader.currency>.
+
+        Return None if there is no recent snapshot
+        for <reader.number_of_ticks>, or if it is older than the current epoch
+        (the collector writes the coins before the snapshot, and the answer
+        would be cached under the new epoch).
+        """
+
+        self._load(reader)
+
+        firstpage = self.firstpage
+        number_of_coins = reader.number_of_coins
+        if (
+            firstpage is None
+            or firstpage["timestamp"] < time.time() - FIRSTPAGE_MAX_AGE
+            or firstpage["timestamp"] < (get_epoch() or 0)
+            or firstpage["number_of_ticks"] != reader.number_of_ticks
+            or len(firstpage["coins"]) < number_of_coins
+        ):
+            return None
+
+        arrays = {name: value[:number_of_coins] for name, value in self.arrays.items()}
+        spark = arrays["spark"]
+        if reader.currency == "USD":
+            factor, factor_1h, factor_24h = 1, 1, 1
+        else:
+            denominators = self._get_denominators(reader)
+            factor = denominators["factor"]
+            factor_1h = denominators["factor_1h"]
+            factor_24h = denominators["factor_24h"]
+            length = min(spark.shape[1], denominators["spark"].shape[0])
+            spark = spark[:, :length] / denominators["spark"][:length]
+
+        price = arrays["price_usd"] * factor
+        cap = arrays["market_cap_usd"] * factor
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            changes = []
+            for price_before in [
+                arrays["price_usd_24h"] * factor_24h,
+                arrays["price_usd_1h"] * factor_1h,
+            ]:
+                changes.append(
+                    np.where(
+                        price_before != 0,
+                        (price - price_before) * 100 / price_before,
+                        0,
+                    )
+                )
+        change_24h, change_1h = changes
+
+        data = []
+        for i, coin in enumerate(firstpage["coins"][:number_of_coins]):
+            has_price = not np.isnan(price[i])
+            has_history = has_price and arrays["has_spark"][i]
+            row_spark = spark[i]
+            data.append(
+                {
+                    "code": coin["symbol"],
+                    "price": float(price[i]) if has_price else "-",
+                    "change_24h": float(change_24h[i]) if has_history else "-",
+                    "change_1h": float(change_1h[i]) if has_history else "-",
+                    "cap": "-" if np.isnan(cap[i]) else float(cap[i]),
+                    "spark": (
+                        row_spark[~np.isnan(row_spark)].tolist() if has_history else "-"
+                    ),
+                }
+            )
+
+        marketcap = {
+            field: value * factor if field.endswith("_usd") else value
+            for field, value in firstpage["marketcap"].items()
+        }
+
+        return {
+            "data": data,
+            "marketcap_global_data": marketcap,
+        }
+
+
+FIRSTPAGE_CONVERTER = FirstPageConverter()
+
+
+class MongoWriter(_Collections):
     """
     MongoDB writer client.
     Provides insert() for data writing.
@@ -372,14 +1262,13 @@ class MongoWriter(object):
 
     def __init__(self):
 
-        self.client = MongoClient()
-
-        ratesx_db = self.client.ratesx
-        self.coins = ratesx_db.coins
-        self.marketcap = ratesx_db.marketcap
-        self.currencies = ratesx_db.currencies
-
-        self.allowed_collections = ["coins_1h", "coins_24h", "currencies_1h"]
+        self.allowed_collections = [
+            "coins_1h",
+            "coins_24h",
+            "currencies_1h",
+            "firstpage",
+            CHECKPOINTS_COLLECTION,
+        ]
 
     def _get_collection(self, collection_name=None):
         if collection_name:
@@ -404,23 +1293,215 @@ class MongoWriter(object):
             if collection_name.startswith("currencies_"):
                 coins.create_index([("timestamp", ASCENDING)], unique=False)
 
+            if collection_name == "firstpage":
+                coins.create_index([("timestamp", ASCENDING)], unique=True)
+
+            if collection_name == CHECKPOINTS_COLLECTION:
+                coins.create_index(
+                    [("coin", ASCENDING), ("interval", ASCENDING)], unique=True
+                )
+
         return coins
 
     def update(self, entry, collection_name=None):
         "coll.replace_one() wrapper"
 
         coins = self._get_collection(collection_name)
-        if "symbol" in entry:
-            coins.replace_one(
-                {"symbol": entry["symbol"], "timestamp": entry["timestamp"]},
-                entry,
-                True,
-            )
-        else:
-            coins.replace_one({"timestamp": entry["timestamp"]}, entry, True)
+        coins.replace_one(_entry_key(entry), entry, True)
 
     def insert_many(self, entries, collection_name=None):
-        "coll.insertMany() wrapper"
+        "coll.insert_many() wrapper"
 
         coins = self._get_collection(collection_name)
-        coins.insertMany(entries)
+        coins.insert_many(entries)
+
+    def save_checkpoint(self, coin, interval_name, timestamp):
+        "save aggregation checkpoint (see MongoReader.get_checkpoint())"
+
+        self._get_collection(CHECKPOINTS_COLLECTION).replace_one(
+            {"coin": coin, "interval": interval_name},
+            {
+                "coin": coin,
+                "interval": interval_name,
+                "timestamp": timestamp,
+                "updated": time.time(),
+            },
+            True,
+        )
+
+    def advance_checkpoints(self, coins, interval_name, time_start, timestamp):
+        """
+        Move the aggregation checkpoints of ``coins`` (all coins if None;
+        [None] for currencies), that are from _time_start_ (>=) to _timestamp_,
+        to _timestamp_: the intervals before it were aggregated
+        by other means (the rollup, the ingest).
+        Checkpoints before _time_start_ (there is a gap) are not moved.
+        """
+
+        query = {
+            "interval": interval_name,
+            "timestamp": {"$gte": time_start, "$lt": timestamp},
+        }
+        if coins is None:
+            query["coin"] = {"$ne": None}
+        else:
+            query["coin"] = {"$in": list(coins)}
+        self._get_collection(CHECKPOINTS_COLLECTION).update_many(
+            query, {"$set": {"timestamp": timestamp, "updated": time.time()}}
+        )
+
+    def bulk(self, collection_name=None, batch_size=BULK_BATCH_SIZE):
+        "BulkWriter of ``collection_name``"
+
+        return BulkWriter(self._get_collection(collection_name), batch_size)
+
+    def upsert_many(self, entries, collection_name=None):
+        "update() of many entries with bulk writes"
+
+        with self.bulk(collection_name) as writer:
+            for entry in entries:
+                writer.update(entry)
+
+    def delete_range(self, start_time, stop_time, symbols=None, collection_name=None):
+        """
+        Delete the entries from _start_time_ (>=) to _stop_time_ (<),
+        only of ``symbols`` if specified.
+        """
+
+        query = {"timestamp": {"$gte": start_time, "$lt": stop_time}}
+        if symbols is not None:
+            query["symbol"] = {"$in": list(symbols)}
+        self._get_collection(collection_name).delete_many(query)
+
+    def merge(self, pipeline, collection_name, source_collection_name=None):
+        """
+        Run the aggregation ``pipeline`` on ``source_collection_name``
+        (coins by default) and merge its output into ``collection_name``
+        on the server side; the output documents replace the entries
+        with the same symbol and timestamp.
+        """
+
+        target = self._get_collection(collection_name)
+        if source_collection_name:
+            source = self.client.ratesx[source_collection_name]
+        else:
+            source = self.coins
+
+        merge = {
+            "$merge": {
+                "into": target.name,
+                "on": ["symbol", "timestamp"],
+                "whenMatched": "replace",
+                "whenNotMatched": "insert",
+            }
+        }
+        source.aggregate(pipeline + [merge], allowDiskUse=True)
+
+
+def _entry_key(entry):
+    "filter of the entry: by symbol and timestamp, or by timestamp only"
+
+    if "symbol" in entry:
+        return {"symbol": entry["symbol"], "timestamp": entry["timestamp"]}
+    return {"timestamp": entry["timestamp"]}
+
+
+class BulkWriter(object):
+    """
+    Buffered writer of a collection. The entries are accumulated
+    as ReplaceOne upserts (keyed as in MongoWriter.update())
+    and written by unordered bulk_write() calls of ``batch_size`` entries.
+
+    The latency of every batch is reported (log and the "mongo_bulk" stage
+    of the metrics), as well as the write errors; the other entries
+    of a batch with errors are written anyway.
+
+        with MongoWriter().bulk("coins_1h") as writer:
+            for entry in entries:
+                writer.update(entry)
+    """
+
+    def __init__(self, collection, batch_size=BULK_BATCH_SIZE):
+        self.collection = collection
+        self.batch_size = batch_size
+        self._requests = []
+
+        self.batches = 0
+        self.written = 0
+        self.errors = 0
+        self.last_latency = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.flush()
+
+    def update(self, entry):
+        """
+        Add upsert of ``entry``; write the batch if it is full
+        """
+
+        self._requests.append(ReplaceOne(_entry_key(entry), entry, upsert=True))
+        if len(self._requests) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the accumulated entries
+        """
+
+        if not self._requests:
+            return
+        requests, self._requests = self._requests, []
+
+        start = time.time()
+        try:
+            result = self.collection.bulk_write(requests, ordered=False)
+            written = result.upserted_count + result.matched_count
+            errors = []
+        except BulkWriteError as e_msg:
+            written = e_msg.details.get("nUpserted", 0) + e_msg.details.get(
+                "nMatched", 0
+            )
+            errors = e_msg.details.get("writeErrors", [])
+        latency = time.time() - start
+
+        self.batches += 1
+        self.written += written
+        self.errors += len(errors)
+        self.last_latency = latency
+        METRICS.observe("mongo_bulk", latency)
+
+        logging.info(
+            "bulk write: %s: %s entries in %.1f ms, %s errors",
+            self.collection.name,
+            len(requests),
+            latency * 1000,
+            len(errors),
+        )
+        if errors:
+            METRICS.inc(
+                "mongo_bulk_write_errors_total",
+                len(errors),
+                collection=self.collection.name,
+            )
+        for error in errors[:BULK_LOGGED_ERRORS]:
+            logging.error(
+                "bulk write: %s: entry %s: %s",
+                self.collection.name,
+                error.get("index"),
+                error.get("errmsg"),
+            )
+
+    def stats(self):
+        """
+        Counters of the written batches, entries and errors
+        """
+
+        return {
+            "batches": self.batches,
+            "written": self.written,
+            "errors": self.errors,
+            "last_latency": self.last_latency,
+        }
@@ -0,0 +1,222 @@
+"""
+Pre-fork WSGI server: a supervisor process and N gevent worker processes
+accepting connections on one shared listening socket.
+
+The application and all its modules (coins names tables, palettes etc.)
+are loaded by the supervisor before fork, so the workers share them
+copy-on-write. The supervisor restarts the workers that die.
+
+Signals (sent to the supervisor):
+
+    SIGTERM, SIGINT     graceful shutdown: the workers stop accepting
+                        connections and finish the requests in progress
+    SIGHUP              graceful reload: the supervisor re-executes itself
+                        (loading the new code), keeping the listening socket,
+                        starts new workers and then stops the old ones
+
+Exports:
+
+    PreforkServer
+"""
+
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import gevent
+from gevent.pywsgi import WSGIServer
+
+# the listening socket and the old workers are passed to the re-executed
+# supervisor in these environment variables
+LISTEN_FD_ENV = "RATESX_LISTEN_FD"
+OLD_WORKERS_ENV = "RATESX_OLD_WORKERS"
+
+# a worker that died sooner than that after its start is restarted with a delay,
+# so a broken worker does not make the supervisor fork in a loop
+MIN_WORKER_LIFETIME = 1.0
+SUPERVISOR_INTERVAL = 0.5
+
+
+class PreforkServer(object):  # pylint: disable=too-many-instance-attributes
+    """
+    Supervisor of the pre-forked gevent WSGI workers
+    """
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        application: Callable,
+        workers: int,
+        graceful_timeout: float = 30,
+        on_worker_start: Optional[Callable[[], None]] = None,
+        on_worker_exit: Optional[Callable[[], None]] = None,
+        backlog: int = 1024,
+    ) -> None:  # pylint: disable=too-many-arguments
+        self.address = address
+        self.application = application
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.on_worker_start = on_worker_start
+        self.on_worker_exit = on_worker_exit
+        self.backlog = backlog
+
+        self.socket = None  # type: Optional[socket.socket]
+        self.pids = {}  # type: Dict[int, float]
+        self.old_pids = set()
+        self._stopping = False
+        self._reloading = False
+
+    def _listen(self) -> socket.socket:
+        fd = os.environ.pop(LISTEN_FD_ENV, None)
+        if fd is not None:
+            # re-executed on reload: the socket is already listening
+            return socket.socket(fileno=int(fd))
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(self.address)
+        sock.listen(self.backlog)
+        return sock
+
+    def serve_forever(self) -> None:
+        """
+        Start the workers and supervise them until shutdown
+        """
+
+        self.socket = self._listen()
+        self.old_pids = {
+            int(pid) for pid in os.environ.pop(OLD_WORKERS_ENV, "").split(",") if pid
+        }
+
+        # the objects loaded before fork are never collected,
+        # and so their pages are not copied by the garbage collector
+        gc.collect()
+        gc.freeze()
+
+        for _ in range(self.workers):
+            self._spawn()
+
+        # new workers are accepting, the old ones (before reload) can go
+        for pid in self.old_pids:
+            self._kill(pid, signal.SIGTERM)
+
+        gevent.signal_handler(signal.SIGTERM, self._stop)
+        gevent.signal_handler(signal.SIGINT, self._stop)
+        gevent.signal_handler(signal.SIGHUP, self._reload)
+
+        logging.info(
+            "prefork: supervisor %s started %s workers on %s",
+            os.getpid(),
+            self.workers,
+            self.address,
+        )
+
+        while not self._stopping and not self._reloading:
+            gevent.sleep(SUPERVISOR_INTERVAL)
+            self._reap()
+            while len(self.pids) < self.workers and not self._stopping:
+                self._spawn()
+
+        if self._reloading:
+            self._reexec()
+        self._shutdown()
+
+    def _spawn(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker()
+        self.pids[pid] = time.time()
+
+    def _run_worker(self) -> None:
+        """
+        Worker process main loop, it never returns
+        """
+
+        exit_code = 0
+        try:
+            # the supervisor signal handlers are not inherited
+            gevent.signal_handler(signal.SIGHUP, lambda: None)
+            gevent.signal_handler(signal.SIGINT, lambda: None)
+
+            server = WSGIServer(self.socket, self.application)
+            if self.on_worker_start is not None:
+                self.on_worker_start()
+            gevent.signal_handler(
+                signal.SIGTERM,
+                lambda: gevent.spawn(server.stop, timeout=self.graceful_timeout),
+            )
+            server.serve_forever()
+        except BaseException:  # pylint: disable=broad-except
+            logging.exception("prefork: worker %s failed", os.getpid())
+            exit_code = 1
+        finally:
+            if self.on_worker_exit is not None:
+                self.on_worker_exit()
+            os._exit(exit_code)  # pylint: disable=protected-access
+
+    def _reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            self.old_pids.discard(pid)
+            started = self.pids.pop(pid, None)
+            if started is None or self._stopping:
+                continue
+
+            logging.error(
+                "prefork: worker %s exited with status %s, restarting", pid, status
+            )
+            if time.time() - started < MIN_WORKER_LIFETIME:
+                gevent.sleep(MIN_WORKER_LIFETIME)
+
+    def _stop(self) -> None:
+        self._stopping = True
+
+    def _reload(self) -> None:
+        self._reloading = True
+
+    def _reexec(self) -> None:
+        """
+        Replace the supervisor with a new one, running the updated code.
+        The listening socket and the current workers are passed to it:
+        the workers are stopped after the new ones are started.
+        """
+
+        logging.info("prefork: reloading supervisor %s", os.getpid())
+        self.socket.set_inheritable(True)
+        os.environ[LISTEN_FD_ENV] = str(self.socket.fileno())
+        os.environ[OLD_WORKERS_ENV] = ",".join(
+            str(pid) for pid in list(self.pids) + list(self.old_pids)
+        )
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    def _shutdown(self) -> None:
+        for pid in self.pids:
+            self._kill(pid, signal.SIGTERM)
+
+        deadline = time.time() + self.graceful_timeout
+        while self.pids and time.time() < deadline:
+            gevent.sleep(SUPERVISOR_INTERVAL)
+            self._reap()
+
+        for pid in self.pids:
+            self._kill(pid, signal.SIGKILL)
+        self.socket.close()
+        logging.info("prefork: supervisor %s stopped", os.getpid())
+
+    @staticmethod
+    def _kill(pid: int, sig: int) -> None:
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
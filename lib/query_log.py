@@ -0,0 +1,201 @@
+"""
+Asynchronous queries log.
+
+Log lines are put into a bounded queue, and a background greenlet writes them
+to the log file in batches (when ``batch_size`` lines are collected or
+``flush_interval`` seconds are passed), so the requests processing never waits
+for the filesystem. The file is written in a thread of the gevent threadpool.
+
+If the queue is full (the disk is too slow), the lines are dropped and counted.
+
+Optionally the log is rotated when it exceeds ``max_bytes``:
+queries.log -> queries.log.1.gz -> queries.log.2.gz ... (``backups`` archives),
+so the old logs can be analysed with ``zcat``.
+
+Every line is ``DATE TIME IP HOSTNAME TOPIC USER-AGENT STATUS``
+(the older lines have no status); see ``parse_line``.
+
+Exports:
+
+    QueryLog
+    answered_queries
+    parse_line
+"""
+
+import atexit
+import gzip
+import logging
+import os
+import shutil
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import gevent
+from gevent.queue import Empty, Full, Queue
+
+from metrics import METRICS
+
+# end of the queue marker
+_STOP = object()
+
+
+def parse_line(line: str) -> Optional[Tuple[str, str, Optional[int]]]:
+    """
+    Hostname, topic and response status (None if it is not logged)
+    of the queries log ``line``, or None if the line is incomplete
+    """
+
+    fields = line.split(" ", 5)
+    if len(fields) < 5:
+        return None
+    status = line.rsplit(" ", 1)[-1]
+    return fields[3], fields[4], int(status) if status.isdigit() else None
+
+
+def answered_queries(lines: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """
+    Hostname and topic of the answered queries (status 200, or not logged)
+    of the queries log ``lines``; the rate limited and the shed ones are skipped
+    """
+
+    for line in lines:
+        parsed = parse_line(line)
+        if parsed is not None and parsed[2] in (None, 200):
+            yield parsed[0], parsed[1]
+
+
+class QueryLog(object):  # pylint: disable=too-many-instance-attributes
+    """
+    Batched background writer of the queries log
+    """
+
+    def __init__(
+        self,
+        path: str,
+        queue_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_bytes: int = 0,
+        backups: int = 10,
+    ) -> None:  # pylint: disable=too-many-arguments
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+        self._queue = Queue(maxsize=queue_size)
+        self._writer = None
+
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.rotations = 0
+
+    def write(self, line: str) -> None:
+        """
+        Add ``line`` to the log (without waiting for it to be written)
+        """
+
+        if self._writer is None:
+            # started lazily, so every forked process has its own writer
+            self._writer = gevent.spawn(self._run)
+            atexit.register(self.close)
+
+        try:
+            self._queue.put_nowait(line)
+        except Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            batch = []  # type: List[str]
+            line = self._queue.get()
+            deadline = time.time() + self.flush_interval
+            while True:
+                if line is _STOP:
+                    stop = True
+                    break
+                batch.append(line)
+                timeout = deadline - time.time()
+                if len(batch) >= self.batch_size or timeout <= 0:
+                    break
+                try:
+                    line = self._queue.get(timeout=timeout)
+                except Empty:
+                    break
+
+            if batch:
+                with METRICS.timer("log"):
+                    gevent.get_hub().threadpool.apply(self._write_batch, (batch,))
+
+    def _write_batch(self, batch: List[str]) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as log_file:
+                log_file.write("".join(f"{line}\n" for line in batch))
+            self.written += len(batch)
+            self.batches += 1
+
+            if self.max_bytes and os.path.getsize(self.path) >= self.max_bytes:
+                self._rotate()
+        except OSError as e_msg:
+            logging.error("ERROR: can't write queries log %s: %s", self.path, e_msg)
+
+    def _rotate(self) -> None:
+        """
+        Compress the current log to .1.gz, shifting the older archives
+        """
+
+        for number in range(self.backups - 1, 0, -1):
+            archive = f"{self.path}.{number}.gz"
+            if os.path.exists(archive):
+                os.replace(archive, f"{self.path}.{number + 1}.gz")
+
+        rotated = f"{self.path}.{os.getpid()}.rotating"
+        os.replace(self.path, rotated)
+        with open(rotated, "rb") as src, gzip.open(f"{self.path}.1.gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(rotated)
+        self.rotations += 1
+
+    def close(self, timeout: float = 5) -> None:
+        """
+        Write all queued lines and stop the writer
+        """
+
+        if self._writer is None:
+            return
+
+        try:
+            self._queue.put_nowait(_STOP)
+            self._writer.join(timeout=timeout)
+        except Full:
+            pass
+        self._writer.kill()
+        self._writer = None
+
+        batch = []
+        while True:
+            try:
+                line = self._queue.get_nowait()
+            except Empty:
+                break
+            if line is not _STOP:
+                batch.append(line)
+        if batch:
+            self._write_batch(batch)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Log writer counters
+        """
+
+        return {
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "rotations": self.rotations,
+            "queued": self._queue.qsize(),
+        }
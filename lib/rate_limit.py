@@ -0,0 +1,84 @@
+"""
+Per-client rate limiting.
+
+Every client (IP address) has a token bucket for every route class
+(e.g. cached answers, chart renderings, first page renderings):
+a query takes one token, and the tokens are refilled with ``rate``
+tokens per second up to ``burst``. Buckets of the clients that were not seen
+for a long time are evicted (only ``max_clients`` buckets are kept).
+
+The buckets are kept in the memory of the process: in the pre-fork mode
+every worker has its own ones with the full limits. The connections of
+a client are not spread evenly over the workers (often they are accepted
+by the same one), so the limits are not divided; a client can get at most
+the number of the workers times the limits in total.
+
+Exports:
+
+    RateLimiter
+"""
+
+import collections
+import time
+from typing import Dict, Tuple
+
+
+class RateLimiter(object):
+    """
+    In-memory token buckets, one per (client, route class).
+    ``limits`` maps route classes to (rate, burst);
+    route classes without limits are not limited.
+    """
+
+    def __init__(
+        self, limits: Dict[str, Tuple[float, float]], max_clients: int = 100000
+    ) -> None:
+        self.limits = limits
+        self.max_clients = max_clients
+
+        self._buckets = collections.OrderedDict()
+
+        self.allowed = collections.Counter()
+        self.limited = collections.Counter()
+
+    def check(self, client: str, route_class: str) -> float:
+        """
+        Take a token from the ``client`` bucket for ``route_class``.
+        Return 0 if the query is allowed, otherwise how long (in seconds)
+        the client should wait for the next token.
+        """
+
+        if route_class not in self.limits:
+            return 0.0
+        rate, burst = self.limits[route_class]
+
+        now = time.monotonic()
+        key = (client, route_class)
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+            self.allowed[route_class] += 1
+        else:
+            wait = (1 - tokens) / rate
+            self.limited[route_class] += 1
+
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Allowed and limited queries of every route class
+        """
+
+        return {
+            route_class: {
+                "allowed": self.allowed[route_class],
+                "limited": self.limited[route_class],
+            }
+            for route_class in self.limits
+        }
@@ -0,0 +1,249 @@
+"""
+Pool of the rendering processes.
+
+Greenlets cooperate only on I/O, so a long CPU-bound rendering (a chart,
+a big table, ANSI to HTML conversion) blocks all other connections
+of the process. The pool runs such jobs in separate worker processes:
+the calling greenlet waits for the result on a socket, and the event loop
+keeps serving other requests (cache hits, MongoDB queries) meanwhile.
+
+The workers are forked on the first job (so every server process has its own
+pool) and communicate with the parent over socket pairs (pickled messages).
+A job that takes longer than ``timeout`` seconds is aborted, and its worker
+is killed and replaced. If more than ``queue_size`` jobs are waiting for
+a free worker, new jobs are rejected.
+
+Exports:
+
+    RenderPool
+    RenderPoolError
+    RenderTimeout
+    RenderPoolBusy
+"""
+
+import logging
+import os
+import pickle
+import signal
+import socket
+import struct
+from typing import Any, Callable, Dict, List, Optional
+
+import gevent
+from gevent.queue import Queue
+
+_HEADER = struct.Struct("!I")
+
+
+class RenderPoolError(RuntimeError):
+    """
+    The job could not be executed in the pool
+    """
+
+
+class RenderTimeout(RenderPoolError):
+    """
+    The job took too long
+    """
+
+
+class RenderPoolBusy(RenderPoolError):
+    """
+    Too many jobs are waiting for a free worker
+    """
+
+
+def _read_exactly(fd: int, size: int) -> Optional[bytes]:
+    data = b""
+    while len(data) < size:
+        chunk = os.read(fd, size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def _worker_main(sock: socket.socket) -> None:
+    """
+    Worker process loop: execute the jobs until the parent goes away.
+    The worker does not use the event loop, the socket is blocking.
+    """
+
+    for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(sig, signal.SIG_DFL)
+
+    fd = sock.fileno()
+    os.set_blocking(fd, True)
+    while True:
+        header = _read_exactly(fd, _HEADER.size)
+        if header is None:
+            break
+        func, args, kwargs = pickle.loads(_read_exactly(fd, _HEADER.unpack(header)[0]))
+        try:
+            result = (True, func(*args, **kwargs))
+        except Exception as e_msg:  # pylint: disable=broad-except
+            result = (False, e_msg)
+
+        try:
+            message = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        except Exception as e_msg:  # pylint: disable=broad-except
+            message = pickle.dumps((False, RenderPoolError(str(e_msg))))
+        os.write(fd, _HEADER.pack(len(message)))
+        written = 0
+        while written < len(message):
+            written += os.write(fd, message[written:])
+
+
+class _Worker(object):
+    """
+    Worker process and the parent end of its socket
+    """
+
+    def __init__(self, siblings: List["_Worker"]) -> None:
+        parent_sock, child_sock = socket.socketpair()
+        pid = os.fork()
+        if pid == 0:
+            parent_sock.close()
+            # the worker must not keep other workers' sockets open,
+            # otherwise they don't see that the parent has gone
+            for sibling in siblings:
+                sibling.sock.close()
+            try:
+                _worker_main(child_sock)
+            finally:
+                os._exit(0)  # pylint: disable=protected-access
+
+        child_sock.close()
+        self.pid = pid
+        self.sock = parent_sock
+
+    def call(self, func: Callable, args: tuple, kwargs: dict) -> Any:
+        message = pickle.dumps((func, args, kwargs), pickle.HIGHEST_PROTOCOL)
+        self.sock.sendall(_HEADER.pack(len(message)) + message)
+
+        header = self._recv(_HEADER.size)
+        success, result = pickle.loads(self._recv(_HEADER.unpack(header)[0]))
+        if not success:
+            raise result
+        return result
+
+    def _recv(self, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = self.sock.recv(min(size - len(data), 1024 * 1024))
+            if not chunk:
+                raise RenderPoolError("Rendering process has died")
+            data += chunk
+        return data
+
+    def kill(self) -> None:
+        self.sock.close()
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+class RenderPool(object):  # pylint: disable=too-many-instance-attributes
+    """
+    Bounded pool of ``size`` rendering processes.
+    With ``size`` 0 the jobs are executed in the calling process.
+    """
+
+    def __init__(self, size: int, timeout: float, queue_size: int) -> None:
+        self.size = size
+        self.timeout = timeout
+        self.queue_size = queue_size
+
+        self._pid = None  # type: Optional[int]
+        self._workers = []  # type: List[_Worker]
+        self._idle = Queue()
+
+        self.jobs = 0
+        self.waiting = 0
+        self.busy = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def _start(self) -> None:
+        self._pid = os.getpid()
+        self._workers = []
+        self._idle = Queue()
+        for _ in range(self.size):
+            self._add_worker()
+
+    def _add_worker(self) -> None:
+        worker = _Worker(self._workers)
+        self._workers.append(worker)
+        self._idle.put(worker)
+
+    def _replace_worker(self, worker: _Worker) -> None:
+        worker.kill()
+        self._workers.remove(worker)
+        self._add_worker()
+
+    def run(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Return ``func(*args, **kwargs)`` executed in a worker process.
+        ``func``, the arguments and the result must be picklable.
+        Exceptions of ``func`` are raised in the caller.
+        """
+
+        if self.size == 0:
+            return func(*args, **kwargs)
+
+        if self._pid != os.getpid():
+            self._start()
+
+        if self._idle.empty() and self.waiting >= self.queue_size:
+            self.rejected += 1
+            raise RenderPoolBusy("Server is too busy, try again later")
+
+        self.waiting += 1
+        try:
+            worker = self._idle.get()
+        finally:
+            self.waiting -= 1
+
+        self.jobs += 1
+        self.busy += 1
+        try:
+            with gevent.Timeout(self.timeout, RenderTimeout("Rendering timed out")):
+                result = worker.call(func, args, kwargs)
+        except RenderPoolError as e_msg:
+            if isinstance(e_msg, RenderTimeout):
+                self.timeouts += 1
+            else:
+                self.failures += 1
+            logging.error("ERROR: render pool: %s (%s)", e_msg, func.__name__)
+            self._replace_worker(worker)
+            raise
+        except Exception:
+            # raised by ``func``: the worker is ready for the next job
+            self._idle.put(worker)
+            raise
+        except BaseException:
+            # the caller is killed in the middle of the job
+            self._replace_worker(worker)
+            raise
+        finally:
+            self.busy -= 1
+
+        self._idle.put(worker)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Pool counters and the queue depth
+        """
+
+        return {
+            "size": self.size,
+            "busy": self.busy,
+            "waiting": self.waiting,
+            "jobs": self.jobs,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "rejected": self.rejected,
+        }
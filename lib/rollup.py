@@ -0,0 +1,173 @@
+"""
+Incremental rollups, maintained at ingest time.
+
+Every batch of 5-minute entries (a tick of coins or of currencies) is folded
+into the open interval bucket of every symbol (coins_1h, currencies_1h)
+right when it is collected, so the aggregated collections stay current
+without the batch aggregation; aggregate.py is used to repair
+or to rebuild them.
+
+The open buckets of the batch are loaded with one query, the entries
+are folded into them in memory (min, max, begin, end, time_min, time_max,
+and the sum and the count of the present values of every key, which
+the average is calculated from; the same document shape as in
+aggregate.py) and the buckets are written back with one bulk write.
+The aggregation checkpoints (see aggregate.py) of the previous interval
+are moved to the current one.
+
+The buckets are aligned to the interval. An entry that is not newer than
+the last entry of its bucket is skipped, so folding the same batch
+twice does not change the buckets; an entry that arrives late,
+after a newer one, is left for the repair.
+
+Exports:
+
+    INTERVAL
+    KEYS
+    fold
+    update_rollups
+"""
+
+from mng import MongoReader, MongoWriter
+
+INTERVAL = {
+    "1h": 1 * 3600,
+}
+#    '24h':      24*3600,
+
+# aggregated fields of the coins entries
+KEYS = [
+    "rank",
+    "price_usd",
+    "24h_volume_usd",
+    "market_cap_usd",
+    "available_supply",
+    "total_supply",
+]
+
+MONGO_READER = MongoReader()
+MONGO_WRITER = MongoWriter()
+
+
+def _entry_keys(entry, currencies):
+    if not currencies:
+        return KEYS
+    return [
+        k
+        for k in entry.keys()
+        if not k.startswith("_") and k not in ["timestamp", "last_updated", "symbol"]
+    ]
+
+
+def fold(bucket, entry, keys):
+    """
+    Fold ``entry`` into the aggregated ``bucket`` (None for a new bucket)
+    and return the bucket
+    """
+
+    timestamp = entry["timestamp"]
+    if bucket is None:
+        bucket = {
+            "timestamp": timestamp,
+            "time_end": timestamp,
+            "number_of_aggregated": 0,
+        }
+        if "symbol" in entry:
+            bucket = dict(symbol=entry["symbol"], **bucket)
+
+    bucket["time_end"] = timestamp
+    bucket["number_of_aggregated"] += 1
+
+    for key in keys:
+        value = entry.get(key)
+        aggregated = bucket.get(key)
+        if aggregated is None:
+            aggregated = bucket[key] = {
+                "min": None,
+                "max": None,
+                "begin": value,
+                "end": value,
+                "time_min": timestamp,
+                "time_max": timestamp,
+                "avg": None,
+                "sum": 0,
+                "count": 0,
+            }
+        elif "count" not in aggregated:
+            # bucket aggregated before the sums and counts were stored
+            aggregated["count"] = bucket["number_of_aggregated"] - 1
+            aggregated["sum"] = (aggregated["avg"] or 0) * aggregated["count"]
+
+        aggregated["end"] = value
+        if value is None:
+            continue
+
+        if aggregated["min"] is None or value < aggregated["min"]:
+            aggregated["min"] = value
+            aggregated["time_min"] = timestamp
+        if aggregated["max"] is None or value > aggregated["max"]:
+            aggregated["max"] = value
+            aggregated["time_max"] = timestamp
+
+        aggregated["sum"] += value
+        aggregated["count"] += 1
+        aggregated["avg"] = aggregated["sum"] / aggregated["count"]
+
+    return bucket
+
+
+def update_rollups(entries, currencies=False):
+    """
+    Fold the batch of coins ``entries`` (or of currencies, if ``currencies``)
+    into the open buckets of all intervals.
+    Return the number of the updated buckets.
+    """
+
+    if not entries:
+        return 0
+
+    entries = sorted(entries, key=lambda x: x["timestamp"])
+    prefix = "currencies_" if currencies else "coins_"
+
+    updated = 0
+    for interval_name, interval_size in INTERVAL.items():
+        collection_name = prefix + interval_name
+
+        def bucket_of(entry, interval_size=interval_size):
+            timestamp = entry["timestamp"]
+            return entry.get("symbol"), timestamp - timestamp % interval_size
+
+        time_start = min(bucket_of(entry)[1] for entry in entries)
+        time_end = entries[-1]["timestamp"] + 1
+        buckets = {
+            bucket_of(bucket): bucket
+            for bucket in MONGO_READER.get_raw_data(
+                None, time_start, time_end, collection_name=collection_name
+            )
+        }
+
+        changed = {}
+        for entry in entries:
+            key = bucket_of(entry)
+            bucket = buckets.get(key)
+            if bucket is not None and entry["timestamp"] <= bucket["time_end"]:
+                continue
+            buckets[key] = changed[key] = fold(
+                bucket, entry, _entry_keys(entry, currencies)
+            )
+
+        MONGO_WRITER.upsert_many(changed.values(), collection_name)
+        updated += len(changed)
+
+        if changed:
+            # the previous interval is complete now, the batch aggregation
+            # continues from the current one (None is the currencies symbol)
+            newest = max(bucket_start for _, bucket_start in changed)
+            MONGO_WRITER.advance_checkpoints(
+                sorted({symbol for symbol, _ in changed}),
+                interval_name,
+                newest - interval_size,
+                newest,
+            )
+
+    return updated
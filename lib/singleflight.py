@@ -0,0 +1,101 @@
+"""
+Requests coalescing.
+
+If several greenlets need the same (not yet cached) answer at the same time,
+only the first of them computes it; the others wait for its result.
+If it takes too long, the waiting ones give up (they don't compute it too,
+as the first one is slow exactly when the server is overloaded).
+
+Exports:
+
+    SingleFlight
+    SingleFlightError
+    SingleFlightTimeout
+"""
+
+from typing import Any, Callable, Dict, Hashable
+
+import gevent
+from gevent.event import AsyncResult
+
+
+class SingleFlightError(RuntimeError):
+    """
+    The result of the first call is not available
+    """
+
+
+class SingleFlightTimeout(SingleFlightError):
+    """
+    The first call took too long
+    """
+
+
+class SingleFlight(object):
+    """
+    Executes only one call for each key at a time.
+    Concurrent callers with the same key wait (up to ``timeout`` seconds)
+    for the result of the first call; SingleFlightTimeout is raised
+    if it takes longer.
+    """
+
+    def __init__(self, timeout: float) -> None:
+        self.timeout = timeout
+        self._calls = {}  # type: Dict[Hashable, AsyncResult]
+
+        self.leaders = 0
+        self.followers = 0
+        self.timeouts = 0
+
+    def do(self, key: Hashable, func: Callable, *args, **kwargs) -> Any:
+        """
+        Return ``func(*args, **kwargs)``, sharing the result (or the exception)
+        between the concurrent callers with the same ``key``.
+        """
+
+        call = self._calls.get(key)
+        if call is not None:
+            self.followers += 1
+            try:
+                return call.get(timeout=self.timeout)
+            except gevent.Timeout:
+                self.timeouts += 1
+                raise SingleFlightTimeout(
+                    f"No result in {self.timeout} seconds"
+                ) from None
+
+        call = AsyncResult()
+        self._calls[key] = call
+        self.leaders += 1
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e_msg:
+            call.set_exception(e_msg)
+            raise
+        except BaseException as e_msg:
+            # the first greenlet is killed or timed out (GreenletExit,
+            # gevent.Timeout): that is not raised in the waiting ones
+            call.set_exception(SingleFlightError(f"Interrupted: {e_msg!r}"))
+            raise
+        finally:
+            del self._calls[key]
+
+        call.set(result)
+        return result
+
+    def in_flight(self) -> int:
+        """
+        Number of the calls being executed now
+        """
+        return len(self._calls)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Coalescing counters
+        """
+        return {
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "timeouts": self.timeouts,
+            "in_flight": self.in_flight(),
+        }
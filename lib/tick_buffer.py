@@ -0,0 +1,276 @@
+"""
+In-memory rolling buffer of the latest 5-minute coins ticks.
+
+The buffer keeps the last 24 hours of the ``coins`` collection
+for every symbol as NumPy arrays (one row per symbol, one column per tick),
+so the first page sparklines and changes can be calculated
+without querying MongoDB.
+
+Exports:
+
+    TickBuffer
+"""
+
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# collection interval of the coins data (in seconds)
+TICK_INTERVAL = 300
+
+# 24 hours of 5-minute ticks
+TICKS_PER_DAY = 24 * 3600 // TICK_INTERVAL
+
+# how often (at most) MongoDB is checked for a new tick when it is overdue
+REFRESH_INTERVAL = 20
+
+# a new tick with fewer entries than the previous one can be still
+# being written by the collector: it is read again until it is complete,
+# but not longer than that (seconds since it was seen first)
+TICK_GRACE = 60
+
+FIELDS = ["price_usd", "market_cap_usd", "24h_volume_usd", "rank"]
+
+
+class TickBuffer(object):  # pylint: disable=too-many-instance-attributes
+    """
+    Ring buffer of the last ``size`` ticks for every symbol.
+    A new column is appended when a new collection timestamp appears.
+    """
+
+    def __init__(self, size: int = TICKS_PER_DAY + 1, rows: int = 1024) -> None:
+        # the 24h change needs the tick exactly 24h ago, hence + 1
+        self.size = size
+        self.timestamps = np.zeros(size, dtype=np.float64)
+        self.data = {
+            field: np.full((rows, size), np.nan, dtype=np.float64) for field in FIELDS
+        }
+        self.symbols = {}  # type: Dict[str, int]
+        self._last_seen = np.zeros(rows, dtype=np.float64)
+        self._free_rows = list(range(rows - 1, -1, -1))
+
+        self.head = 0
+        self.count = 0
+        self.last_timestamp = None  # type: Optional[float]
+
+        self._last_count = None  # type: Optional[int]
+        self._pending = None  # type: Optional[tuple]
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    #
+    # writing
+    #
+
+    def _grow(self) -> None:
+        rows = self._last_seen.shape[0]
+        for field in FIELDS:
+            self.data[field] = np.vstack(
+                [self.data[field], np.full((rows, self.size), np.nan)]
+            )
+        self._last_seen = np.concatenate(
+            [self._last_seen, np.zeros(rows, dtype=np.float64)]
+        )
+        self._free_rows = list(range(2 * rows - 1, rows - 1, -1)) + self._free_rows
+
+    def _row(self, symbol: str) -> int:
+        row = self.symbols.get(symbol)
+        if row is None:
+            if not self._free_rows:
+                self._grow()
+            row = self._free_rows.pop()
+            self.symbols[symbol] = row
+        return row
+
+    def _release_stale_rows(self) -> None:
+        """
+        Free rows of symbols that have no ticks in the buffer anymore
+        """
+        oldest = self.oldest_timestamp()
+        for symbol, row in list(self.symbols.items()):
+            if self._last_seen[row] < oldest:
+                del self.symbols[symbol]
+                self._free_rows.append(row)
+
+    def append(self, timestamp: float, entries: List[Dict]) -> None:
+        """
+        Append a new column with coins ``entries`` collected at ``timestamp``.
+        """
+
+        if self.last_timestamp is not None and timestamp <= self.last_timestamp:
+            return
+
+        column = self.head
+        for field in FIELDS:
+            self.data[field][:, column] = np.nan
+        self.timestamps[column] = timestamp
+
+        for entry in entries:
+            symbol = entry.get("symbol")
+            if symbol is None:
+                continue
+            row = self._row(symbol)
+            for field in FIELDS:
+                value = entry.get(field)
+                if value is not None:
+                    self.data[field][row, column] = value
+            self._last_seen[row] = timestamp
+
+        self.head = (self.head + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+        self.last_timestamp = timestamp
+        self._last_count = len(entries)
+
+        if self.count == self.size:
+            self._release_stale_rows()
+
+    def refresh(self, coins) -> None:
+        """
+        Load new ticks from the ``coins`` collection.
+
+        MongoDB is not queried until the next tick is due
+        (TICK_INTERVAL after the last one), and then not more often
+        than once in REFRESH_INTERVAL seconds. The newest tick is appended
+        only when it is complete (see _complete()).
+        """
+
+        now = time.time()
+        if (
+            self.last_timestamp is not None
+            and now < self.last_timestamp + TICK_INTERVAL
+        ):
+            return
+        if now - self._checked_at < REFRESH_INTERVAL:
+            return
+
+        if not self._lock.acquire(blocking=False):
+            # another greenlet is already loading the ticks
+            return
+        try:
+            self._checked_at = now
+
+            since = now - self.size * TICK_INTERVAL
+            if self.last_timestamp is not None:
+                since = max(since, self.last_timestamp + 1)
+
+            fields = {field: 1 for field in FIELDS}
+            fields.update({"symbol": 1, "timestamp": 1, "_id": 0})
+
+            column = []
+            column_timestamp = None
+            for entry in coins.find({"timestamp": {"$gt": since - 1}}, fields).sort(
+                [("timestamp", 1)]
+            ):
+                if entry["timestamp"] != column_timestamp:
+                    if column:
+                        self.append(column_timestamp, column)
+                    column = []
+                    column_timestamp = entry["timestamp"]
+                column.append(entry)
+            if column and self._complete(column_timestamp, column, now):
+                self.append(column_timestamp, column)
+        finally:
+            self._lock.release()
+
+    def _complete(self, timestamp: float, entries: List[Dict], now: float) -> bool:
+        """
+        False if the newest tick (``timestamp``) can be still being written:
+        it has fewer ``entries`` than the previous tick, and it was seen
+        first less than TICK_GRACE seconds ago. Then it is not appended
+        and is read again by the next refresh().
+        """
+
+        if self._last_count is None or len(entries) >= self._last_count:
+            return True
+        if self._pending is None or self._pending[0] != timestamp:
+            self._pending = (timestamp, now)
+        return now - self._pending[1] >= TICK_GRACE
+
+    #
+    # reading
+    #
+
+    def oldest_timestamp(self) -> float:
+        """
+        Timestamp of the oldest tick in the buffer
+        """
+        if self.count < self.size:
+            return float(self.timestamps[0])
+        return float(self.timestamps[self.head])
+
+    def covers(self, timestamp: float, history: int = 24 * 3600) -> bool:
+        """
+        True if the buffer contains all ticks from ``timestamp`` - ``history``
+        to ``timestamp``.
+        """
+        if self.count == 0:
+            return False
+        return self.oldest_timestamp() <= timestamp - history and (
+            timestamp <= self.last_timestamp
+        )
+
+    def _ordered(self, symbol: str, timestamp: float, field: str):
+        """
+        Timestamps and values of ``symbol`` not newer than ``timestamp``,
+        from the oldest to the newest; ticks without data are skipped.
+        """
+
+        order = (np.arange(self.count) + self.head - self.count) % self.size
+        timestamps = self.timestamps[order]
+        values = self.data[field][self.symbols[symbol], order]
+        mask = (timestamps <= timestamp) & ~np.isnan(values)
+        return timestamps[mask], values[mask]
+
+    def last(
+        self, symbol: str, timestamp: float, number: int, field: str = "price_usd"
+    ) -> Optional[List[float]]:
+        """
+        The last ``number`` values of ``symbol`` not newer than ``timestamp``.
+        None if the symbol is unknown.
+        """
+        if symbol not in self.symbols:
+            return None
+        _, values = self._ordered(symbol, timestamp, field)
+        return values[-number:].tolist()
+
+    def value_at(
+        self, symbol: str, timestamp: float, field: str = "price_usd"
+    ) -> Optional[float]:
+        """
+        The last value of ``symbol`` not newer than ``timestamp``.
+        None if there is no such value in the buffer.
+        """
+        if symbol not in self.symbols:
+            return None
+        _, values = self._ordered(symbol, timestamp, field)
+        if values.shape[0] == 0:
+            return None
+        return float(values[-1])
+
+    def snapshot(self, timestamp: float, number_of_coins: int) -> List[Dict]:
+        """
+        Coins entries (like in the ``coins`` collection) with rank up to
+        ``number_of_coins`` at ``timestamp`` (that must be in the buffer),
+        sorted by rank.
+        """
+
+        columns = np.nonzero(self.timestamps == timestamp)[0]
+        if self.count == 0 or columns.shape[0] == 0:
+            return []
+        column = columns[0]
+
+        entries = []
+        for symbol, row in self.symbols.items():
+            rank = self.data["rank"][row, column]
+            if np.isnan(rank) or rank > number_of_coins:
+                continue
+            entry = {"symbol": symbol, "timestamp": timestamp, "rank": int(rank)}
+            for field in FIELDS:
+                value = self.data[field][row, column]
+                if field != "rank" and not np.isnan(value):
+                    entry[field] = float(value)
+            entries.append(entry)
+
+        return sorted(entries, key=lambda x: x["rank"])
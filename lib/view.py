@@ -2,8 +2,10 @@ from mng import MongoReader
 from view_ansi import print_table
 
 
-def show(config):
-    "main function"
+def load(config):
+    """
+    Load the data for the table; returns the arguments of render()
+    """
 
     default_config = {
         "number_of_ticks": 12,
@@ -31,7 +33,14 @@ def show(config):
     config = default_config
 
     mongo_reader = MongoReader(config)
-    data = mongo_reader.load_from_mongo()
+    data = mongo_reader.load_from_mongo(mode="snapshot")
+    return config, data
+
+
+def render(config, data):
+    """
+    Format the loaded ``data`` as a table (CPU only, no database access)
+    """
 
     market_cap_direction, vol_24h_direction, btc_dominance_direction = 0, 0, 0
     marktcap_spark = "." * 48
@@ -51,6 +60,12 @@ def show(config):
     return output
 
 
+def show(config):
+    "main function"
+
+    return render(*load(config))
+
+
 def main():
     print(show({}))
 
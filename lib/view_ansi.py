@@ -6,13 +6,8 @@ import sys
 import os
 from typing import Dict, List, Tuple, Union
 
-from terminaltables import WindowsTable
-
-# Other useful tables:
-#  GithubFlavoredMarkdownTable, SingleTable, DoubleTable, PorcelainTable
 from colorama import Fore, Style
 from termcolor import colored
-from babel.numbers import format_decimal
 
 MYDIR = os.path.abspath(os.path.dirname(os.path.dirname("__file__")))
 sys.path.append(f"{MYDIR}/lib/")
@@ -143,6 +138,15 @@ def print_table(
     if currency_symbol == "":
         currency_suffix = " " + currency
 
+    # babel and terminaltables are slow to import, so they are imported
+    # when the first table is printed
+    # pylint: disable=import-outside-toplevel
+    from babel.numbers import format_decimal
+    from terminaltables import WindowsTable
+
+    # Other useful tables:
+    #  GithubFlavoredMarkdownTable, SingleTable, DoubleTable, PorcelainTable
+
     # Currently, always use the en_US for formatting the numbers. May be parametrized in future.
     locale_to_use = "en_US"
 
@@ -0,0 +1,176 @@
+"""
+Responses cache warm-up.
+
+When the server starts, and every time a new collection epoch appears,
+the most popular answers are rendered in the background, so the first
+visitors get them from the cache. The keys (hostname, topic) are
+the configured ones plus the ``top_k`` most frequent answered queries
+(status 200) from the tail of the queries log.
+
+The warm-up renders at most ``concurrency`` answers at a time and stops
+when the server is overloaded, so the live queries are not starved.
+If several server processes run (pre-fork mode), only one of them warms
+the cache for an epoch (the others use the answers from the disk cache).
+
+Exports:
+
+    Warmup
+"""
+
+import collections
+import fcntl
+import logging
+import os
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+import gevent
+from gevent.pool import Pool
+
+from cmd_wrapper import INTERNAL_TOPICS, cmd_wrapper, is_overloaded
+from compression import ENCODINGS
+from metrics import METRICS
+from mng import get_epoch
+from parse_query import parse_query
+from query_log import answered_queries
+
+# hosts of the keys taken from the queries log
+HOSTNAME = re.compile(r"^([a-z0-9-]+\.)?rate\.sx$")
+
+# warmed variants of every key: (html, encoding);
+# the terminal clients (curl) don't compress, the browsers do
+VARIANTS = [(False, None), (True, ENCODINGS[0])]
+
+
+class Warmup(object):  # pylint: disable=too-many-instance-attributes
+    """
+    Background warm-up of the responses cache
+    """
+
+    def __init__(
+        self,
+        keys: List[Tuple[str, str]],
+        queries_log: str,
+        lock_file: str,
+        top_k: int = 50,
+        log_bytes: int = 10 * 1024 * 1024,
+        concurrency: int = 2,
+        check_interval: float = 10,
+    ) -> None:  # pylint: disable=too-many-arguments
+        self.keys = keys
+        self.queries_log = queries_log
+        self.lock_file = lock_file
+        self.top_k = top_k
+        self.log_bytes = log_bytes
+        self.concurrency = concurrency
+        self.check_interval = check_interval
+
+        self.epoch = None  # type: Optional[float]
+        self._greenlet = None
+
+        self.runs = 0
+        self.warmed = 0
+        self.errors = 0
+        self.interrupted = 0
+        self.last_duration = 0.0
+
+    def start(self) -> None:
+        """
+        Start the warm-up greenlet (in every server process)
+        """
+
+        if self._greenlet is None:
+            self._greenlet = gevent.spawn(self._run)
+
+    def _run(self) -> None:
+        while True:
+            epoch = get_epoch()
+            if epoch is not None and epoch != self.epoch:
+                self.epoch = epoch
+                try:
+                    self.warm()
+                except Exception as e_msg:  # pylint: disable=broad-except
+                    logging.error("ERROR: cache warm-up failed: %s", e_msg)
+            gevent.sleep(self.check_interval)
+
+    def top_keys(self) -> List[Tuple[str, str]]:
+        """
+        The most frequent (hostname, topic) of the queries log tail
+        """
+
+        if self.top_k == 0:
+            return []
+        return gevent.get_hub().threadpool.apply(self._read_top_keys)
+
+    def _read_top_keys(self) -> List[Tuple[str, str]]:
+        try:
+            with open(self.queries_log, "rb") as log_file:
+                log_file.seek(0, os.SEEK_END)
+                log_file.seek(max(0, log_file.tell() - self.log_bytes))
+                data = log_file.read().decode("utf-8", errors="replace")
+        except FileNotFoundError:
+            return []
+
+        counter = collections.Counter()
+        # the first line can be incomplete
+        for hostname, topic in answered_queries(data.splitlines()[1:]):
+            hostname = hostname.lower()
+            if HOSTNAME.match(hostname) and topic not in INTERNAL_TOPICS:
+                counter[(hostname, topic)] += 1
+        return [key for key, _ in counter.most_common(self.top_k)]
+
+    def warm(self) -> None:
+        """
+        Render the configured and the most popular answers for the current epoch
+        """
+
+        os.makedirs(os.path.dirname(self.lock_file), exist_ok=True)
+        with open(self.lock_file, "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # another server process is warming the cache
+                return
+
+            start = time.time()
+            keys = list(dict.fromkeys(self.keys + self.top_keys()))
+            pool = Pool(self.concurrency)
+            for hostname, topic in keys:
+                if is_overloaded():
+                    self.interrupted += 1
+                    break
+                pool.spawn(self._warm_key, hostname, topic)
+            pool.join()
+
+            self.runs += 1
+            self.last_duration = time.time() - start
+            METRICS.observe("warmup", self.last_duration)
+            logging.info(
+                "cache warm-up: %s keys in %.1f s", len(keys), self.last_duration
+            )
+
+    def _warm_key(self, hostname: str, topic: str) -> None:
+        for html, encoding in VARIANTS:
+            try:
+                cmd_wrapper(topic, hostname, parse_query({}), html, encoding)
+            except Exception as e_msg:  # pylint: disable=broad-except
+                self.errors += 1
+                logging.error(
+                    "ERROR: cache warm-up of %s %s failed: %s", hostname, topic, e_msg
+                )
+                return
+        self.warmed += 1
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Warm-up counters
+        """
+
+        return {
+            "runs": self.runs,
+            "warmed": self.warmed,
+            "errors": self.errors,
+            "interrupted": self.interrupted,
+            "last_duration": self.last_duration,
+        }
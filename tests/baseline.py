@@ -0,0 +1,205 @@
+"""
+Reference implementation of the first page: the original query-per-coin
+MongoReader (before the batched loader, the ticks buffer, the snapshot
+and the factors table), used to check that the optimized paths
+return the same data.
+"""
+
+import currencies_names
+
+
+class BaselineReader(object):
+    """
+    The original MongoReader, reading the ``database`` directly
+    """
+
+    def __init__(self, database, config=None):
+        self.coins = database.coins
+        self.marketcap = database.marketcap
+        self.currencies = database.currencies
+
+        if config is None:
+            config = {}
+        self.number_of_coins = config.get("number_of_coins", 30)
+        self.number_of_ticks = config.get("number_of_ticks", 12)
+        self.currency = config.get("currency", "USD")
+        self.is_currency_coin = (
+            self.currency not in currencies_names.SUPPORTED_CURRENCIES
+        )
+        self._spark_price_currency_ticks = []
+
+    def currency_factor(self, timestamp=None, currency=None):
+        "Factor converting USD into <currency> at <timestamp>"
+
+        if currency is None:
+            currency = self.currency
+        if currency == "USD":
+            return 1
+
+        query = {}
+        if timestamp:
+            query["timestamp"] = {"$lt": timestamp + 1}
+
+        if currency not in currencies_names.SUPPORTED_CURRENCIES:
+            query.update({"symbol": currency})
+            price_symbol = (
+                self.coins.find(query, {"price_usd": 1})
+                .sort([("timestamp", -1)])
+                .limit(1)[0]["price_usd"]
+            )
+        else:
+            query.update({currency: {"$exists": True}})
+            price_symbol = (
+                self.currencies.find(query, {currency: 1})
+                .sort([("timestamp", -1)])
+                .limit(1)[0][currency]
+            )
+
+        return 1 / price_symbol
+
+    def load_spark(self, symbol, timestamp):
+        "Sparkline of <symbol> in <self.currency>"
+
+        ticks = self.number_of_ticks + 1
+        price_usd_ticks = [
+            x["price_usd"]
+            for x in self.coins.find(
+                {"symbol": symbol, "timestamp": {"$lt": timestamp + 1}}
+            )
+            .sort([("timestamp", -1)])
+            .limit(ticks)
+        ][::-1]
+
+        if self.currency == "USD":
+            return price_usd_ticks
+
+        if self._spark_price_currency_ticks == []:
+            if self.is_currency_coin:
+                self._spark_price_currency_ticks = [
+                    x["price_usd"]
+                    for x in self.coins.find(
+                        {"symbol": self.currency, "timestamp": {"$lt": timestamp + 1}}
+                    )
+                    .sort([("timestamp", -1)])
+                    .limit(ticks)
+                ][::-1]
+            else:
+                self._spark_price_currency_ticks = [
+                    x[self.currency]
+                    for x in self.currencies.find(
+                        {
+                            self.currency: {"$exists": True},
+                            "timestamp": {"$lt": timestamp + 1},
+                        }
+                    )
+                    .sort([("timestamp", -1)])
+                    .limit(ticks)
+                ][::-1]
+        return [
+            x / y for x, y in zip(price_usd_ticks, self._spark_price_currency_ticks)
+        ]
+
+    def mng_load_marketcap_global_data(self):
+        "Marketcap data in <self.currency>"
+
+        data = self.marketcap.find().sort([("timestamp", -1)]).limit(1)[0]
+        factor = self.currency_factor(timestamp=data["timestamp"])
+        return {
+            field: value * factor if field.endswith("_usd") else value
+            for field, value in data.items()
+            if field not in ["_id", "timestamp"]
+        }
+
+    def mng_load_coins_data(self):
+        "Rows of the first page table in <self.currency>"
+
+        def get_change(symbol, price_usd, timestamp, timedelta):
+            try:
+                price_before = (
+                    self.coins.find(
+                        {
+                            "symbol": symbol,
+                            "timestamp": {"$lt": timestamp - timedelta + 1},
+                        }
+                    )
+                    .sort([("timestamp", -1)])
+                    .limit(1)[0]["price_usd"]
+                )
+            except IndexError:
+                price_before = 0
+
+            price_before = price_before * self.currency_factor(
+                timestamp=timestamp - timedelta
+            )
+            price = price_usd * self.currency_factor(timestamp=timestamp)
+
+            if price_before != 0:
+                return (price - price_before) * 100 / price_before
+            return 0
+
+        timestamp = (
+            self.coins.find({}, {"timestamp": 1})
+            .sort([("timestamp", -1)])
+            .limit(1)[0]["timestamp"]
+        )
+
+        data = []
+        for entry in self.coins.find(
+            {"rank": {"$lt": self.number_of_coins + 1}, "timestamp": timestamp}
+        ).sort([("rank", 1)]):
+            data.append(
+                {
+                    "code": entry["symbol"],
+                    "price": entry["price_usd"] * self.currency_factor(timestamp),
+                    "change_24h": get_change(
+                        entry["symbol"], entry["price_usd"], timestamp, 24 * 3600
+                    ),
+                    "change_1h": get_change(
+                        entry["symbol"], entry["price_usd"], timestamp, 3600
+                    ),
+                    "cap": entry["market_cap_usd"] * self.currency_factor(timestamp),
+                    "spark": self.load_spark(entry["symbol"], timestamp),
+                }
+            )
+        return data
+
+
+def aggregate_loop(entries, keys):
+    """
+    The original aggregation of ``keys`` of the ``entries`` of one interval
+    (aggregate_coin, aggregate_currencies); all values must be present
+    """
+
+    result = {
+        "timestamp": entries[0].get("timestamp"),
+        "time_end": entries[-1].get("timestamp"),
+        "number_of_aggregated": len(entries),
+    }
+    for key in keys:
+        aggregated = {
+            "min": entries[0].get(key),
+            "max": entries[0].get(key),
+            "begin": entries[0].get(key),
+            "end": entries[-1].get(key),
+            "time_min": entries[0].get("timestamp"),
+            "time_max": entries[0].get("timestamp"),
+        }
+
+        sum_ = 0
+        for entry in entries:
+            this = entry.get(key)
+            time_this = entry.get("timestamp")
+
+            if this > aggregated["max"]:
+                aggregated["max"] = this
+                aggregated["time_max"] = time_this
+
+            if this < aggregated["min"]:
+                aggregated["min"] = this
+                aggregated["time_min"] = time_this
+
+            sum_ += this
+        aggregated["avg"] = sum_ / len(entries)
+
+        result[key] = aggregated
+    return result
@@ -0,0 +1,145 @@
+"""
+Fixtures of the tests: an in-memory MongoDB (mongomock) shared by all readers
+and writers, filled with a day and a half of synthetic 5-minute data.
+
+The modules write their logs relative to the working directory,
+so the tests are run in a temporary one.
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+import mongomock
+import mongomock.collection
+import pytest
+
+MYDIR = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+sys.path.insert(0, f"{MYDIR}/lib/")
+
+WORKDIR = tempfile.mkdtemp(prefix="rate.sx-tests-")
+os.makedirs(f"{WORKDIR}/log")
+os.chdir(WORKDIR)
+
+# pylint: disable=wrong-import-position
+import mng
+from tick_buffer import TickBuffer, TICK_INTERVAL
+
+# pylint: enable=wrong-import-position
+
+SYMBOLS = ["BTC", "ETH", "XRP", "LTC", "DOGE", "ADA", "DOT", "SOL"]
+CURRENCIES = ["EUR", "GBP", "JPY"]
+
+# 36 hours of ticks: enough for the 24h changes and the factors window
+TICKS = 36 * 3600 // TICK_INTERVAL
+
+
+def _patch_mongomock_bulk():
+    """
+    pymongo 4.9+ passes ``sort`` to the bulk operations builder,
+    mongomock does not know it yet
+    """
+
+    builder = mongomock.collection.BulkOperationBuilder
+    for name in ["add_replace", "add_update", "add_delete"]:
+        method = getattr(builder, name, None)
+        if method is None:
+            continue
+
+        def wrapper(self, *args, _method=method, **kwargs):
+            kwargs.pop("sort", None)
+            return _method(self, *args, **kwargs)
+
+        setattr(builder, name, wrapper)
+
+
+_patch_mongomock_bulk()
+
+
+def fill(database, now):
+    """
+    Synthetic coins, currencies and marketcap data up to ``now``:
+    a random walk of the prices, a coin with missing ticks,
+    a coin that appears in the middle and currencies collected
+    at other times than the coins
+    """
+
+    rnd = random.Random(1)
+    last_tick = int(now) // TICK_INTERVAL * TICK_INTERVAL
+    prices = {symbol: rnd.uniform(1, 1000) for symbol in SYMBOLS}
+    rates = {currency: rnd.uniform(0.5, 150) for currency in CURRENCIES}
+
+    coins = []
+    currencies = []
+    for i in range(TICKS, -1, -1):
+        timestamp = last_tick - i * TICK_INTERVAL
+        for rank, symbol in enumerate(SYMBOLS, 1):
+            prices[symbol] *= rnd.uniform(0.98, 1.02)
+            if symbol == "DOGE" and i % 7 == 3:
+                continue
+            if symbol == "SOL" and i > TICKS // 2:
+                continue
+            coins.append(
+                {
+                    "symbol": symbol,
+                    "timestamp": timestamp,
+                    "rank": rank,
+                    "price_usd": prices[symbol],
+                    "market_cap_usd": prices[symbol] * 1e6,
+                    "24h_volume_usd": prices[symbol] * 1e4,
+                    "available_supply": 1e6,
+                    "total_supply": prices[symbol] * 2e3 if i % 3 else None,
+                }
+            )
+
+        entry = {"timestamp": timestamp - 17, "last_updated": timestamp - 17}
+        for currency in CURRENCIES:
+            rates[currency] *= rnd.uniform(0.995, 1.005)
+            if currency == "JPY" and i % 5 == 1:
+                continue
+            entry[currency] = rates[currency]
+        currencies.append(entry)
+
+    database.coins.insert_many(coins)
+    database.currencies.insert_many(currencies)
+    database.marketcap.insert_one(
+        {
+            "timestamp": last_tick,
+            "active_currencies": 1500,
+            "bitcoin_percentage_of_market_cap": 51.2,
+            "last_updated": last_tick,
+            "total_market_cap_usd": 2.1e12,
+            "active_markets": 12000,
+            "active_assets": 900,
+            "total_24h_volume_usd": 9.5e10,
+        }
+    )
+    return last_tick
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """
+    Empty in-memory MongoDB used by all readers and writers,
+    with the process-wide caches of mng reset
+    """
+
+    mongo_client = mongomock.MongoClient()
+    monkeypatch.setattr(mng, "_CLIENT", mongo_client)
+    monkeypatch.setattr(mng, "_TICK_BUFFER", TickBuffer())
+    monkeypatch.setattr(mng, "_EPOCH", {"timestamp": None, "checked_at": 0.0})
+    monkeypatch.setattr(mng, "CURRENCY_FACTORS", mng.CurrencyFactorTable())
+    monkeypatch.setattr(mng, "FIRSTPAGE_CONVERTER", mng.FirstPageConverter())
+    return mongo_client
+
+
+@pytest.fixture
+def last_tick(client):
+    """
+    Fill the ratesx database with the synthetic data
+    and return the timestamp of the last tick
+    """
+
+    return fill(client.ratesx, time.time())
@@ -0,0 +1,165 @@
+"""
+The batch aggregation (aggregate.py) against the original per-interval loop.
+"""
+
+import io
+import itertools
+import os
+
+import pytest
+
+import aggregate
+import mng
+from aggregate import (
+    INTERVAL,
+    KEYS,
+    aggregate_bucket,
+    aggregate_chunk,
+    aggregate_entries,
+)
+from baseline import aggregate_loop
+from rollup import update_rollups
+
+INTERVAL_SIZE = INTERVAL["1h"]
+
+
+def hours(entries):
+    return [
+        list(bucket)
+        for _, bucket in itertools.groupby(
+            entries, key=lambda x: x["timestamp"] // INTERVAL_SIZE
+        )
+    ]
+
+
+def coin_entries(client, symbol):
+    return list(
+        client.ratesx.coins.find({"symbol": symbol}, {"_id": 0}).sort(
+            [("timestamp", 1)]
+        )
+    )
+
+
+@pytest.mark.parametrize("symbol", ["BTC", "DOGE"])
+def test_baseline(client, last_tick, symbol):
+    # the original loop does not skip missing values
+    keys = [key for key in KEYS if key != "total_supply"]
+    entries = coin_entries(client, symbol)
+    time_start = entries[0]["timestamp"] - entries[0]["timestamp"] % INTERVAL_SIZE
+
+    expected = [aggregate_loop(x, keys) for x in hours(entries)]
+
+    for result in [
+        aggregate_entries(entries, keys, time_start, INTERVAL_SIZE),
+        [aggregate_bucket(x, keys) for x in hours(entries)],
+    ]:
+        for aggregated in result:
+            for key in keys:
+                del aggregated[key]["sum"]
+                del aggregated[key]["count"]
+        assert result == expected
+
+
+def test_loop_and_kernel(client, last_tick):
+    entries = coin_entries(client, "DOGE")
+    time_start = entries[0]["timestamp"] - entries[0]["timestamp"] % INTERVAL_SIZE
+
+    assert aggregate_chunk(entries, KEYS, time_start, INTERVAL_SIZE) == (
+        aggregate_entries(entries, KEYS, time_start, INTERVAL_SIZE)
+    )
+
+
+def test_currencies_keys(client, last_tick, monkeypatch):
+    monkeypatch.setattr(aggregate, "ROLLUP_CHUNK", 6 * INTERVAL_SIZE)
+    currencies = client.ratesx.currencies
+    time_start = last_tick - last_tick % INTERVAL_SIZE - 12 * INTERVAL_SIZE
+    currencies.update_many(
+        {"timestamp": {"$gt": last_tick - 7200}}, {"$set": {"CHF": 1.1}}
+    )
+
+    aggregate.aggregate_range(None, "1h", time_start, last_tick)
+
+    aggregated = list(client.ratesx.currencies_1h.find().sort([("timestamp", 1)]))
+    raw = list(currencies.find({"timestamp": {"$gte": time_start, "$lte": last_tick}}))
+    assert [x["timestamp"] // INTERVAL_SIZE for x in aggregated] == sorted(
+        {x["timestamp"] // INTERVAL_SIZE for x in raw}
+    )
+    assert [
+        x["timestamp"] // INTERVAL_SIZE for x in aggregated if "CHF" in x
+    ] == sorted({x["timestamp"] // INTERVAL_SIZE for x in raw if "CHF" in x})
+
+
+def test_aggregation_range_is_aligned(client, last_tick):
+    mng.MongoWriter().save_checkpoint("BTC", "1h", last_tick - 3 * 3600 + 300)
+
+    hour = last_tick - last_tick % INTERVAL_SIZE
+
+    time_start, last_timestamp = aggregate.get_aggregation_range("BTC", "1h")
+    aggregate.aggregate_range("BTC", "1h", hour - 6 * INTERVAL_SIZE + 600, last_tick)
+
+    assert time_start % INTERVAL_SIZE == 0
+    assert last_timestamp == last_tick
+    timestamps = [x["timestamp"] for x in client.ratesx.coins_1h.find()]
+    assert len(timestamps) == len({x // INTERVAL_SIZE for x in timestamps}) == 7
+
+
+def test_checkpoints(client, last_tick):
+    writer = mng.MongoWriter()
+    hour = last_tick - last_tick % INTERVAL_SIZE
+    writer.save_checkpoint("BTC", "1h", hour - INTERVAL_SIZE)
+    writer.save_checkpoint("ETH", "1h", hour - 2 * INTERVAL_SIZE)
+    writer.save_checkpoint(None, "1h", hour - 12 * INTERVAL_SIZE)
+
+    update_rollups(list(client.ratesx.coins.find({"timestamp": hour}, {"_id": 0})))
+    aggregate.rollup_currencies(hour - 12 * INTERVAL_SIZE, last_tick + 1)
+
+    reader = mng.MongoReader()
+    assert reader.get_checkpoint("BTC", "1h") == hour
+    # there is a gap, that is left to the batch aggregation
+    assert reader.get_checkpoint("ETH", "1h") == hour - 2 * INTERVAL_SIZE
+    assert reader.get_checkpoint(None, "1h") == hour
+
+
+def _run_shard(shard):
+    if shard[0] == "ETH":
+        os._exit(1)  # pylint: disable=protected-access
+    return {"shard": shard[0], "written": 1, "error": None}
+
+
+def test_runner_worker_dies(monkeypatch):
+    monkeypatch.setattr(aggregate, "_run_shard", _run_shard)
+    runner = aggregate.AggregationRunner(
+        ["BTC", "ETH"], workers=2, output=io.StringIO(), timeout=2
+    )
+    monkeypatch.setattr(
+        runner, "plan", lambda: [("BTC", [("1h", 0, 0)]), ("ETH", [("1h", 0, 0)])]
+    )
+
+    summary = runner.run()
+
+    assert summary["shards"] == 2
+    assert summary["failed"] == 1
+    assert summary["written"] == 1
+
+
+def test_rollup_catches_up_lagging_coin(client, last_tick, monkeypatch):
+    def merge(pipeline, collection_name, source_collection_name=None):
+        # $merge is not supported by mongomock
+        for entry in aggregate.MONGO_READER.aggregate(
+            pipeline, collection_name=source_collection_name
+        ):
+            aggregate.MONGO_WRITER.update(entry, collection_name)
+
+    monkeypatch.setattr(aggregate.MONGO_WRITER, "merge", merge)
+    coins_1h = client.ratesx.coins_1h
+    symbols = ["BTC", "ETH"]
+    aggregate.rollup_new_entries(symbols)
+    expected = coins_1h.count_documents({"symbol": "BTC"})
+    coins_1h.delete_many(
+        {"symbol": "BTC", "timestamp": {"$gte": last_tick - 5 * INTERVAL_SIZE}}
+    )
+
+    aggregate.rollup_new_entries(symbols)
+
+    assert coins_1h.count_documents({"symbol": "BTC"}) == expected
+    assert coins_1h.count_documents({"symbol": "ETH"}) == expected
@@ -0,0 +1,51 @@
+"""
+The in-process ANSI to HTML converter against the output of the script
+it was ported from, captured in tests/data/ansi2html:
+
+    bash share/ansi2html.sh --palette=xterm --bg=dark < NAME.ansi > NAME.html
+
+``firstpage`` and ``btc`` are the first page and a chart page rendered
+from the test data; the other inputs cover the SGR codes (reset, bold,
+256 colors), spans left open across lines, the C0 controls
+and the trailing spaces padding (screen mode), and the HTML escaping.
+"""
+
+import os
+import re
+
+import pytest
+
+import ansi2html
+
+DATA = os.path.join(os.path.dirname(__file__), "data", "ansi2html")
+PAGES = ["firstpage", "btc", "sgr", "open_spans", "padding", "escaping"]
+
+
+def read(name, extension):
+    with open(os.path.join(DATA, f"{name}.{extension}"), encoding="utf-8") as page:
+        return page.read()
+
+
+@pytest.mark.parametrize("name", PAGES)
+def test_same_as_script(name):
+    assert ansi2html.ansi2html(read(name, "ansi")) == read(name, "html")
+
+
+@pytest.mark.parametrize("name", PAGES)
+def test_fast_paths(name, monkeypatch):
+    # every line is normalized with the regular expressions
+    # and goes through the screen tracking
+    monkeypatch.setattr(ansi2html, "_normalize_fast", ansi2html._normalize)
+    monkeypatch.setattr(ansi2html, "_SCREEN_CONTROL", re.compile(""))
+
+    assert ansi2html.ansi2html(read(name, "ansi")) == read(name, "html")
+
+
+def test_streamed():
+    text = read("firstpage", "ansi")
+
+    chunks = list(ansi2html.convert(text.splitlines()))
+
+    assert chunks[0] == ansi2html.HEADER
+    assert chunks[-1] == ansi2html.FOOTER
+    assert "".join(chunks) == read("firstpage", "html")
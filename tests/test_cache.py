@@ -0,0 +1,50 @@
+"""
+The epoch-aware responses cache (ResponseCache).
+"""
+
+import os
+import threading
+
+import gevent
+
+import cache
+
+
+def test_old_epochs_removed_off_request_path(tmp_path, monkeypatch):
+    sweepers = []
+    remove_old_epochs = cache.ResponseCache._remove_old_epochs
+
+    def spy(self, oldest):
+        sweepers.append(threading.get_ident())
+        remove_old_epochs(self, oldest)
+
+    monkeypatch.setattr(cache.ResponseCache, "_remove_old_epochs", spy)
+    response_cache = cache.ResponseCache(str(tmp_path), 1 << 20)
+
+    for epoch in [300, 600, 900]:
+        response_cache.put("btc", epoch, f"answer {epoch}")
+    gevent.get_hub().threadpool.join()
+
+    assert sweepers and threading.get_ident() not in sweepers
+    assert sorted(os.listdir(tmp_path)) == ["600", "900"]
+    assert response_cache.get("btc", 900) == "answer 900"
+    assert response_cache.get_stale("btc", 900, "ansi") == "answer 600"
+
+
+def test_unknown_epoch_not_cached(tmp_path):
+    os.makedirs(tmp_path / "none")
+    response_cache = cache.ResponseCache(str(tmp_path), 1 << 20)
+
+    response_cache.put("btc", None, "answer")
+    response_cache.put_encoded("btc", None, b"answer", "ansi", "gzip")
+
+    assert not response_cache.contains("btc", None)
+    assert response_cache.get("btc", None) is None
+    assert response_cache.get_encoded("btc", None, "ansi", "gzip") is None
+    assert response_cache.stats()["entries"] == 0
+
+    # the directory left by the older versions is removed on the first epochs
+    for epoch in [300, 600]:
+        response_cache.put("btc", epoch, f"answer {epoch}")
+    gevent.get_hub().threadpool.join()
+    assert sorted(os.listdir(tmp_path)) == ["300", "600"]
@@ -0,0 +1,32 @@
+"""
+The shared as-of table of the currency factors (CurrencyFactorTable).
+"""
+
+import time
+
+import pytest
+
+import mng
+from baseline import BaselineReader
+
+
+def test_older_lookup_keeps_newest_price(client, last_tick):
+    now = time.time()
+    client.ratesx.currencies.insert_one({"timestamp": now - 5, "EUR": 1.25})
+    reader = mng.MongoReader({"currency": "EUR"})
+
+    assert reader.currency_factor(timestamp=now) == pytest.approx(1 / 1.25)
+    older = reader.currency_factor(timestamp=last_tick - 24 * 3600)
+    assert reader.currency_factor(timestamp=now) == pytest.approx(1 / 1.25)
+    assert reader.currency_factor(timestamp=last_tick - 24 * 3600) == older
+
+
+@pytest.mark.parametrize("currency", ["EUR", "JPY", "ETH", "DOGE"])
+def test_factors(client, last_tick, currency):
+    reader = mng.MongoReader({"currency": currency})
+    baseline = BaselineReader(client.ratesx, {"currency": currency})
+    timestamps = [last_tick - x * 250 for x in range(0, 36 * 3600 // 250, 7)]
+
+    factors = reader.currency_factors(timestamps)
+
+    assert factors.tolist() == [baseline.currency_factor(x) for x in timestamps]
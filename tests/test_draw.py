@@ -0,0 +1,20 @@
+"""
+The data of the diagrams (draw.get_data), used by the JSON answers.
+"""
+
+import pytest
+
+import draw
+
+
+def test_data(client, last_tick):
+    data = draw.get_data("btc@2h")
+
+    assert data["ticks"]
+    assert data["meta"]["time_end"] <= last_tick
+
+
+@pytest.mark.parametrize("query", ["btc@2019-01-01..2019-01-02", "nosuchcoin"])
+def test_no_data(client, last_tick, query):
+    with pytest.raises(RuntimeError):
+        draw.get_data(query)
@@ -0,0 +1,85 @@
+"""
+The first page (the batched loader, the ticks buffer and the snapshot
+converted into other currencies) against the original query-per-coin reader.
+"""
+
+import pytest
+
+import mng
+from baseline import BaselineReader
+
+CURRENCIES = ["USD", "EUR", "JPY", "ETH"]
+
+
+def config(currency):
+    return {"number_of_coins": 5, "number_of_ticks": 12, "currency": currency}
+
+
+def assert_same_rows(rows, expected):
+    assert [x["code"] for x in rows] == [x["code"] for x in expected]
+    for row, expected_row in zip(rows, expected):
+        for field in ["price", "change_24h", "change_1h", "cap"]:
+            assert row[field] == pytest.approx(expected_row[field], rel=1e-9), (
+                row["code"],
+                field,
+            )
+        assert row["spark"] == pytest.approx(expected_row["spark"], rel=1e-9)
+
+
+@pytest.mark.parametrize("currency", CURRENCIES)
+def test_batched_loader(client, last_tick, currency):
+    reader = mng.MongoReader(config(currency))
+
+    rows = reader.mng_load_coins_data(timestamp=last_tick)
+
+    assert not mng.get_tick_buffer().covers(last_tick)
+    expected = BaselineReader(client.ratesx, config(currency)).mng_load_coins_data()
+    assert_same_rows(rows, expected)
+
+
+@pytest.mark.parametrize("currency", CURRENCIES)
+def test_ticks_buffer(client, last_tick, currency):
+    reader = mng.MongoReader(config(currency))
+
+    rows = reader.mng_load_coins_data()
+
+    assert mng.get_tick_buffer().covers(last_tick)
+    expected = BaselineReader(client.ratesx, config(currency)).mng_load_coins_data()
+    assert_same_rows(rows, expected)
+
+
+@pytest.mark.parametrize("currency", CURRENCIES)
+def test_snapshot(client, last_tick, currency):
+    entries = list(client.ratesx.coins.find({"timestamp": last_tick}))
+    collector = mng.MongoReader({"number_of_coins": len(entries), "currency": "USD"})
+    mng.MongoWriter().update(
+        collector.build_firstpage(last_tick, entries=entries), "firstpage"
+    )
+
+    answer = mng.MongoReader(config(currency)).load_firstpage()
+
+    assert answer is not None
+    baseline = BaselineReader(client.ratesx, config(currency))
+    assert_same_rows(answer["data"], baseline.mng_load_coins_data())
+    assert answer["marketcap_global_data"] == pytest.approx(
+        baseline.mng_load_marketcap_global_data(), rel=1e-9
+    )
+
+
+def test_snapshot_of_previous_epoch(client, last_tick):
+    writer = mng.MongoWriter()
+    previous_tick = last_tick - 300
+    entries = list(client.ratesx.coins.find({"timestamp": previous_tick}))
+    collector = mng.MongoReader({"number_of_coins": len(entries), "currency": "USD"})
+    writer.update(
+        collector.build_firstpage(previous_tick, entries=entries), "firstpage"
+    )
+
+    # the coins of the new tick are written, its snapshot is not yet
+    assert mng.get_epoch() == last_tick
+    reader = mng.MongoReader(config("EUR"))
+    assert reader.load_firstpage() is None
+    assert_same_rows(
+        reader.load_from_mongo(mode="snapshot")["data"],
+        BaselineReader(client.ratesx, config("EUR")).mng_load_coins_data(),
+    )
@@ -0,0 +1,53 @@
+"""
+The lines of the queries log (query_log.parse_line), as counted by the warm-up.
+"""
+
+import collections
+
+import pytest
+
+from query_log import answered_queries, parse_line
+
+
+@pytest.mark.parametrize(
+    "line, expected",
+    [
+        (
+            "2026-10-18 10:00:00.1 1.2.3.4 rate.sx btc curl/7.68.0 200",
+            ("rate.sx", "btc", 200),
+        ),
+        (
+            "2026-10-18 10:00:00.2 1.2.3.4 eur.rate.sx :firstpage Mozilla/5.0 (X11) 429",
+            ("eur.rate.sx", ":firstpage", 429),
+        ),
+        (
+            "2026-10-18 10:00:00.3 1.2.3.4 rate.sx eth@30d curl/7.68.0 503",
+            ("rate.sx", "eth@30d", 503),
+        ),
+        # written before the status was logged
+        (
+            "2026-10-18 10:00:00.4 1.2.3.4 rate.sx eth@30d curl/7.68.0",
+            ("rate.sx", "eth@30d", None),
+        ),
+        ("0.5 rate.sx btc", None),
+    ],
+)
+def test_parse_line(line, expected):
+    assert parse_line(line) == expected
+
+
+def test_flood_of_limited_queries():
+    lines = [
+        f"2026-10-18 10:00:01.{i} 6.6.6.6 rate.sx doge@1y curl/7.68.0 {status}"
+        for i, status in enumerate([429] * 10 + [503] * 10 + [200])
+    ] + [
+        f"2026-10-18 10:00:02.{i} 1.2.3.{i} rate.sx btc curl/7.68.0 200"
+        for i in range(3)
+    ]
+
+    counter = collections.Counter(answered_queries(lines))
+
+    assert counter.most_common() == [
+        (("rate.sx", "btc"), 3),
+        (("rate.sx", "doge@1y"), 1),
+    ]
@@ -0,0 +1,19 @@
+"""
+The per-client rate limits (RateLimiter).
+"""
+
+import pytest
+
+from rate_limit import RateLimiter
+
+
+def test_full_limits_in_every_worker():
+    # the connections of a client are often accepted by the same worker
+    limiter = RateLimiter({"chart": (2, 20)})
+
+    allowed = sum(not limiter.check("1.2.3.4", "chart") for _ in range(25))
+
+    assert allowed == 20
+    assert limiter.check("1.2.3.4", "chart") == pytest.approx(0.5, rel=0.1)
+    assert not limiter.check("5.6.7.8", "chart")
+    assert not limiter.check("1.2.3.4", "hit")
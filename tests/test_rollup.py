@@ -0,0 +1,53 @@
+"""
+The rollups maintained at ingest time (rollup.py) against the batch
+aggregation of the same entries (aggregate.aggregate_entries).
+"""
+
+import itertools
+
+from aggregate import aggregate_entries
+from rollup import INTERVAL, KEYS, fold, update_rollups
+
+
+def test_update_rollups(client, last_tick):
+    coins = client.ratesx.coins
+    interval_size = INTERVAL["1h"]
+    time_start = last_tick - last_tick % interval_size - 6 * interval_size
+    entries = list(
+        coins.find({"timestamp": {"$gte": time_start}}, {"_id": 0}).sort(
+            [("timestamp", 1)]
+        )
+    )
+
+    for _, tick in itertools.groupby(entries, key=lambda x: x["timestamp"]):
+        update_rollups(list(tick))
+
+    buckets = list(client.ratesx.coins_1h.find({}, {"_id": 0}))
+    assert len(buckets) == len(
+        {(x["symbol"], x["timestamp"] // interval_size) for x in entries}
+    )
+    for bucket in buckets:
+        hour = bucket["timestamp"] // interval_size
+        raw = [
+            x
+            for x in entries
+            if x["symbol"] == bucket["symbol"]
+            and x["timestamp"] // interval_size == hour
+        ]
+        expected = aggregate_entries(raw, KEYS)[0]
+        assert bucket == dict(symbol=bucket["symbol"], **expected)
+
+
+def test_missing_values():
+    entries = [
+        {"timestamp": 300 * i, "total_supply": None if i % 2 else float(i)}
+        for i in range(12)
+    ]
+
+    bucket = None
+    for entry in entries:
+        bucket = fold(bucket, entry, ["total_supply"])
+
+    expected = aggregate_entries(entries, ["total_supply"])[0]
+    assert bucket["total_supply"]["avg"] == 5.0
+    assert bucket["total_supply"] == expected["total_supply"]
@@ -0,0 +1,82 @@
+"""
+Requests coalescing (SingleFlight).
+"""
+
+import time
+
+import gevent
+import pytest
+
+from singleflight import SingleFlight, SingleFlightError, SingleFlightTimeout
+
+
+def slow(calls, seconds, result):
+    calls.append(result)
+    gevent.sleep(seconds)
+    return result
+
+
+def test_shared_result():
+    single_flight = SingleFlight(timeout=1)
+    calls = []
+
+    greenlets = [
+        gevent.spawn(single_flight.do, "btc", slow, calls, 0.05, x) for x in range(5)
+    ]
+    gevent.joinall(greenlets, raise_error=True)
+
+    assert calls == [0]
+    assert [x.value for x in greenlets] == [0] * 5
+    assert single_flight.in_flight() == 0
+
+
+def test_slow_leader_not_recomputed():
+    single_flight = SingleFlight(timeout=0.05)
+    calls = []
+
+    leader = gevent.spawn(single_flight.do, "btc", slow, calls, 0.3, "leader")
+    gevent.sleep(0)
+    with pytest.raises(SingleFlightTimeout):
+        single_flight.do("btc", slow, calls, 0, "follower")
+
+    assert calls == ["leader"]
+    assert leader.get() == "leader"
+    assert single_flight.stats()["timeouts"] == 1
+
+
+@pytest.mark.parametrize(
+    "interrupt",
+    [
+        lambda greenlet: greenlet.kill(block=False),
+        lambda greenlet: greenlet.kill(gevent.Timeout(), block=False),
+    ],
+)
+def test_interrupted_leader(interrupt):
+    single_flight = SingleFlight(timeout=5)
+    calls = []
+
+    leader = gevent.spawn(single_flight.do, "btc", slow, calls, 1, "leader")
+    gevent.sleep(0)
+    follower = gevent.spawn(single_flight.do, "btc", slow, calls, 0, "follower")
+    gevent.sleep(0)
+    start = time.monotonic()
+    interrupt(leader)
+    follower.join()
+
+    assert time.monotonic() - start < 1
+    assert isinstance(follower.exception, SingleFlightError)
+    assert calls == ["leader"]
+    assert single_flight.in_flight() == 0
+
+
+def test_exception_shared():
+    single_flight = SingleFlight(timeout=1)
+
+    def fail():
+        gevent.sleep(0.05)
+        raise ValueError("bad query")
+
+    greenlets = [gevent.spawn(single_flight.do, "btc", fail) for _ in range(3)]
+    gevent.joinall(greenlets)
+
+    assert all(isinstance(x.exception, ValueError) for x in greenlets)
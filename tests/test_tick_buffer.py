@@ -0,0 +1,53 @@
+"""
+The in-memory buffer of the latest coins ticks (TickBuffer).
+"""
+
+import time
+
+import tick_buffer
+from tick_buffer import TICK_GRACE, TICK_INTERVAL, TickBuffer
+
+
+def tick(timestamp, symbols):
+    return [
+        {"symbol": symbol, "timestamp": timestamp, "rank": rank, "price_usd": 1.0}
+        for rank, symbol in enumerate(symbols, 1)
+    ]
+
+
+def test_partial_tick_is_read_again(client):
+    coins = client.ratesx.coins
+    now = time.time()
+    last_tick = now - now % TICK_INTERVAL - TICK_INTERVAL
+    coins.insert_many(tick(last_tick - TICK_INTERVAL, ["BTC", "ETH", "XRP"]))
+    buffer = TickBuffer()
+    buffer.refresh(coins)
+
+    # the collector has written only a part of the tick yet
+    entries = tick(last_tick, ["BTC", "ETH", "XRP"])
+    coins.insert_many(entries[:2])
+    buffer._checked_at = 0.0  # pylint: disable=protected-access
+    buffer.refresh(coins)
+    assert buffer.last_timestamp == last_tick - TICK_INTERVAL
+
+    coins.insert_many(entries[2:])
+    buffer._checked_at = 0.0  # pylint: disable=protected-access
+    buffer.refresh(coins)
+    assert buffer.last_timestamp == last_tick
+    assert buffer.value_at("XRP", last_tick) == 1.0
+
+
+def test_smaller_tick_is_accepted_after_grace(client, monkeypatch):
+    coins = client.ratesx.coins
+    now = time.time()
+    last_tick = now - now % TICK_INTERVAL - TICK_INTERVAL
+    coins.insert_many(tick(last_tick - TICK_INTERVAL, ["BTC", "ETH", "XRP"]))
+    coins.insert_many(tick(last_tick, ["BTC", "ETH"]))
+    buffer = TickBuffer()
+    buffer.refresh(coins)
+    assert buffer.last_timestamp == last_tick - TICK_INTERVAL
+
+    monkeypatch.setattr(tick_buffer.time, "time", lambda: now + TICK_GRACE + 1)
+    buffer._checked_at = 0.0  # pylint: disable=protected-access
+    buffer.refresh(coins)
+    assert buffer.last_timestamp == last_tick